@@ -1,11 +1,20 @@
 from pydispix import churches  # noqa: F401: F401
 from pydispix.autodraw import AutoDrawer  # noqa: F401
-from pydispix.canvas import Canvas, Pixel  # noqa: F401
-from pydispix.church import ChurchClient  # noqa: F401
+from pydispix.canvas import Canvas, CanvasCache, CanvasDiff, Pixel  # noqa: F401
+from pydispix.church import ChurchClient, ChurchRunner  # noqa: F401
 from pydispix.client import Client  # noqa: F401
 from pydispix.color import Color, Colour, parse_color, parse_colour  # noqa: F401
+from pydispix.guard import Guard  # noqa: F401
+from pydispix.history import CanvasHistory, CanvasRecorder  # noqa: F401
 from pydispix.log import setup_logging
+from pydispix.metrics import Instrumentation, MetricsRegistry  # noqa: F401
 from pydispix.multiplexing import DistributedAutoDrawer, DistributedClient  # noqa: F401
+from pydispix.partitioners import (  # noqa: F401
+    HilbertPartitioner, ModuloPartitioner, Partitioner, RowBandPartitioner, TilePartitioner
+)
+from pydispix.pool import TokenPool  # noqa: F401
 from pydispix.ratelimits import RateLimitedEndpoint, RateLimiter  # noqa: F401
+from pydispix.shared import CanvasPublisher, SharedCanvas, SharedCanvasCache, SharedCanvasReader  # noqa: F401
+from pydispix.stores import MemoryRateLimitStore, RateLimitStore, SQLiteRateLimitStore  # noqa: F401
 
 setup_logging()
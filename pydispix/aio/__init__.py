@@ -0,0 +1,18 @@
+"""
+Asynchronous versions of the pydispix clients and auto drawers.
+
+These require the optional `httpx` dependency, which can be installed
+with the `async` extra (`pip install pydispix[async]`).
+"""
+try:
+    import httpx  # noqa: F401
+except ImportError:
+    raise ImportError(
+        "The asynchronous pydispix clients require httpx, install it with: pip install pydispix[async]"
+    ) from None
+
+from pydispix.aio.autodraw import AsyncAutoDrawer, AsyncMultiAutoDrawer  # noqa: F401
+from pydispix.aio.church import AsyncChurchClient  # noqa: F401
+from pydispix.aio.churches import AsyncRickChurchClient, AsyncSQLiteChurchClient  # noqa: F401
+from pydispix.aio.client import AsyncClient  # noqa: F401
+from pydispix.aio.guard import AsyncGuard  # noqa: F401
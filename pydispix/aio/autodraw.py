@@ -0,0 +1,130 @@
+"""Tool for automatically drawing images with the asynchronous client."""
+import logging
+from typing import List, Optional, Tuple
+
+import PIL.Image
+
+from pydispix.aio.client import AsyncClient
+from pydispix.aio.guard import AsyncGuard
+from pydispix.autodraw import GridType, _BaseAutoDrawer, _BaseMultiAutoDrawer
+from pydispix.canvas import Canvas
+
+logger = logging.getLogger('pydispix')
+
+
+async def _refresh_canvas(client: AsyncClient, canvas: Canvas, max_age: Optional[float]) -> Canvas:
+    """Re-fetch the canvas if it's too old, or no longer valid, see `pydispix.autodraw._refresh_canvas`."""
+    if canvas.is_valid and (max_age is None or canvas.age < max_age):
+        return canvas
+    logger.debug(f"Canvas is {canvas.age:.1f}s old, re-fetching it.")
+    return await client.get_canvas()
+
+
+class AsyncAutoDrawer(_BaseAutoDrawer):
+    """
+    Tool for automatically drawing images with the asynchronous client.
+
+    Since the dimensions of the canvas can't be fetched from `__init__`,
+    the image size is only checked against the canvas once we start drawing.
+    """
+
+    def __init__(
+        self,
+        client: AsyncClient,
+        x: int, y: int,
+        grid: GridType
+    ):
+        """Store the plan."""
+        super().__init__(x, y, grid)
+        self.client = client
+
+    @classmethod
+    def load_image(
+        cls,
+        client: AsyncClient,
+        xy: Tuple[int, int],
+        image: PIL.Image.Image,
+        scale: float = 1
+    ) -> 'AsyncAutoDrawer':
+        """Draw from the pixels of an image."""
+        grid = cls._grid_from_img(image, scale)
+        return cls(client, *xy, grid)
+
+    async def draw_pixel(self, canvas: Canvas, x: int, y: int, show_progress: bool = True) -> bool:
+        """
+        Draw a pixel if not already drawn.
+
+        Returns True if the pixel was not already drawn.
+        """
+        color = self.target_pixel(x, y)
+        if canvas[x, y] == color:
+            logger.debug(f'Skipping already correct pixel at {x}, {y}.')
+            return False
+        await self.client.put_pixel(x, y, color, show_progress=show_progress)
+        canvas[x, y] = color
+        return True
+
+    async def draw(
+        self,
+        guard: bool = False,
+        guard_delay: int = 5,
+        show_progress: bool = True,
+        canvas_max_age: Optional[float] = 60,
+    ):
+        """Draw the pixels of the image, see `AutoDrawer.draw` for the meaning of the arguments."""
+        canvas = await self.client.get_canvas()
+        self._check_boundaries((canvas.width, canvas.height))
+        for x, y in self._iter_mismatched_coords(canvas):
+            if await self.draw_pixel(canvas, x, y, show_progress=show_progress):
+                canvas = await _refresh_canvas(self.client, canvas, canvas_max_age)
+
+        if guard:
+            await AsyncGuard(self.client, [self], interval=guard_delay).run(show_progress=show_progress)
+
+
+class AsyncMultiAutoDrawer(_BaseMultiAutoDrawer[AsyncAutoDrawer]):
+    """Tool for automatically drawing set of images with the asynchronous client."""
+    def __init__(
+        self,
+        client: AsyncClient,
+        positions: List[Tuple[int, int]],
+        grids: List[GridType],
+        one_by_one: bool = True
+    ):
+        self.client = client
+        drawers = [
+            AsyncAutoDrawer(client, *position, grid)
+            for position, grid in zip(positions, grids)
+        ]
+        super().__init__(drawers, one_by_one)
+
+    @classmethod
+    def load_images(
+        cls,
+        client: AsyncClient,
+        positions: List[Tuple[int, int]],
+        images: List[PIL.Image.Image],
+        scales: Optional[List[int]] = None,
+        one_by_one: bool = True
+    ) -> "AsyncMultiAutoDrawer":
+        """Draw from pixels on the images."""
+        return cls(client, positions, cls._grids_from_images(images, scales), one_by_one)
+
+    async def draw(
+        self,
+        guard: bool = False,
+        guard_delay: int = 5,
+        show_progress: bool = True,
+        canvas_max_age: Optional[float] = 60,
+    ):
+        """Draw the pixels of the images, see `AutoDrawer.draw` for the meaning of the arguments."""
+        canvas = await self.client.get_canvas()
+        for drawer in self.drawers:
+            drawer._check_boundaries((canvas.width, canvas.height))
+
+        for drawer, (x, y) in self.positions_generator(canvas):
+            if await drawer.draw_pixel(canvas, x, y, show_progress=show_progress):
+                canvas = await _refresh_canvas(self.client, canvas, canvas_max_age)
+
+        if guard:
+            await AsyncGuard(self.client, self.drawers, interval=guard_delay).run(show_progress=show_progress)
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import time
+from abc import abstractmethod
+from typing import Optional, Tuple
+
+import httpx
+import requests
+
+from pydispix.aio.client import AsyncClient
+from pydispix.church import ChurchTask
+from pydispix.color import parse_color
+from pydispix.errors import RateLimitBreached, get_response_result
+from pydispix.utils import resolve_url_endpoint
+
+logger = logging.getLogger("pydispix")
+
+
+class AsyncChurchClient(AsyncClient):
+    """Asynchronous version of `ChurchClient`, see it for more details."""
+    def __init__(
+        self,
+        pixel_api_token: str,
+        church_token: str,
+        base_church_url: str,
+        *args,
+        **kwargs
+    ):
+        super().__init__(pixel_api_token, *args, **kwargs)
+
+        if not base_church_url.endswith("/"):
+            base_church_url = base_church_url + "/"
+
+        self.base_church_url = base_church_url
+        self.church_token = church_token
+
+        # See `ChurchClient` for these
+        self._prefetched_task: "Optional[asyncio.Task[Tuple[ChurchTask, float]]]" = None
+        self._task_fetch_time = 1.0
+
+    def resolve_church_endpoint(self, endpoint: str):
+        return resolve_url_endpoint(self.base_church_url, endpoint)
+
+    @abstractmethod
+    async def get_task(self, endpoint: str = "get_task", repeat_delay: int = 2) -> ChurchTask:
+        """
+        Get task from the church, this is an abstract method, you'll need
+        to override this to get it to work with your church's specific API.
+
+        `repeat_delay` is the time we will wait for, if the church currently
+        doesn't have any aviable tasks for us.
+        """
+
+    @abstractmethod
+    async def submit_task(self, church_task: ChurchTask, endpoint: str = "submit_task") -> httpx.Response:
+        """
+        Submit a task to the church, this is an abstract method, you'll need
+        to override this to get it to work with your church's specific API.
+        """
+
+    def _handle_church_task_errors(self, exception: Exception) -> None:
+        """
+        Handle exceptions that might occur while making a church
+        task, since these exception are specific to each church,
+        this method should be overwritten by each church to handle them.
+        """
+        raise exception
+
+    async def _fetch_task(self, repeat_delay: int, delay: float = 0) -> Tuple[ChurchTask, float]:
+        """Get a task from the church after `delay` seconds, along with the monotonic time it was obtained at."""
+        await asyncio.sleep(delay)
+        start = time.monotonic()
+        task = await self.get_task(repeat_delay=repeat_delay)
+        fetched_at = time.monotonic()
+        self._task_fetch_time = 0.75 * self._task_fetch_time + 0.25 * (fetched_at - start)
+        return task, fetched_at
+
+    def _prefetch_task(self, url: str, repeat_delay: int):
+        """Start fetching the next task in the background, see `ChurchClient._prefetch_task`."""
+        delay = max(self.rate_limiter.get_endpoint(url).get_wait_time() - 1.5 * self._task_fetch_time, 0)
+        self._prefetched_task = asyncio.ensure_future(self._fetch_task(repeat_delay, delay))
+
+    async def _cancel_prefetch(self):
+        """Cancel the prefetching of a task, if it's pending, and wait until it's stopped."""
+        prefetched_task, self._prefetched_task = self._prefetched_task, None
+        if prefetched_task is None:
+            return
+        prefetched_task.cancel()
+        # Retrieve the result, so that an error of the prefetch isn't reported as never retrieved
+        await asyncio.gather(prefetched_task, return_exceptions=True)
+
+    async def close(self):
+        """Cancel the prefetching of a task, if it's pending, and close all pooled connections."""
+        await self._cancel_prefetch()
+        await super().close()
+
+    async def _next_task(self, repeat_delay: int, max_age: float) -> ChurchTask:
+        """Get the prefetched task, or a new one, see `ChurchClient._next_task`."""
+        prefetched_task, self._prefetched_task = self._prefetched_task, None
+        if prefetched_task is not None:
+            task, fetched_at = await prefetched_task
+            age = time.monotonic() - fetched_at
+            if age <= max_age:
+                return task
+            logger.warning(f"Prefetched church task is {age:.1f}s old, getting a new one.")
+        task, _ = await self._fetch_task(repeat_delay)
+        return task
+
+    async def run_task(
+        self,
+        submit_endpoint: str = "submit_task",
+        show_progress: bool = False,
+        repeat_delay: int = 2,
+        repeat_on_ratelimit: bool = True,
+        prefetch: bool = False,
+        prefetch_max_age: float = 5,
+    ):
+        """
+        Obtain the Church Task, put new pixel on the canvas and send the `submit_task` request.
+
+        This works the same as `ChurchClient.run_task`.
+        """
+        task = await self._next_task(repeat_delay, prefetch_max_age)
+        logger.info(f"Running church task: {task}")
+
+        # Manual set_pixel, with submit before waiting for rate limits
+        url = self.resolve_endpoint("set_pixel")
+
+        async def submit():
+            try:
+                return await self.submit_task(task, endpoint=submit_endpoint)
+            finally:
+                if prefetch:
+                    self._prefetch_task(url, repeat_delay)
+
+        try:
+            response = await self.make_request(
+                "POST", url,
+                data={
+                    "x": task.x,
+                    "y": task.y,
+                    "rgb": parse_color(task.color)
+                },
+                headers=self.headers,
+                ratelimit_after=True,
+                task_after=submit,
+                show_progress=show_progress
+            )
+        except RateLimitBreached as exc:
+            response_text = get_response_result(exc, "message")
+
+            # See `ChurchClient.run_task` for why this is only repeated once
+            if repeat_on_ratelimit:
+                logger.warning(f"Hit pixels api ratelimit: {response_text}, waiting it out and ignoring this task.")
+                async with self.rate_limiter.lock(url):
+                    await self.rate_limiter.wait(url, show_progress=show_progress)
+                return await self.run_task(
+                    submit_endpoint=submit_endpoint,
+                    show_progress=show_progress,
+                    repeat_delay=repeat_delay,
+                    repeat_on_ratelimit=False,
+                    prefetch=prefetch,
+                    prefetch_max_age=prefetch_max_age,
+                )
+            raise exc
+
+        # Return status of the submit task, or raise the exception that ocurred in it
+        if hasattr(response, "task_exception"):
+            raise response.task_exception  # type: ignore - since we assigned a task, this will be set by make_request
+        return response.task_result  # type: ignore - since we assigned a task, this will be set by make_request
+
+    async def run_tasks(
+        self,
+        submit_endpoint: str = "submit_task",
+        show_progress: bool = False,
+        repeat_delay: int = 2,
+        prefetch: bool = False,
+        prefetch_max_age: float = 5,
+    ):
+        """
+        Continually run church tasks, in case we encounter a known exception, handle it
+        cleanly, but if the exception isn't known, it should still be raised, it's up to
+        the user to handle those, we raise them to make debugging possible.
+        """
+        try:
+            while True:
+                try:
+                    await self.run_task(
+                        submit_endpoint=submit_endpoint,
+                        show_progress=show_progress,
+                        repeat_delay=repeat_delay,
+                        prefetch=prefetch,
+                        prefetch_max_age=prefetch_max_age,
+                    )
+                except Exception as exc:
+                    # If this exception was specific to the church,
+                    # it should be cleanly handled in this function,
+                    # otherwise it should be raised from it.
+                    try:
+                        self._handle_church_task_errors(exc)
+                    except requests.HTTPError as e:
+                        # Handle 500/502s here, same as `ChurchClient.run_tasks`
+                        if e.response.status_code in (500, 502):
+                            logger.exception(f"The Church server is down, waiting {repeat_delay}s", exc_info=e)
+                            await asyncio.sleep(repeat_delay)
+                        else:
+                            raise e
+        finally:
+            # Don't leave the prefetching of the next task running
+            await self._cancel_prefetch()
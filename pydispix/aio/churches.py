@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from pydispix.aio.church import AsyncChurchClient
+from pydispix.canvas import Canvas
+from pydispix.churches import (
+    RICK_CHURCH, RickChurchTask, SQLITE_CHURCH, SQLiteChurchTask, handle_rick_church_error, select_sqlite_church_task
+)
+from pydispix.color import parse_color
+
+logger = logging.getLogger("pydispix")
+
+
+class AsyncRickChurchClient(AsyncChurchClient):
+    """
+    Asynchronous Church Client designed to work specifically with rick church
+
+    The stats are cached the same way as in `RickChurchClient`.
+    """
+
+    def __init__(
+        self,
+        pixel_api_token: str,
+        church_token: str,
+        base_church_url: str = RICK_CHURCH,
+        *args,
+        stats_ttl: float = 60,
+        **kwargs
+    ):
+        super().__init__(pixel_api_token, church_token, base_church_url, *args, **kwargs)
+        self.stats_ttl = stats_ttl
+        self._stats_cache: Dict[str, Tuple[float, Any]] = {}
+
+    async def get_task(self, repeat_delay: int = 2) -> RickChurchTask:
+        url = self.resolve_church_endpoint("get_task")
+        while True:
+            response = (await self.make_request("GET", url, params={"key": self.church_token})).json()
+
+            if response["task"] is None:
+                logger.info(f"Church doesn't currently have any aviable tasks, waiting {repeat_delay}s")
+                await asyncio.sleep(repeat_delay)
+                continue
+            return RickChurchTask(**response["task"])
+
+    async def submit_task(self, church_task: RickChurchTask, endpoint: str = "submit_task") -> httpx.Response:
+        url = self.resolve_church_endpoint(endpoint)
+        body = {
+            'project_title': church_task.project_title,
+            'start': church_task.start,
+            'x': church_task.x,
+            'y': church_task.y,
+            'color': church_task.color
+        }
+        req = await self.make_request("POST", url, data=body, params={"key": self.church_token})
+
+        # See `RickChurchClient.submit_task`
+        try:
+            stats = await self.get_personal_stats()
+        except Exception:
+            logger.warning("Unable to refresh church stats (user/stats)", exc_info=True)
+            logger.info("Task submitted to the church")
+        else:
+            logger.info(f"Task submitted to the church (tasks complete={stats['goodTasks']})")
+        return req
+
+    def _handle_church_task_errors(self, exception: Exception) -> None:
+        """
+        Rick church can raise certain specific errors, handle
+        them here or raise them back, if they shouldn't be handled.
+        """
+        if not handle_rick_church_error(exception, self.base_church_url):
+            return super()._handle_church_task_errors(exception)
+
+    async def _get_stats(self, endpoint: str, params: Optional[dict] = None, max_age: Optional[float] = None) -> Any:
+        """Get the JSON response of a stats endpoint, see `RickChurchClient._get_stats`."""
+        if max_age is None:
+            max_age = self.stats_ttl
+        cached = self._stats_cache.get(endpoint)
+        if cached is not None and time.monotonic() - cached[0] < max_age:
+            return cached[1]
+
+        url = self.resolve_church_endpoint(endpoint)
+        requested_at = time.monotonic()
+        response = (await self.make_request("GET", url, params=params)).json()
+        self._stats_cache[endpoint] = (requested_at, response)
+        return response
+
+    # region: Add some misc endpoints which Church of Rick provides
+
+    async def get_personal_stats(self, max_age: Optional[float] = None):
+        """Get personal stats."""
+        return await self._get_stats("user/stats", {"key": self.church_token}, max_age)
+
+    async def get_church_stats(self, max_age: Optional[float] = None):
+        """Get church stats."""
+        return await self._get_stats("overall_stats", max_age=max_age)
+
+    async def get_leaderboard(self, max_age: Optional[float] = None) -> list:
+        """Get church leaderboard."""
+        return (await self._get_stats("leaderboard", max_age=max_age))["leaderboard"]
+
+    async def get_uptime(self, max_age: Optional[float] = None) -> float:
+        """Uptime of the church of rick."""
+        return float((await self._get_stats("leaderboard", max_age=max_age))["uptime"])
+
+    async def get_projects(self, max_age: Optional[float] = None) -> list:
+        """Get project data from the church."""
+        return await self._get_stats("projects/stats", max_age=max_age)
+
+    # endregion
+
+
+class AsyncSQLiteChurchClient(AsyncChurchClient):
+    """
+    Asynchronous Church Client designed to work specifically with SQLite church
+
+    Tasks are picked the same way as in `SQLiteChurchClient`.
+    """
+
+    def __init__(
+            self,
+            pixel_api_token: str,
+            base_church_url: str = SQLITE_CHURCH,
+            *args,
+            attempt_ttl: float = 60,
+            canvas_max_age: Optional[float] = 10,
+            **kwargs
+    ):
+        # SQLite Church API is open for everyone, it doesn't need a token
+        church_token = ""
+        super().__init__(pixel_api_token, church_token, base_church_url, *args, **kwargs)
+        self.attempt_ttl = attempt_ttl
+        self.canvas_max_age = canvas_max_age
+        self._attempted_tasks: Dict[int, float] = {}
+
+    def _task_canvas(self) -> Optional[Canvas]:
+        """
+        Get a fresh snapshot of the canvas from the canvas cache to check the tasks against, if there is one.
+        The canvas is never downloaded just for this, the check is skipped instead.
+        """
+        if self.canvas_max_age is None or self.canvas_cache is None:
+            return None
+        return self.canvas_cache.peek(self.canvas_max_age)
+
+    async def get_task(self, endpoint: str = "tasks", repeat_delay: int = 2) -> SQLiteChurchTask:
+        url = self.resolve_church_endpoint(endpoint)
+        while True:
+            response = (await self.make_request("GET", url)).json()
+
+            task = None
+            if len(response) != 0:
+                task = select_sqlite_church_task(response, self.token, self._attempted_tasks, self._task_canvas())
+            if task is None:
+                logger.info(f"Church doesn't currently have any aviable tasks ({len(response)} skipped), waiting {repeat_delay}s")
+                await asyncio.sleep(repeat_delay)
+                continue
+
+            self._attempted_tasks[task["id"]] = time.monotonic() + self.attempt_ttl
+            return SQLiteChurchTask(**task)
+
+    async def submit_task(self, church_task: SQLiteChurchTask, endpoint: str = "submit_task") -> httpx.Response:
+        url = self.resolve_church_endpoint(endpoint)
+        body = {"task_id": church_task.id}
+        req = await self.make_request("POST", url, data=body)
+        logger.info("Task submitted to the church")
+        # Keep the cached canvas up to date with our own changes
+        if self.canvas_cache is not None:
+            self.canvas_cache.set_pixel(church_task.x, church_task.y, tuple(bytes.fromhex(parse_color(church_task.color))))
+        return req
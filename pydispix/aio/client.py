@@ -0,0 +1,320 @@
+import asyncio
+import inspect
+import logging
+import os
+import time
+from typing import Any, Callable, Optional
+
+import httpx
+
+from pydispix.canvas import Canvas, CanvasBuffer, CanvasCache, Dimensions, Pixel, ProgressCallback
+from pydispix.client import CANVAS_CHUNK_SIZE, announced_length, handle_response_status
+from pydispix.color import ResolvableColor, parse_color
+from pydispix.errors import CanvasFormatError, RateLimitBreached
+from pydispix.metrics import Instrumentation
+from pydispix.ratelimits import AsyncRateLimiter
+from pydispix.stores import RateLimitStore
+from pydispix.utils import resolve_url_endpoint
+
+logger = logging.getLogger("pydispix")
+
+
+class AsyncClient:
+    """
+    Asynchronous HTTP client to the pixel API.
+
+    This mirrors `Client`, but all of the requests are coroutines, and the rate limits
+    are awaited instead of blocking the whole thread, which allows running many clients
+    (or many tasks sharing one client) on a single event loop.
+
+    Connections are kept alive and reused, with up to `pool_size` connections. Use
+    `close()` or the client as an async context manager to release them once you're done.
+    """
+
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        base_url: str = "https://pixels.pythondiscord.com/",
+        pool_size: int = 10,
+        rate_limit_store: Optional[RateLimitStore] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        canvas_cache: Optional[CanvasCache] = None,
+    ):
+        if token is None:
+            try:
+                token = os.environ["TOKEN"]
+            except KeyError:
+                raise RuntimeError("Unable to load token, 'TOKEN' environmental variable not found.")
+
+        if not base_url.endswith("/"):
+            base_url = base_url + "/"
+
+        self.token = token
+        self.base_url = base_url
+        self.headers = {"Authorization": "Bearer " + token}
+        self.rate_limiter = AsyncRateLimiter(store=rate_limit_store, token=token, instrumentation=instrumentation)
+        self.instrumentation = self.rate_limiter.instrumentation
+        self.pool_size = pool_size
+        self.canvas_cache = canvas_cache
+        self._dimensions: Optional[Dimensions] = None
+        # Created on first use, so that they belong to the running event loop
+        self._canvas_lock: Optional[asyncio.Lock] = None
+        self._dimensions_lock: Optional[asyncio.Lock] = None
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Close all pooled connections."""
+        await self.http_client.aclose()
+
+    async def make_raw_request(
+        self, method: str, url: str, *,
+        data: Optional[dict] = None,
+        params: Optional[dict] = None,
+        headers: Optional[dict] = None,
+        update_rate_limits: bool = True,
+        stream: bool = False,
+    ) -> httpx.Response:
+        """
+        This method is here purely to make an HTTP request and update the rate limiter.
+        Even though this will update the rate limtis, it will not wait for them.
+
+        With `stream`, only the headers of successful responses are received, and the body
+        has to be read (or the response closed) by the caller.
+        """
+        logger.debug(f"Request: {method} on {url} {data=} {params=}.")
+
+        if headers is None:
+            headers = {}
+
+        # Set the user-agent, if not set to something else
+        headers.setdefault("User-Agent", "ItsDrike pydispix")
+
+        token_id = self.rate_limiter.key_prefix
+        self.instrumentation.on_request_start(token_id, method, url)
+        sent_at = time.monotonic()
+        try:
+            request = self.http_client.build_request(
+                method, url,
+                json=data,
+                params=params,
+                headers=headers
+            )
+            response = await self.http_client.send(request, stream=stream)
+        except Exception:
+            self.instrumentation.on_request_end(token_id, method, url, None, time.monotonic() - sent_at)
+            raise
+        # The elapsed time of streamed responses is only known once they're closed
+        rtt = time.monotonic() - sent_at
+        self.instrumentation.on_request_end(token_id, method, url, response.status_code, rtt)
+
+        if update_rate_limits:
+            await self.rate_limiter.run_store(
+                self.rate_limiter.update_from_headers,
+                url, response.headers,
+                sent_at=sent_at, rtt=rtt
+            )
+
+        if response.status_code == 429:
+            logger.debug(f"Request failed (rate limitation): {method} on {url} {data=} {params=}")
+            self.instrumentation.on_rate_limit_breach(token_id, url)
+            # Our local rate limits didn't match the real ones, make sure to obtain them again
+            if update_rate_limits:
+                await self.rate_limiter.run_store(self.rate_limiter.mark_stale, url)
+        if stream and response.status_code != 200:
+            # The errors are handled with the whole body, reading it also releases the connection
+            await response.aread()
+        handle_response_status(response)
+
+        return response
+
+    async def make_request(
+        self, method: str, url: str, *,
+        data: Optional[dict] = None,
+        params: Optional[dict] = None,
+        headers: Optional[dict] = None,
+        ratelimit_after: bool = False,
+        task_after: Optional[Callable[[], Any]] = None,
+        head_ratelimit_update: bool = False,
+        repeat_on_ratelimit: bool = False,
+        show_progress: bool = False,
+        stream: bool = False,
+    ) -> httpx.Response:
+        """
+        This method handles making a request on a rate-limited endpoint.
+
+        The arguments work the same as in `Client.make_request`, except that `task_after`
+        can also be a coroutine function, in which case it's awaited.
+
+        Requests made to the same endpoint are made one by one, each waiting for the
+        rate limits of the previous one, even when they're made from multiple tasks.
+        """
+        if repeat_on_ratelimit and ratelimit_after:
+            raise ValueError(
+                "Can't combine `ratelimit_after` with `repeat_on_ratelimit` (If we breached rate-limit, "
+                "we have to wait it out, and that's impossible to do after a failed request)"
+            )
+
+        async with self.rate_limiter.lock(url):
+            if not ratelimit_after:
+                if head_ratelimit_update and await self.rate_limiter.run_store(self.rate_limiter.needs_update, url):
+                    await self.make_raw_request("HEAD", url, headers=headers, update_rate_limits=True)
+                await self.rate_limiter.wait(url, show_progress=show_progress)
+
+            try:
+                response = await self.make_raw_request(
+                    method, url,
+                    data=data,
+                    params=params,
+                    headers=headers,
+                    update_rate_limits=True,
+                    stream=stream,
+                )
+            except RateLimitBreached as exc:
+                if not repeat_on_ratelimit:
+                    raise exc
+                logger.warning(f"Hit rate limit, repeating request ({exc.response.content})")
+                self.instrumentation.on_retry(self.rate_limiter.key_prefix, url)
+                # The failed request has already updated the rate limits, wait them out
+                # and repeat the request only once, to avoid infinite loops
+                await self.rate_limiter.wait(url, show_progress=show_progress)
+                response = await self.make_raw_request(
+                    method, url,
+                    data=data,
+                    params=params,
+                    headers=headers,
+                    update_rate_limits=True,
+                    stream=stream,
+                )
+
+            if task_after:
+                try:
+                    result = task_after()
+                    if inspect.isawaitable(result):
+                        result = await result
+                except Exception as exc:
+                    response.task_exception = exc  # type: ignore - type is unknown, because it's a new property we're adding
+                else:
+                    response.task_result = result  # type: ignore - type is unknown, because it's a new property we're adding
+
+            if ratelimit_after:
+                await self.rate_limiter.wait(url, show_progress=show_progress)
+
+        return response
+
+    def resolve_endpoint(self, endpoint: str) -> str:
+        """Resolve given `endpoint` to use the base_url"""
+        return resolve_url_endpoint(self.base_url, endpoint)
+
+    async def get_dimensions(self, refresh: bool = False) -> Dimensions:
+        """Get the canvas dimensions, they're only requested once and cached, see `Client.get_dimensions`."""
+        if self._dimensions is not None and not refresh:
+            return self._dimensions
+
+        if self._dimensions_lock is None:
+            self._dimensions_lock = asyncio.Lock()
+        # Tasks waiting for the lock will get the dimensions requested by the task holding it
+        async with self._dimensions_lock:
+            if self._dimensions is None or refresh:
+                url = self.resolve_endpoint("get_size")
+                data = (await self.make_request("GET", url)).json()
+                self._dimensions = Dimensions(width=data["width"], height=data["height"])
+            return self._dimensions
+
+    async def _fetch_canvas(self, show_progress: bool = False, progress: Optional[ProgressCallback] = None, retry: bool = True) -> Canvas:
+        """Download the canvas in chunks, right into a buffer of the size of the cached dimensions, see `Client._fetch_canvas`."""
+        url = self.resolve_endpoint("get_pixels")
+        size = await self.get_dimensions()
+        response = await self.make_request("GET", url, headers=self.headers, show_progress=show_progress, stream=True)
+        try:
+            length = announced_length(response.headers)
+            if length is not None and length != size.width * size.height * 3:
+                logger.info("Fetched canvas doesn't match the cached dimensions, requesting them again.")
+                size = await self.get_dimensions(refresh=True)
+            buffer = CanvasBuffer(size, progress)
+            try:
+                async for chunk in response.aiter_bytes(CANVAS_CHUNK_SIZE):
+                    buffer.feed(chunk)
+                return buffer.finish()
+            except CanvasFormatError:
+                if length is not None or not retry:
+                    raise
+        finally:
+            await response.aclose()
+
+        # The canvas was most likely resized, obtain the new dimensions
+        logger.info("Fetched canvas doesn't match the cached dimensions, requesting them again.")
+        if await self.get_dimensions(refresh=True) == size:
+            raise CanvasFormatError(f"Fetched canvas doesn't match it's dimensions ({size}).")
+        return await self._fetch_canvas(show_progress, progress, retry=False)
+
+    async def get_canvas(
+        self,
+        show_progress: bool = False,
+        max_age: Optional[float] = None,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Canvas:
+        """Fetch the whole canvas and return it in a `Canvas` object, or use the cached one, see `Client.get_canvas`."""
+        if self.canvas_cache is None:
+            return await self._fetch_canvas(show_progress, progress)
+
+        if self._canvas_lock is None:
+            self._canvas_lock = asyncio.Lock()
+        # Tasks waiting for the lock will get the canvas fetched by the task holding it
+        async with self._canvas_lock:
+            canvas = self.canvas_cache.peek(max_age)
+            if canvas is None:
+                canvas = await self._fetch_canvas(show_progress, progress)
+                self.canvas_cache.store(canvas)
+            return canvas
+
+    async def get_pixel(self, x: int, y: int, show_progress: bool = False) -> Pixel:
+        """Fetch rgb data about a specific pixel, this uses the cached canvas, if there's a fresh one."""
+        if self.canvas_cache is not None:
+            canvas = self.canvas_cache.peek()
+            if canvas is not None:
+                return canvas[x, y]
+
+        url = self.resolve_endpoint("get_pixel")
+        response = await self.make_request(
+            "GET", url, params={"x": x, "y": y}, headers=self.headers,
+            show_progress=show_progress
+        )
+        hex_color = response.json()["rgb"]
+        return Pixel.from_hex(hex_color)
+
+    async def put_pixel(
+        self,
+        x: int, y: int,
+        color: ResolvableColor,
+        show_progress: bool = False,
+    ) -> str:
+        """Draw a pixel and return a message."""
+        url = self.resolve_endpoint("set_pixel")
+        response = await self.make_request(
+            "POST", url,
+            data={
+                "x": x,
+                "y": y,
+                "rgb": parse_color(color)
+            },
+            headers=self.headers,
+            head_ratelimit_update=True,
+            show_progress=show_progress,
+        )
+
+        if self.canvas_cache is not None:
+            self.canvas_cache.set_pixel(x, y, tuple(bytes.fromhex(parse_color(color))))
+
+        msg = response.json()["message"]
+        logger.info(f"Success: {msg}")
+        return msg
+
+    set_pixel = put_pixel
@@ -0,0 +1,35 @@
+"""Guarding drawn images with the asynchronous client."""
+import asyncio
+import logging
+from typing import List, Optional, TYPE_CHECKING
+
+from pydispix.aio.client import AsyncClient
+from pydispix.canvas import Canvas
+from pydispix.guard import _BaseGuard
+
+if TYPE_CHECKING:
+    from pydispix.aio.autodraw import AsyncAutoDrawer
+
+logger = logging.getLogger("pydispix")
+
+
+class AsyncGuard(_BaseGuard["AsyncAutoDrawer"]):
+    """Guard, which repairs the damaged pixels with the asynchronous client and drawers, see `Guard`."""
+
+    def __init__(self, client: AsyncClient, drawers: List["AsyncAutoDrawer"], *args, **kwargs):
+        super().__init__(drawers, *args, **kwargs)
+        self.client = client
+
+    async def run(self, canvas: Optional[Canvas] = None, show_progress: bool = True):
+        """Keep repairing the damaged pixels, re-fetching the canvas every `interval` seconds."""
+        if canvas is None:
+            canvas = await self.client.get_canvas()
+        self.update(canvas)
+
+        while True:
+            for drawer, x, y in self._iter_repairs(canvas):
+                await drawer.draw_pixel(canvas, x, y, show_progress=show_progress)
+
+            await asyncio.sleep(self._fetch_delay(canvas))
+            canvas = await self.client.get_canvas(max_age=self.interval)
+            self.update(canvas)
@@ -1,51 +1,91 @@
 """Tool for automatically drawing images."""
 import logging
-import time
-from typing import Iterator, List, Optional, Tuple
+from typing import Generic, Iterator, List, Optional, Tuple, Union
 
 import PIL.Image
+import numpy as np
 
-from pydispix.canvas import Canvas, Pixel
+from pydispix.canvas import Canvas, Pixel, SizeType
 from pydispix.client import Client
 from pydispix.errors import OutOfBoundaries
+from pydispix.guard import DrawerType, Guard
 
 logger = logging.getLogger('pydispix')
 
+# Target image, either as rows of pixels, or as a (height, width, 3) uint8 array
+GridType = Union[List[List[Pixel]], np.ndarray]
 
-class AutoDrawer:
-    """Tool for automatically drawing images."""
 
-    def __init__(
-        self,
-        client: Client,
-        x: int, y: int,
-        grid: List[List[Pixel]]
-    ):
+def _refresh_canvas(client: Client, canvas: Canvas, max_age: Optional[float]) -> Canvas:
+    """
+    Re-fetch the canvas if it's older than `max_age` seconds, or if it's a shared
+    canvas, which is being overwritten, otherwise keep using it.
+    """
+    if canvas.is_valid and (max_age is None or canvas.age < max_age):
+        return canvas
+    logger.debug(f"Canvas is {canvas.age:.1f}s old, re-fetching it.")
+    return client.get_canvas()
+
+
+class _BaseAutoDrawer:
+    """The plan of an image, shared by the regular and the asynchronous auto drawers, see `AutoDrawer`."""
+
+    def __init__(self, x: int, y: int, grid: GridType):
         """Store the plan."""
-        self.client = client
-        self.grid = grid
+        self.target = self._target_from_grid(grid)
         # Top left coords.
         self.x0 = x
         self.y0 = y
         # Bottom right coords.
-        self.x1 = x + len(self.grid[0])
-        self.y1 = y + len(self.grid)
+        self.x1 = x + self.target.shape[1]
+        self.y1 = y + self.target.shape[0]
 
-        # Make sure we're within canvas boundaries
-        canvas_width, canvas_height = canvas_size = self.client.get_dimensions()
-        image_width, image_height = image_size = len(self.grid[0]), len(self.grid)
+    @property
+    def grid(self) -> List[List[Pixel]]:
+        """
+        Get the target pixels as a list of rows.
+
+        This creates a new `Pixel` object for every pixel of the image, prefer
+        `target_pixel` or working with the `target` array directly.
+        """
+        return [[Pixel(*triple) for triple in row] for row in self.target.tolist()]
+
+    def target_pixel(self, x: int, y: int) -> Pixel:
+        """Get the target color of the pixel at given canvas coordinates."""
+        return Pixel(*self.target[y - self.y0, x - self.x0].tolist())
+
+    def _check_boundaries(self, canvas_size: SizeType):
+        """Make sure the image isn't bigger than the canvas."""
+        canvas_width, canvas_height = canvas_size
+        image_height, image_width = self.target.shape[:2]
+        image_size = image_width, image_height
         if image_width > canvas_width or image_height > canvas_height:
             raise OutOfBoundaries(f"Can't draw picture bigger than the canvas ({image_size} > {canvas_size})")
 
+    @staticmethod
+    def _target_from_grid(grid: GridType) -> np.ndarray:
+        """
+        Get the target colors as a (height, width, 3) array, used to find all
+        mismatched pixels at once, instead of comparing them one by one.
+        """
+        if isinstance(grid, np.ndarray):
+            if grid.ndim != 3 or grid.shape[2] != 3:
+                raise ValueError(f"Target array needs to have a (height, width, 3) shape, got {grid.shape}")
+            return grid.astype(np.uint8, copy=False)
+        return np.array([[pixel.triple for pixel in row] for row in grid], dtype=np.uint8)
+
     @staticmethod
     def _grid_from_img(
         image: PIL.Image.Image,
         scale: float = 1
-    ):
+    ) -> np.ndarray:
+        """Get the pixels of given image as a (height, width, 3) uint8 array, sharing the buffer of `Image.tobytes`."""
         if image.mode == 'RGBA':
             new_image = PIL.Image.new('RGB', image.size)
             new_image.paste(image, mask=image)
             image = new_image
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
 
         width = round(image.width * scale)
         height = round(image.height * scale)
@@ -53,12 +93,62 @@ class AutoDrawer:
         if scale != 1:
             image = image.resize((width, height), PIL.Image.BILINEAR)
 
-        data = list(image.getdata())
-        grid = [
-            [Pixel(r, g, b) for r, g, b in data[start:start + width]]
-            for start in range(0, len(data), width)
-        ]
-        return grid
+        return np.frombuffer(image.tobytes(), dtype=np.uint8).reshape(height, width, 3)
+
+    def _iter_coords(self) -> Iterator[Tuple[int, int]]:
+        """Iterate over the coordinates of the image."""
+        for x in range(self.x0, self.x1):
+            for y in range(self.y0, self.y1):
+                yield x, y
+
+    def _mismatch_mask(self, canvas: Canvas) -> np.ndarray:
+        """
+        Compare the target image with the area of the canvas it covers.
+
+        Returns a (height, width) boolean array, which is `True` for every
+        pixel that doesn't yet have the target color.
+        """
+        area = canvas.region(self.x0, self.y0, self.x1, self.y1)
+        return (area != self.target).any(axis=2)
+
+    def _iter_mismatched_coords(self, canvas: Canvas) -> Iterator[Tuple[int, int]]:
+        """
+        Iterate over the coordinates of pixels which don't match the image on given canvas.
+
+        The coordinates are yielded in the same order as from `_iter_coords`.
+        """
+        # Transpose the mask, so that `nonzero` sorts the results by x first, like `_iter_coords`
+        xs, ys = np.nonzero(self._mismatch_mask(canvas).T)
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            yield self.x0 + x, self.y0 + y
+
+    def iter_mismatched_pixels(self, canvas: Canvas) -> Iterator[Tuple[int, int, Pixel]]:
+        """Iterate over the coordinates and target colors of pixels which don't match the image on given canvas."""
+        for x, y in self._iter_mismatched_coords(canvas):
+            yield x, y, self.target_pixel(x, y)
+
+
+class AutoDrawer(_BaseAutoDrawer):
+    """
+    Tool for automatically drawing images.
+
+    The target image is stored as a (height, width, 3) uint8 array, i.e. 3 bytes per pixel,
+    `Pixel` objects are only created for the pixels which are actually being drawn.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        x: int, y: int,
+        grid: GridType
+    ):
+        """Store the plan."""
+        super().__init__(x, y, grid)
+        self.client = client
+
+        # Make sure we're within canvas boundaries
+        self.canvas_size = self.client.get_dimensions()
+        self._check_boundaries(self.canvas_size)
 
     @classmethod
     def load_image(
@@ -72,100 +162,85 @@ class AutoDrawer:
         grid = cls._grid_from_img(image, scale)
         return cls(client, *xy, grid)
 
-    def _iter_coords(self) -> Iterator[Tuple[int, int]]:
-        """Iterate over the coordinates of the image."""
-        for x in range(self.x0, self.x1):
-            for y in range(self.y0, self.y1):
-                yield x, y
-
     def draw_pixel(self, canvas: Canvas, x: int, y: int, show_progress: bool = True) -> bool:
         """
         Draw a pixel if not already drawn.
 
         Returns True if the pixel was not already drawn.
         """
-        color = self.grid[y - self.y0][x - self.x0]
+        color = self.target_pixel(x, y)
         if canvas[x, y] == color:
             logger.debug(f'Skipping already correct pixel at {x}, {y}.')
             return False
         self.client.put_pixel(x, y, color, show_progress=show_progress)
+        # Apply our change to the local canvas, so it doesn't need to be re-fetched
+        canvas[x, y] = color
         return True
 
-    def draw(self, guard: bool = False, guard_delay: int = 5, show_progress: bool = True):
-        """Draw the pixels of the image, attempting each pixel max. once."""
-        canvas = self.client.get_canvas()
-        while True:
-            for x, y in self._iter_coords():
-                if self.draw_pixel(canvas, x, y, show_progress=show_progress):
-                    canvas = self.client.get_canvas()
-
-            if not guard:
-                # Check this here, to act as do-while,
-                # (always run first time, only continue if this is met)
-                break
-            # When we're guarding we need to update canvas even if no pixel was drawn
-            # because otherwise we'd be looping over same non-updated canvas forever
-            # since this looping with no changes takes a long time, we should also sleep
-            # to avoid needless cpu usage
-            time.sleep(guard_delay)
-            canvas = self.client.get_canvas()
-
-
-class MultiAutoDrawer:
-    """Tool for automatically drawing set of images"""
-    def __init__(
+    def draw(
         self,
-        client: Client,
-        positions: List[Tuple[int, int]],
-        grids: List[List[List[Pixel]]],
-        one_by_one: bool = True
+        guard: bool = False,
+        guard_delay: int = 5,
+        show_progress: bool = True,
+        canvas_max_age: Optional[float] = 60,
     ):
-        self.client = client
-        self.drawers = [
-            AutoDrawer(client, *position, grid)
-            for position, grid in zip(positions, grids)
-        ]
+        """
+        Draw the pixels of the image, attempting each pixel max. once.
+
+        Our own changes are applied to the local canvas directly, so it is only
+        re-fetched after a pixel was drawn when it's older than `canvas_max_age`
+        seconds. This catches changes made by others in the meantime, without
+        downloading the whole canvas for every pixel.
+
+        With `guard`, the image is then kept on the canvas by a `Guard`, which repairs
+        the damaged pixels by priority, re-fetching the canvas every `guard_delay`
+        seconds initially, adapting this interval to how often the image is attacked.
+        """
+        canvas = self.client.get_canvas()
+        for x, y in self._iter_mismatched_coords(canvas):
+            if self.draw_pixel(canvas, x, y, show_progress=show_progress):
+                canvas = _refresh_canvas(self.client, canvas, canvas_max_age)
+
+        if guard:
+            Guard(self.client, [self], interval=guard_delay).run(show_progress=show_progress)
+
+
+class _BaseMultiAutoDrawer(Generic[DrawerType]):
+    """The order of drawing a set of images, shared by the regular and the asynchronous multi auto drawers."""
+    def __init__(self, drawers: List[DrawerType], one_by_one: bool = True):
+        self.drawers = drawers
         self.positions_generator = self._one_by_one_positions if one_by_one else self._per_pixel_positions
 
-    @classmethod
-    def load_images(
-        cls,
-        client: Client,
-        positions: List[Tuple[int, int]],
-        images: List[PIL.Image.Image],
-        scales: Optional[List[int]] = None,
-        one_by_one: bool = True
-    ) -> "MultiAutoDrawer":
-        """Draw from pixels on the images."""
+    @staticmethod
+    def _grids_from_images(images: List[PIL.Image.Image], scales: Optional[List[int]] = None) -> List[np.ndarray]:
+        """Get the pixels of given images, see `_BaseAutoDrawer._grid_from_img`."""
         if scales is None:
             # Default all scales to 1
             scales = [1 for _ in images]
 
-        grids = [
-            AutoDrawer._grid_from_img(image, scale)
+        return [
+            _BaseAutoDrawer._grid_from_img(image, scale)
             for image, scale in zip(images, scales)
         ]
 
-        return cls(client, positions, grids, one_by_one)
-
-    def _one_by_one_positions(self) -> Iterator[Tuple[AutoDrawer, Tuple[int, int]]]:
+    def _one_by_one_positions(self, canvas: Canvas) -> Iterator[Tuple[DrawerType, Tuple[int, int]]]:
         """
-        Return iterator of the pixels to check for the passed set of grids (images).
+        Return iterator of the mismatched pixels on given canvas for the passed set of grids (images).
         This will one by one through the individual images. This allows for prioritizing
         certain images over others.
         """
-        coord_generators = [drawer._iter_coords() for drawer in self.drawers]
+        coord_generators = [drawer._iter_mismatched_coords(canvas) for drawer in self.drawers]
         for drawer, coord_generator in zip(self.drawers, coord_generators):
             for x, y in coord_generator:
                 yield drawer, (x, y)
 
-    def _per_pixel_positions(self) -> Iterator[Tuple[AutoDrawer, Tuple[int, int]]]:
+    def _per_pixel_positions(self, canvas: Canvas) -> Iterator[Tuple[DrawerType, Tuple[int, int]]]:
         """
         This is similar to `_one_by_one_positions`, except instead of iterating one by one,
         we are instead iterating through individual pixels, i.e. all 1st pixels from
         all images, all 2nd pixels, etc.
         """
-        coord_generators = [drawer._iter_coords() for drawer in self.drawers]
+        coord_generators = [drawer._iter_mismatched_coords(canvas) for drawer in self.drawers]
 
         # Keep track of which drawers are already depleted
         depleted = {drawer: False for drawer in self.drawers}
@@ -181,25 +256,56 @@ class MultiAutoDrawer:
                     continue
                 yield drawer, (x, y)
 
+    def iter_mismatched_pixels(self, canvas: Canvas) -> Iterator[Tuple[int, int, Pixel]]:
+        """Iterate over the coordinates and target colors of pixels which don't match the images on given canvas."""
+        for drawer, (x, y) in self.positions_generator(canvas):
+            yield x, y, drawer.target_pixel(x, y)
+
+
+class MultiAutoDrawer(_BaseMultiAutoDrawer[AutoDrawer]):
+    """Tool for automatically drawing set of images"""
+    def __init__(
+        self,
+        client: Client,
+        positions: List[Tuple[int, int]],
+        grids: List[GridType],
+        one_by_one: bool = True
+    ):
+        self.client = client
+        drawers = [
+            AutoDrawer(client, *position, grid)
+            for position, grid in zip(positions, grids)
+        ]
+        super().__init__(drawers, one_by_one)
+
+    @classmethod
+    def load_images(
+        cls,
+        client: Client,
+        positions: List[Tuple[int, int]],
+        images: List[PIL.Image.Image],
+        scales: Optional[List[int]] = None,
+        one_by_one: bool = True
+    ) -> "MultiAutoDrawer":
+        """Draw from pixels on the images."""
+        return cls(client, positions, cls._grids_from_images(images, scales), one_by_one)
+
     def draw(
         self,
         guard: bool = False,
         guard_delay: int = 5,
         show_progress: bool = True,
+        canvas_max_age: Optional[float] = 60,
     ):
+        """
+        Draw the pixels of the images, see `AutoDrawer.draw` for the meaning of the arguments.
+
+        When guarding, the images are prioritized in the order they were passed in.
+        """
         canvas = self.client.get_canvas()
+        for drawer, (x, y) in self.positions_generator(canvas):
+            if drawer.draw_pixel(canvas, x, y, show_progress=show_progress):
+                canvas = _refresh_canvas(self.client, canvas, canvas_max_age)
 
-        while True:
-            for drawer, (x, y) in self.positions_generator():
-                if drawer.draw_pixel(canvas, x, y, show_progress=show_progress):
-                    canvas = self.client.get_canvas()
-            if not guard:
-                # Check this here, to act as do-while,
-                # (always run first time, only continue if this is met)
-                break
-            # When we're guarding we need to update canvas even if no pixel was drawn
-            # because otherwise we'd be looping over same non-updated canvas forever
-            # since this looping with no changes takes a long time, we should also sleep
-            # to avoid needless cpu usage
-            time.sleep(guard_delay)
-            canvas = self.client.get_canvas()
+        if guard:
+            Guard(self.client, self.drawers, interval=guard_delay).run(show_progress=show_progress)
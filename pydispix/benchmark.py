@@ -0,0 +1,255 @@
+"""
+Benchmarks of parsing the canvas, guarding, setting up drawers and drawing throughput.
+
+All of the requests are made against a local `PixelsEmulator`, so the results only depend on
+the machine and the version of pydispix. The results are written as JSON, and can be compared
+with the results of another version:
+
+    python -m pydispix.benchmark --output new.json --compare old.json
+"""
+import argparse
+import json
+import logging
+import math
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from functools import partial
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import PIL.Image
+import numpy as np
+
+from pydispix.autodraw import AutoDrawer, MultiAutoDrawer
+from pydispix.canvas import Canvas, Dimensions
+from pydispix.client import Client
+from pydispix.color import parse_color
+from pydispix.emulator import EndpointLimits, PixelsEmulator
+from pydispix.guard import Guard
+
+logger = logging.getLogger("pydispix")
+
+DEFAULT_SIZES = [(160, 90), (640, 360), (1920, 1080)]
+QUICK_SIZES = [(160, 90), (320, 180)]
+
+
+class _TimedClient(Client):
+    """Client which measures the time spent in the HTTP requests, so the idle time can be told apart."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.request_time = 0.0
+        self.requests = 0
+
+    def make_raw_request(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().make_raw_request(*args, **kwargs)
+        finally:
+            self.request_time += time.perf_counter() - start
+            self.requests += 1
+
+
+def _measure(function: Callable[[], object], repeats: int) -> Dict[str, float]:
+    """Run `function` `repeats` times, return the median and the minimal duration in seconds."""
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return {"median_seconds": statistics.median(durations), "min_seconds": min(durations)}
+
+
+def _peak_memory(function: Callable[[], object]) -> int:
+    """Get the peak of memory (in bytes) allocated while running `function`."""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _exhaust(function: Callable[..., Iterator], *args) -> int:
+    """Go through the whole iterator returned by `function`, return the number of it's items."""
+    return sum(1 for _ in function(*args))
+
+
+def _random_image(width: int, height: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def bench_canvas_parse(sizes: List[Tuple[int, int]], repeats: int) -> List[dict]:
+    """Parsing of the `get_pixels` data into a `Canvas`, and reading of all of it's pixels."""
+    results = []
+    for width, height in sizes:
+        size = Dimensions(width=width, height=height)
+        data = _random_image(width, height).tobytes()
+        canvas = Canvas(size, data)
+        results.append({
+            "name": "canvas_parse",
+            "params": {"width": width, "height": height},
+            **_measure(partial(Canvas, size, data), repeats),
+            "peak_memory_bytes": _peak_memory(partial(Canvas, size, data)),
+            "as_array_seconds": _measure(canvas.as_array, repeats)["median_seconds"],
+        })
+    return results
+
+
+def bench_parse_color(repeats: int, count: int = 100_000) -> List[dict]:
+    """Throughput of `parse_color` with all of the supported formats."""
+    values = ["#ff00aa", "00FF00", "blurple", 0x123456, (1, 2, 3)] * (count // 5)
+    result = _measure(lambda: [parse_color(value) for value in values], repeats)
+    return [{
+        "name": "parse_color",
+        "params": {"count": len(values)},
+        **result,
+        "colors_per_second": len(values) / result["median_seconds"],
+    }]
+
+
+def bench_guard_scan(client: Client, sizes: List[Tuple[int, int]], repeats: int) -> List[dict]:
+    """
+    Full guard pass over an image covering the whole canvas, with 1% of it's pixels damaged,
+    and a full scan of the mismatched pixels of the drawer.
+    """
+    results = []
+    for width, height in sizes:
+        target = _random_image(width, height)
+        damaged = target.copy()
+        mask = np.random.default_rng(1).random((height, width)) < 0.01
+        damaged[mask] = 255 - damaged[mask]
+        canvas = Canvas(Dimensions(width=width, height=height), damaged.tobytes())
+
+        drawer = AutoDrawer(client, 0, 0, target)
+        guard = Guard(client, [drawer])
+        guard.update(canvas)
+
+        results.append({
+            "name": "guard_scan",
+            "params": {"width": width, "height": height, "damaged": int(mask.sum())},
+            **_measure(partial(guard.update, canvas), repeats),
+            "mismatch_scan_seconds": _measure(partial(_exhaust, drawer._iter_mismatched_coords, canvas), repeats)["median_seconds"],
+        })
+    return results
+
+
+def bench_multi_setup(client: Client, repeats: int, images: int = 10, size: int = 64) -> List[dict]:
+    """Setting up a `MultiAutoDrawer` from multiple images, including their conversion."""
+    loaded = [PIL.Image.fromarray(_random_image(size, size, seed)) for seed in range(images)]
+    positions = [(index * 2, index) for index in range(images)]
+    result = _measure(lambda: MultiAutoDrawer.load_images(client, positions, loaded), repeats)
+    return [{"name": "multi_autodrawer_setup", "params": {"images": images, "size": size}, **result}]
+
+
+def bench_draw_throughput(pixels: int, limit: int, period: float, latency: float, seed: int = 0) -> List[dict]:
+    """
+    Drawing of (at least) `pixels` pixels under the `set_pixel` rate limit of `limit` requests
+    per `period` seconds, compared with the theoretical maximum, allowed by that rate limit.
+    """
+    limits = {"set_pixel": EndpointLimits(limit, period), "get_pixels": None, "get_size": None}
+    width = min(pixels, 100)
+    height = math.ceil(pixels / width)
+    with PixelsEmulator(width, height, limits=limits, latency=latency, seed=seed) as emulator:
+        client = _TimedClient("benchmark", emulator.url)
+        drawer = AutoDrawer(client, 0, 0, _random_image(width, height, seed))
+        drawn = int(drawer._mismatch_mask(emulator.get_canvas()).sum())
+
+        start = time.perf_counter()
+        drawer.draw(show_progress=False)
+        elapsed = time.perf_counter() - start
+        client.close()
+
+    # The first window of requests can be used right away
+    theoretical = max(math.ceil(drawn / limit) - 1, 0) * period
+    return [{
+        "name": "draw_throughput",
+        "params": {"pixels": drawn, "limit": limit, "period": period, "latency": latency},
+        "elapsed_seconds": elapsed,
+        "theoretical_seconds": theoretical,
+        "overhead_seconds": elapsed - theoretical,
+        "efficiency": theoretical / elapsed,
+        "request_seconds": client.request_time,
+        "idle_seconds": elapsed - client.request_time,
+        "requests": client.requests,
+        "pixels_per_minute": drawn / elapsed * 60,
+        "theoretical_pixels_per_minute": limit / period * 60,
+    }]
+
+
+def run(sizes: List[Tuple[int, int]], repeats: int, draw_pixels: int, draw_period: float, latency: float) -> dict:
+    """Run all of the benchmarks and return the results."""
+    results: List[dict] = []
+    results += bench_canvas_parse(sizes, repeats)
+    results += bench_parse_color(repeats)
+
+    with PixelsEmulator(max(w for w, _ in sizes), max(h for _, h in sizes), limits={"get_size": None}) as emulator:
+        client = Client("benchmark", emulator.url)
+        results += bench_guard_scan(client, sizes, repeats)
+        results += bench_multi_setup(client, repeats)
+        client.close()
+
+    results += bench_draw_throughput(draw_pixels, 1, draw_period, latency)
+    results += bench_draw_throughput(draw_pixels, 5, draw_period * 5, latency)
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "timestamp": time.time(),
+        "results": results,
+    }
+
+
+def compare(new: dict, old: dict) -> List[str]:
+    """Get lines describing the changes of the durations between two benchmark results."""
+    old_results = {(result["name"], json.dumps(result["params"], sort_keys=True)): result for result in old["results"]}
+    lines = []
+    for result in new["results"]:
+        previous = old_results.get((result["name"], json.dumps(result["params"], sort_keys=True)))
+        if previous is None:
+            continue
+        for key, value in result.items():
+            if key.endswith("_seconds") and previous.get(key):
+                lines.append(f"{result['name']} {result['params']} {key}: {previous[key]:.6f} -> {value:.6f} ({value / previous[key]:.2f}x)")
+    return lines
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark pydispix against a local emulator of the pixels API.")
+    parser.add_argument("--output", help="Write the results as JSON to this file, instead of the standard output")
+    parser.add_argument("--compare", help="Compare the results with results from this file")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="Only use small canvas sizes and few pixels")
+    parser.add_argument("--draw-pixels", type=int, default=40)
+    parser.add_argument("--draw-period", type=float, default=0.25, help="Period of the set_pixel rate limit")
+    parser.add_argument("--latency", type=float, default=0.002, help="Latency of the emulator")
+    args = parser.parse_args(argv)
+    # Don't flood the output with the messages of every drawn pixel
+    logger.setLevel(logging.WARNING)
+
+    results = run(
+        QUICK_SIZES if args.quick else DEFAULT_SIZES,
+        args.repeats,
+        10 if args.quick else args.draw_pixels,
+        args.draw_period,
+        args.latency,
+    )
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as file:
+            for line in compare(results, json.load(file)):
+                print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
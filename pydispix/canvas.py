@@ -1,14 +1,19 @@
 
+import threading
+import time
 from collections import namedtuple
-from typing import Tuple, Union
+from typing import Callable, Iterator, List, Optional, Tuple, Union
 
 import PIL.Image
 import matplotlib.pyplot as plt
+import numpy as np
 
 from pydispix.errors import CanvasFormatError
 
 Dimensions = namedtuple("Dimensions", ("width", "height"))
 SizeType = Union[Dimensions, Tuple[int, int]]
+# Called with the number of received bytes and the total number of bytes of a downloaded canvas
+ProgressCallback = Callable[[int, int], None]
 
 
 class Pixel:
@@ -57,10 +62,20 @@ class Pixel:
 
 
 class Canvas:
-    """container for all the pixels on a canvas."""
+    """
+    Container for all the pixels on a canvas.
+
+    The raw RGB bytes are the only thing stored, `Pixel` objects are only
+    created when they're requested, and the PIL image is only built once
+    it's first accessed.
+
+    The canvas can also be modified locally (`canvas[x, y] = pixel`), which
+    is useful for keeping a fetched snapshot up to date with our own changes,
+    without having to download the whole canvas again.
+    """
 
     def __init__(self, size: SizeType, data: bytes):
-        """Parse the raw canvas data."""
+        """Store the raw canvas data, making sure it matches given size."""
         self.width, self.height = size
 
         expected_length = self.width * self.height * 3
@@ -68,35 +83,107 @@ class Canvas:
         if expected_length != actual_length:
             raise CanvasFormatError(f"Incorrect size ({size}), expected {expected_length} bytes, got {actual_length} bytes")
 
-        pixels = [
-            Pixel(*data[start_idx:start_idx + 3])
-            for start_idx in range(0, len(data), 3)
-        ]
-
-        self.grid = [
-            pixels[row * self.width:(row + 1) * self.width]
-            for row in range(self.height)
-        ]
         self.raw = data
-        self.image = PIL.Image.frombytes('RGB', (self.width, self.height), data)
+        self._image = None
+        self._grid: Optional[List[List[Pixel]]] = None
+        # Time of the snapshot, used to determine how outdated it is
+        self.timestamp = time.monotonic()
+
+    @property
+    def age(self) -> float:
+        """Get the number of seconds since this canvas was created."""
+        return time.monotonic() - self.timestamp
+
+    @property
+    def is_valid(self) -> bool:
+        """Check whether the data of the canvas can still be read, which is always the case, unless they're shared."""
+        return True
+
+    def _index(self, xy: SizeType) -> int:
+        """Get the index of the pixel at given coordinates, negative coordinates count from the end, like in `grid`."""
+        x, y = xy
+        if not (-self.width <= x < self.width and -self.height <= y < self.height):
+            raise IndexError(f"Pixel ({x}, {y}) is outside of the canvas ({self.width}x{self.height})")
+        return (y % self.height) * self.width + x % self.width
+
+    def _changed(self):
+        """Drop the image and the grid built from the previous data, after the canvas was modified locally."""
+        self._image = None
+        self._grid = None
+
+    def _pixel_at(self, index: int) -> Pixel:
+        """Get a pixel from the n-th RGB triple in the raw data."""
+        start_idx = index * 3
+        return Pixel(self.raw[start_idx], self.raw[start_idx + 1], self.raw[start_idx + 2])
+
+    @property
+    def grid(self) -> List[List[Pixel]]:
+        """
+        Get the pixels as a list of rows.
+
+        On first access, this creates a `Pixel` object for every pixel on the canvas, which
+        is quite slow, prefer indexing the canvas directly when possible. The grid is then
+        kept, until the canvas is modified locally.
+        """
+        if self._grid is None:
+            self._grid = [
+                [self._pixel_at(row * self.width + column) for column in range(self.width)]
+                for row in range(self.height)
+            ]
+        return self._grid
+
+    @property
+    def image(self) -> PIL.Image.Image:
+        """Get the canvas as a PIL image, it's only created on first access."""
+        if self._image is None:
+            self._image = PIL.Image.frombytes('RGB', (self.width, self.height), self.raw)
+        return self._image
+
+    def as_array(self) -> np.ndarray:
+        """
+        Get the canvas as a (height, width, 3) uint8 numpy array.
+
+        The array is a view into `raw`, no data is copied, and it's always read-only,
+        modify the canvas with `canvas[x, y] = pixel` instead. If `raw` is immutable `bytes`,
+        the first local modification of the canvas replaces it with a mutable copy,
+        so arrays obtained before that won't see it.
+        """
+        array = np.frombuffer(self.raw, dtype=np.uint8).reshape(self.height, self.width, 3)
+        array.flags.writeable = False
+        return array
+
+    def region(self, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+        """Get the part of the canvas between the top left (`x0`, `y0`) and bottom right (`x1`, `y1`) coords, see `as_array`."""
+        return self.as_array()[y0:y1, x0:x1]
 
     def __getitem__(self, xy: SizeType):
         """Get a pixel by coordinates."""
-        x, y = xy
-        return self.grid[y][x]
+        return self._pixel_at(self._index(xy))
+
+    def __setitem__(self, xy: SizeType, pixel: Union[Pixel, Tuple[int, int, int]]):
+        """Change a pixel by coordinates, this only affects this local canvas."""
+        index = self._index(xy)
+        if isinstance(pixel, Pixel):
+            pixel = pixel.triple
+
+        # Only copy the data once we actually need to modify it
+        if not isinstance(self.raw, bytearray):
+            self.raw = bytearray(self.raw)
+
+        start_idx = index * 3
+        self.raw[start_idx:start_idx + 3] = bytes(pixel)
+        self._changed()
 
     def __iter__(self) -> "Canvas":
         self.iter_pixel = 0
         return self
 
     def __next__(self) -> Pixel:
-        y = self.iter_pixel // self.width
-        x = self.iter_pixel % self.width
-        self.iter_pixel += 1
-        try:
-            return self.grid[y][x]
-        except IndexError:
+        if self.iter_pixel >= self.width * self.height:
             raise StopIteration
+        pixel = self._pixel_at(self.iter_pixel)
+        self.iter_pixel += 1
+        return pixel
 
     def show(self):
         """Display the image with matplotlib."""
@@ -110,3 +197,144 @@ class Canvas:
     def save(self, path: str):
         """Save the image to a given file."""
         self.image.save(path)
+
+    def diff(self, other: "Canvas") -> "CanvasDiff":
+        """Get the pixels which differ on the `other` (newer) canvas, with their colors on both canvases."""
+        if (self.width, self.height) != (other.width, other.height):
+            raise ValueError(f"Can't compare canvases of different sizes ({self.width}x{self.height} and {other.width}x{other.height})")
+        old = self.as_array().reshape(-1, 3)
+        new = other.as_array().reshape(-1, 3)
+        indices = np.flatnonzero((old != new).any(axis=1))
+        return CanvasDiff((self.width, self.height), indices, old[indices], new[indices])
+
+
+class CanvasDiff:
+    """
+    Pixels changed between two canvases of given size, stored as numpy arrays, rather than as `Pixel` objects.
+
+    `indices` are the positions of the changed pixels on the canvas (`y * width + x`), with
+    their coordinates in `x` and `y`, and `old` and `new` are (n, 3) arrays of their RGB colors.
+    Iterating over the diff yields `(x, y, old_pixel, new_pixel)` tuples.
+    """
+
+    def __init__(self, size: SizeType, indices: np.ndarray, old: np.ndarray, new: np.ndarray):
+        self.width, self.height = size
+        self.indices = indices
+        self.old = old
+        self.new = new
+
+    @property
+    def x(self) -> np.ndarray:
+        return self.indices % self.width
+
+    @property
+    def y(self) -> np.ndarray:
+        return self.indices // self.width
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __iter__(self) -> Iterator[Tuple[int, int, Pixel, Pixel]]:
+        for index, old, new in zip(self.indices.tolist(), self.old.tolist(), self.new.tolist()):
+            yield index % self.width, index // self.width, Pixel(*old), Pixel(*new)
+
+    def __repr__(self):
+        return f"<CanvasDiff(changed={len(self)})>"
+
+    def apply(self, canvas: Canvas):
+        """Apply the new colors of the changed pixels to given canvas."""
+        if (canvas.width, canvas.height) != (self.width, self.height):
+            raise ValueError(
+                f"Can't apply the diff to a canvas of a different size ({canvas.width}x{canvas.height}, expected {self.width}x{self.height})"
+            )
+        # Only copy the data once we actually need to modify it
+        if not isinstance(canvas.raw, bytearray):
+            canvas.raw = bytearray(canvas.raw)
+        np.frombuffer(canvas.raw, dtype=np.uint8).reshape(-1, 3)[self.indices] = self.new
+        canvas._changed()
+
+
+class CanvasBuffer:
+    """
+    Buffer for a canvas of given size, which is being downloaded.
+
+    The received chunks are copied right into a buffer preallocated for the whole canvas, so the
+    canvas data are only held once, and their length is validated as they arrive. Once all of them
+    are received, `finish` returns the canvas, which uses the buffer as it's (mutable) raw data.
+    """
+
+    def __init__(self, size: SizeType, progress: Optional[ProgressCallback] = None):
+        self.size = Dimensions(*size)
+        self.length = self.size.width * self.size.height * 3
+        self.received = 0
+        self.progress = progress
+        self.data = bytearray(self.length)
+        self._view = memoryview(self.data)
+
+    def feed(self, chunk: bytes):
+        """Copy the next received chunk into the buffer."""
+        end = self.received + len(chunk)
+        if end > self.length:
+            raise CanvasFormatError(f"Incorrect size ({self.size}), expected {self.length} bytes, got at least {end} bytes")
+        self._view[self.received:end] = chunk
+        self.received = end
+        if self.progress is not None:
+            self.progress(self.received, self.length)
+
+    def finish(self) -> Canvas:
+        """Get the received canvas, making sure all of it was received."""
+        if self.received != self.length:
+            raise CanvasFormatError(f"Incorrect size ({self.size}), expected {self.length} bytes, got {self.received} bytes")
+        self._view.release()
+        return Canvas(self.size, self.data)
+
+
+class CanvasCache:
+    """
+    Snapshot of the canvas, shared by clients, so that they don't all download it separately.
+
+    A client with a cache returns the cached canvas from `get_canvas` while it's younger than
+    `max_age` seconds, and answers `get_pixel` from it too. Pixels drawn by the clients are
+    applied to the cached canvas, so it stays up to date with our own changes. A single cache
+    can be shared by multiple clients (i.e. the clients of drawers and churches in one process).
+
+    Since the cached canvas is shared, modifying it (`canvas[x, y] = pixel`) affects all of
+    the clients using the cache, which is what the drawers want, as they only apply the pixels
+    they've drawn.
+    """
+
+    def __init__(self, max_age: float = 5):
+        self.max_age = max_age
+        self.canvas: Optional[Canvas] = None
+        self._lock = threading.Lock()
+
+    def peek(self, max_age: Optional[float] = None) -> Optional[Canvas]:
+        """Get the cached canvas, if there is one, which isn't older than `max_age` (by default, the max age of the cache)."""
+        canvas = self.canvas
+        if canvas is None or canvas.age > (self.max_age if max_age is None else max_age):
+            return None
+        return canvas
+
+    def get(self, fetch: Callable[[], Canvas], max_age: Optional[float] = None) -> Canvas:
+        """
+        Get the cached canvas, if it's fresh enough, otherwise fetch a new one with `fetch`.
+        Concurrent callers wait for a single fetch, instead of each making their own.
+        """
+        with self._lock:
+            canvas = self.peek(max_age)
+            if canvas is None:
+                canvas = self.canvas = fetch()
+            return canvas
+
+    def store(self, canvas: Canvas):
+        """Replace the cached canvas with a newly fetched one."""
+        self.canvas = canvas
+
+    def set_pixel(self, x: int, y: int, pixel: Union[Pixel, Tuple[int, int, int]]):
+        """Apply a drawn pixel to the cached canvas."""
+        if self.canvas is not None:
+            self.canvas[x, y] = pixel
+
+    def invalidate(self):
+        """Drop the cached canvas, so the next request fetches a new one."""
+        self.canvas = None
@@ -1,15 +1,21 @@
 import logging
+import queue
+import threading
 import time
 from abc import abstractmethod
+from collections import Counter
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass
-from functools import partial
-from typing import Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 import requests
 
 from pydispix.client import Client
 from pydispix.color import Color, parse_color
 from pydispix.errors import RateLimitBreached, get_response_result
+from pydispix.metrics import Instrumentation
+from pydispix.pool import TokenWorkers
+from pydispix.stores import RateLimitStore
 from pydispix.utils import resolve_url_endpoint
 
 logger = logging.getLogger("pydispix")
@@ -39,6 +45,22 @@ class ChurchClient(Client):
         self.base_church_url = base_church_url
         self.church_token = church_token
 
+        # Next task, fetched in the background while waiting out the pixels API rate limits,
+        # along with the monotonic time it was fetched at, see `run_tasks`
+        self._prefetched_task: "Optional[Future[Tuple[ChurchTask, float]]]" = None
+        self._task_fetch_time = 1.0  # Smoothed duration of obtaining a task from the church
+        # The prefetching runs on a single thread, so there's never more than one prefetch running
+        self._prefetch_executor: Optional[ThreadPoolExecutor] = None
+        self._prefetch_cancelled = threading.Event()
+
+    def close(self):
+        """Cancel the prefetching of a task, if it's pending, and close all pooled connections."""
+        self._cancel_prefetch()
+        if self._prefetch_executor is not None:
+            self._prefetch_executor.shutdown()
+            self._prefetch_executor = None
+        super().close()
+
     def resolve_church_endpoint(self, endpoint: str):
         return resolve_url_endpoint(self.base_church_url, endpoint)
 
@@ -67,12 +89,67 @@ class ChurchClient(Client):
         """
         raise exception
 
+    def _fetch_task(self, repeat_delay: int) -> Tuple[ChurchTask, float]:
+        """Get a task from the church, along with the monotonic time it was obtained at."""
+        start = time.monotonic()
+        task = self.get_task(repeat_delay=repeat_delay)
+        fetched_at = time.monotonic()
+        self._task_fetch_time = 0.75 * self._task_fetch_time + 0.25 * (fetched_at - start)
+        return task, fetched_at
+
+    def _prefetch_task(self, url: str, repeat_delay: int):
+        """
+        Start fetching the next task in the background, timed to be obtained just before
+        the rate limits of `url` are over, so that it's as fresh as possible once it's used.
+
+        This is only started once the task was submitted, and `_next_task` waits for it, so the
+        church requests of the prefetch never overlap with the other requests of the client,
+        which is only waiting out the rate limits in the meantime.
+        """
+        delay = max(self.rate_limiter.get_endpoint(url).get_wait_time() - 1.5 * self._task_fetch_time, 0)
+        if self._prefetch_executor is None:
+            self._prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pydispix-prefetch")
+        self._prefetch_cancelled.clear()
+
+        def prefetch() -> Tuple[ChurchTask, float]:
+            if self._prefetch_cancelled.wait(delay):
+                raise CancelledError
+            return self._fetch_task(repeat_delay)
+
+        self._prefetched_task = self._prefetch_executor.submit(prefetch)
+
+    def _cancel_prefetch(self):
+        """Cancel the prefetching of a task, if it's pending, and wait until it's stopped."""
+        future, self._prefetched_task = self._prefetched_task, None
+        if future is None:
+            return
+        self._prefetch_cancelled.set()
+        future.cancel()
+        wait([future])
+
+    def _next_task(self, repeat_delay: int, max_age: float) -> ChurchTask:
+        """
+        Get the prefetched task, if there is one, and it isn't older than `max_age` seconds,
+        otherwise get a new task from the church. Exceptions from the prefetching are raised here.
+        """
+        future, self._prefetched_task = self._prefetched_task, None
+        if future is not None:
+            task, fetched_at = future.result()
+            age = time.monotonic() - fetched_at
+            if age <= max_age:
+                return task
+            logger.warning(f"Prefetched church task is {age:.1f}s old, getting a new one.")
+        task, _ = self._fetch_task(repeat_delay)
+        return task
+
     def run_task(
         self,
         submit_endpoint: str = "submit_task",
         show_progress: bool = False,
         repeat_delay: int = 2,
         repeat_on_ratelimit: bool = True,
+        prefetch: bool = False,
+        prefetch_max_age: float = 5,
     ):
         """
         Obtain the Church Task, put new pixel on the canvas and send the `submit_task` request.
@@ -82,15 +159,29 @@ class ChurchClient(Client):
         has already likely expired.
 
         `repeat_delay` is the delay to wait, if the church doesn't have any more aviable tasks.
+
+        `prefetch`: Once the task is submitted, start getting the next task in the background,
+        while we're waiting out the rate limits, the next `run_task` then uses it, unless it's
+        older than `prefetch_max_age` seconds, in which case it's likely to expire before it's
+        submitted, so a new one is obtained.
         """
         # This can't just use the `set_pixel`, because we need to send submit message to the church
         # before we wait for the rate limits, this is also why we use `make_raw_request` instead
         # of just using `make_requests` that handles the rate limits for us
-        task = self.get_task(repeat_delay=repeat_delay)
+        task = self._next_task(repeat_delay, prefetch_max_age)
         logger.info(f"Running church task: {task}")
 
         # Manual set_pixel, with submit before waiting for rate limits
         url = self.resolve_endpoint("set_pixel")
+
+        def submit():
+            try:
+                return self.submit_task(task, endpoint=submit_endpoint)
+            finally:
+                # Only get the next task once this one was submitted, so that the church doesn't replace it
+                if prefetch:
+                    self._prefetch_task(url, repeat_delay)
+
         try:
             response = self.make_request(
                 "POST", url,
@@ -101,7 +192,7 @@ class ChurchClient(Client):
                 },
                 headers=self.headers,
                 ratelimit_after=True,
-                task_after=partial(self.submit_task, task, endpoint=submit_endpoint),
+                task_after=submit,
                 show_progress=show_progress
             )
         except RateLimitBreached as exc:
@@ -122,7 +213,9 @@ class ChurchClient(Client):
                     submit_endpoint=submit_endpoint,
                     show_progress=show_progress,
                     repeat_delay=repeat_delay,
-                    repeat_on_ratelimit=False
+                    repeat_on_ratelimit=False,
+                    prefetch=prefetch,
+                    prefetch_max_age=prefetch_max_age,
                 )
             raise exc
 
@@ -135,33 +228,235 @@ class ChurchClient(Client):
         self,
         submit_endpoint: str = "submit_task",
         show_progress: bool = False,
-        repeat_delay: int = 2
+        repeat_delay: int = 2,
+        prefetch: bool = False,
+        prefetch_max_age: float = 5,
     ):
         """
         Continually run church tasks, in case we encounter a known exception, handle it
         cleanly, but if the exception isn't known, it should still be raised, it's up to
         the user to handle those, we raise them to make debugging possible.
+
+        With `prefetch`, the next task is obtained while the rate limits are being waited
+        out, so the pixel can be drawn as soon as they're over, see `run_task`.
         """
+        try:
+            while True:
+                try:
+                    self.run_task(
+                        submit_endpoint=submit_endpoint,
+                        show_progress=show_progress,
+                        repeat_delay=repeat_delay,
+                        prefetch=prefetch,
+                        prefetch_max_age=prefetch_max_age,
+                    )
+                except Exception as exc:
+                    # If this exception was specific to the church,
+                    # it should be cleanly handled in this function,
+                    # otherwise it should be raised from it.
+                    try:
+                        self._handle_church_task_errors(exc)
+                    except requests.HTTPError as e:
+                        # Handle 500/502s here, because they require a sleep
+                        # and they normally shouldn't occur, this is a special
+                        # case for when the church is down, which, for some reason
+                        # occurs relatively often with some churches
+                        if e.response.status_code in (500, 502):
+                            logger.exception(f"The Church server is down, waiting {repeat_delay}s", exc_info=e)
+                            time.sleep(repeat_delay)
+                        else:
+                            raise e
+        finally:
+            # Don't leave the prefetching of the next task running
+            self._cancel_prefetch()
+
+
+class ChurchRunner(TokenWorkers):
+    """
+    Run the tasks of a single church with a pool of multiple pixel API tokens.
+
+    Only the `church` client talks to the church, and only from a single poller thread, which
+    submits the drawn tasks and keeps a buffer of up to `buffer_size` tasks (by default, one per
+    token) filled, so the load on the church stays the same, no matter how many tokens are used.
+    Every token has it's own client (and so it's own rate limits) and worker thread, which waits
+    out the `set_pixel` rate limits of it's token, takes a task from the buffer and draws it (see
+    `TokenWorkers`). Tasks which spent more than `task_max_age` seconds in the buffer are dropped,
+    since they would likely expire before they could be submitted.
+
+    Errors of all of the workers (and of the poller) are handled in one place, known church
+    errors are handled with the church's `_handle_church_task_errors`, church server outages
+    are waited out, and any other error stops the runner and is raised from `run`, as well as
+    the error of the last worker, if none of them can be used.
+    The number of handled errors of every type is kept in `error_counts`.
+
+    Note that some churches only assign a single task per member at once, with those,
+    the buffer size should be kept at 1.
+    """
+
+    def __init__(
+        self,
+        church: ChurchClient,
+        tokens: List[str],
+        buffer_size: Optional[int] = None,
+        task_max_age: float = 5,
+        repeat_delay: int = 2,
+        pool_size: int = 10,
+        rate_limit_store: Optional[RateLimitStore] = None,
+        instrumentation: Optional[Instrumentation] = None,
+    ):
+        if len(tokens) == 0:
+            raise ValueError("Church runner needs at least one token.")
+
+        super().__init__([Client(token, church.base_url, pool_size, rate_limit_store, instrumentation) for token in tokens])
+        self.church = church
+        self.task_max_age = task_max_age
+        self.repeat_delay = repeat_delay
+        # Buffered tasks, along with the monotonic time they were obtained at
+        self.tasks: "queue.Queue[Tuple[ChurchTask, float]]" = queue.Queue(buffer_size or len(tokens))
+        # Drawn tasks, waiting to be submitted by the poller
+        self.drawn: "queue.Queue[ChurchTask]" = queue.Queue()
+
+        self.error_counts: Counter = Counter()
+        self.completed = 0
+        self._error: Optional[Exception] = None
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "ChurchRunner":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stop(self):
+        """Stop the poller and the workers, once they finish their current task."""
+        self._stopped.set()
+
+    def close(self):
+        """Stop the runner and close the clients."""
+        self.stop()
+        for client in self.clients:
+            client.close()
+
+    def _handle_error(self, exception: Exception) -> None:
+        """
+        Handle an exception from any of the threads, just like `ChurchClient.run_tasks` would,
+        if it isn't known, store it, so that it can be raised from `run`, and stop the runner.
+        """
+        with self._lock:
+            self.error_counts[type(exception).__name__] += 1
+        try:
+            self.church._handle_church_task_errors(exception)
+        except requests.HTTPError as exc:
+            if exc.response is not None and exc.response.status_code in (500, 502):
+                logger.exception(f"The Church server is down, waiting {self.repeat_delay}s", exc_info=exc)
+                self._stopped.wait(self.repeat_delay)
+            else:
+                self._fail(exc)
+        except Exception as exc:
+            self._fail(exc)
+
+    def _fail(self, exception: Exception) -> None:
+        with self._lock:
+            if self._error is None:
+                self._error = exception
+        self.stop()
+
+    def _on_workers_failed(self, exception: Exception) -> None:
+        logger.error("None of the tokens can be used, stopping the runner.")
+        self._fail(exception)
+
+    def _submit_drawn(self, timeout: float = 0) -> None:
+        """Submit the drawn tasks to the church, waiting up to `timeout` seconds for the first one."""
+        try:
+            task = self.drawn.get(timeout=timeout) if timeout > 0 else self.drawn.get_nowait()
+        except queue.Empty:
+            return
         while True:
             try:
-                self.run_task(
-                    submit_endpoint=submit_endpoint,
-                    show_progress=show_progress,
-                    repeat_delay=repeat_delay
-                )
+                self.church.submit_task(task)
             except Exception as exc:
-                # If this exception was specific to the church,
-                # it should be cleanly handled in this function,
-                # otherwise it should be raised from it.
+                self._handle_error(exc)
+            else:
+                with self._lock:
+                    self.completed += 1
+            try:
+                task = self.drawn.get_nowait()
+            except queue.Empty:
+                return
+
+    def _run_poller(self):
+        """
+        Keep submitting the drawn tasks and keep the task buffer filled with new tasks from the church.
+        All of the church requests are made from here, since the church client isn't thread safe.
+        """
+        item: Optional[Tuple[ChurchTask, float]] = None
+        while not self._stopped.is_set():
+            # Submit the drawn tasks first, they need to be submitted before they expire
+            self._submit_drawn()
+            if item is None:
                 try:
-                    self._handle_church_task_errors(exc)
-                except requests.HTTPError as e:
-                    # Handle 500/502s here, because they require a sleep
-                    # and they normally shouldn't occur, this is a special
-                    # case for when the church is down, which, for some reason
-                    # occurs relatively often with some churches
-                    if e.response.status_code in (500, 502):
-                        logger.exception(f"The Church server is down, waiting {repeat_delay}s", exc_info=e)
-                        time.sleep(repeat_delay)
-                    else:
-                        raise e
+                    item = (self.church.get_task(repeat_delay=self.repeat_delay), time.monotonic())
+                except Exception as exc:
+                    self._handle_error(exc)
+                    continue
+
+            try:
+                self.tasks.put_nowait(item)
+            except queue.Full:
+                # Wait for tasks to submit, until a worker takes a task from the buffer
+                self._submit_drawn(timeout=0.1)
+            else:
+                item = None
+
+    def _take_job(self) -> Optional[ChurchTask]:
+        """Take a task from the buffer, skipping the ones which are too old, return `None` once stopped."""
+        while not self._stopped.is_set():
+            try:
+                task, fetched_at = self.tasks.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            age = time.monotonic() - fetched_at
+            if age <= self.task_max_age:
+                return task
+            logger.warning(f"Buffered church task is {age:.1f}s old, dropping it.")
+        return None
+
+    def _run_job(self, client: Client, url: str, task: ChurchTask) -> None:
+        logger.info(f"Running church task: {task}")
+        try:
+            client.make_raw_request(
+                "POST", url,
+                data={
+                    "x": task.x,
+                    "y": task.y,
+                    "rgb": parse_color(task.color)
+                },
+                headers=client.headers,
+            )
+        except RateLimitBreached as exc:
+            # Our rate limits of this token were off, they're obtained again, the task is likely to expire by then
+            with self._lock:
+                self.error_counts[type(exc).__name__] += 1
+            logger.warning(f"Hit pixels api ratelimit: {get_response_result(exc, 'message')}, ignoring this task.")
+        except Exception as exc:
+            self._handle_error(exc)
+        else:
+            self.drawn.put(task)
+
+    def run(self, show_progress: bool = False):
+        """
+        Run the church tasks with all of the tokens, until the runner is stopped,
+        or until an error which couldn't be handled occurs, which is then raised.
+        """
+        self._stopped.clear()
+        self._error = None
+        poller = threading.Thread(target=self._run_poller, daemon=True)
+        poller.start()
+        threads = [poller, *self._start_workers(show_progress)]
+        for thread in threads:
+            thread.join()
+        # Submit the tasks drawn after the poller stopped
+        self._submit_drawn()
+
+        if self._error is not None:
+            raise self._error
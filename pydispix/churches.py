@@ -1,15 +1,25 @@
+import hashlib
 import logging
-import random
 import re
+import ssl
 import time
 from dataclasses import dataclass
 from json.decoder import JSONDecodeError
+from typing import Any, Dict, List, Optional, Tuple
 
 import requests
 
+from pydispix.canvas import Canvas
 from pydispix.church import ChurchClient, ChurchTask
+from pydispix.color import parse_color
 from pydispix.errors import RateLimitBreached, get_response_result
 
+try:
+    import httpx
+except ImportError:
+    # httpx is only needed by the asynchronous clients, see `pydispix.aio`
+    httpx = None
+
 logger = logging.getLogger("pydispix")
 
 SQLITE_CHURCH = "https://decorator-factory.su"
@@ -28,8 +38,137 @@ class SQLiteChurchTask(ChurchTask):
     issued_by: str
 
 
+def _ssl_error_url(exception: Exception) -> Optional[str]:
+    """
+    Get the URL of the request, which failed because of an invalid SSL certificate, or `None` for other exceptions.
+
+    `requests` raises an `SSLError` for these, `httpx` raises a `ConnectError`, caused by the `ssl.SSLError`.
+    """
+    if isinstance(exception, requests.exceptions.SSLError):
+        return exception.request.url
+    if httpx is not None and isinstance(exception, httpx.ConnectError):
+        cause = exception.__cause__
+        while cause is not None:
+            if isinstance(cause, ssl.SSLError):
+                return str(exception.request.url)
+            cause = cause.__cause__ or cause.__context__
+    return None
+
+
+def handle_rick_church_error(exception: Exception, base_church_url: str) -> bool:
+    """
+    Rick church can raise certain specific errors, log them here and return `True`
+    if they were handled, or return `False` if they shouldn't be handled.
+
+    This is shared by the regular and the asynchronous rick church clients.
+    """
+    if isinstance(exception, RateLimitBreached):
+        try:
+            detail: str = get_response_result(exception, "detail", error_on_fail=True)  # type: ignore
+        except (UnicodeDecodeError, JSONDecodeError, KeyError):
+            # If we can't get the detail, this isn't the exception we're looking for
+            return False
+
+        match = re.search(
+            r"You have not gotten a task yet or you took more than (\d+) seconds to submit your task",
+            detail
+        )
+        if not match:
+            # If the detail isn't matching, this isn't an exception from the rick church
+            return False
+
+        # Log the exception and proceed cleanly
+        logger.warning(f"Church task failed, task disassigned, submitting took over {match.groups()[0]} seconds")
+    elif isinstance(exception, requests.HTTPError):
+        try:
+            detail: str = get_response_result(exception, "detail", error_on_fail=True)  # type: ignore - if it's not str, we handle it
+        except (UnicodeDecodeError, JSONDecodeError, KeyError):
+            # If we can't get the detail, this isn't the exception we're looking for
+            return False
+
+        if exception.response.status_code == 409:
+            if detail != "This is not the task you were assigned":
+                # If the detail isn't matching, this isn't an exception from the rick church
+                return False
+
+            # Log the exception and proceed cleanly
+            logger.warning("Church task failed, this task already got reassigned to somebody else.")
+        elif exception.response.status_code == 400:
+            msg = (
+                "You did not complete this task properly, or it was fixed before the server could verify it. "
+                "You have not been credited for this task."
+            )
+            if detail != msg:
+                # If the detail isn't matching, this isn't an exception from the rick church
+                return False
+
+            # Log the exception and proceed cleanly
+            logger.warning("Church task failed, check failed, someone has overwritten the pixel before we could submit it.")
+    else:
+        url = _ssl_error_url(exception)
+        if url is None or not url.startswith(base_church_url):
+            # If we didn't find a rich church specific exception (SSL error of a church of rick URL),
+            # let the caller use the super's implementation, there could be some other common errors
+            return False
+
+        # Log the exception and proceed cleanly
+        logger.warning("Church task failed, SSL Error: Church of rick's SSL certificate wasn't valid. For some reason this sometimes occurs.")
+    return True
+
+
+def _is_task_satisfied(canvas: Canvas, task: dict) -> bool:
+    """Check whether the pixel of given task already has the requested color on the canvas."""
+    try:
+        return canvas[task["x"], task["y"]].hex_str[1:].upper() == parse_color(task["color"]).upper()
+    except (IndexError, ValueError, TypeError):
+        return False
+
+
+def select_sqlite_church_task(
+    tasks: List[dict],
+    token: str,
+    attempted: Dict[int, float],
+    canvas: Optional[Canvas] = None,
+) -> Optional[dict]:
+    """
+    Pick a task to run from the list of tasks of the SQLite church, or return `None` if there's none worth running.
+
+    SQLite church returns a list of aviable tasks to complete, it doesn't assign specific
+    tasks to members, since there is no unique API key. Picking a task randomly from this
+    list means that workers keep colliding on the same tasks, so instead:
+    - tasks attempted recently are skipped, `attempted` maps their IDs to the monotonic
+      time until which they're skipped, expired entries are removed from it here
+    - tasks which are already satisfied on the `canvas` (if given) are skipped
+    - the task with the lowest hash of our `token` and the task ID is picked, this gives
+      every token a different order of the tasks, so the workers are spread over the list
+
+    This is shared by the regular and the asynchronous SQLite church clients.
+    """
+    now = time.monotonic()
+    for task_id in [task_id for task_id, until in attempted.items() if until <= now]:
+        del attempted[task_id]
+
+    best_task, best_key = None, None
+    for task in tasks:
+        if task["id"] in attempted:
+            continue
+        if canvas is not None and _is_task_satisfied(canvas, task):
+            continue
+        key = hashlib.sha256(f"{token}:{task['id']}".encode()).digest()
+        if best_key is None or key < best_key:
+            best_task, best_key = task, key
+    return best_task
+
+
 class RickChurchClient(ChurchClient):
-    """Church Client designed to work specifically with rick church"""
+    """
+    Church Client designed to work specifically with rick church
+
+    Responses of the stats endpoints (`get_personal_stats`, `get_church_stats`, `get_leaderboard`,
+    `get_uptime` and `get_projects`) are cached for `stats_ttl` seconds. The personal stats are
+    refreshed right after a task is submitted, once they're older than that, so the submit itself
+    isn't delayed, and all of the requests of the client are still made from the caller's thread.
+    """
 
     def __init__(
         self,
@@ -37,9 +176,13 @@ class RickChurchClient(ChurchClient):
         church_token: str,
         base_church_url: str = RICK_CHURCH,
         *args,
+        stats_ttl: float = 60,
         **kwargs
     ):
         super().__init__(pixel_api_token, church_token, base_church_url, *args, **kwargs)
+        self.stats_ttl = stats_ttl
+        # Cached JSON responses of the stats endpoints, endpoint -> (monotonic time of the request, response)
+        self._stats_cache: Dict[str, Tuple[float, Any]] = {}
 
     def get_task(self, repeat_delay: int = 2) -> RickChurchTask:
         url = self.resolve_church_endpoint("get_task")
@@ -62,8 +205,15 @@ class RickChurchClient(ChurchClient):
             'color': church_task.color
         }
         req = self.make_request("POST", url, data=body, params={"key": self.church_token})
-        completed_tasks = self.get_personal_stats()["goodTasks"]
-        logger.info(f"Task submitted to the church (tasks complete={completed_tasks}")
+
+        # The stats are only refreshed once the task was submitted, so they don't delay it
+        try:
+            stats = self.get_personal_stats()
+        except Exception:
+            logger.warning("Unable to refresh church stats (user/stats)", exc_info=True)
+            logger.info("Task submitted to the church")
+        else:
+            logger.info(f"Task submitted to the church (tasks complete={stats['goodTasks']})")
         return req
 
     def _handle_church_task_errors(self, exception: Exception) -> None:
@@ -71,119 +221,100 @@ class RickChurchClient(ChurchClient):
         Rick church can raise certain specific errors, handle
         them here or raise them back, if they shouldn't be handled.
         """
-        if isinstance(exception, RateLimitBreached):
-            try:
-                detail: str = get_response_result(exception, "detail", error_on_fail=True)  # type: ignore
-            except (UnicodeDecodeError, JSONDecodeError, KeyError):
-                # If we can't get the detail, this isn't the exception we're looking for
-                return super()._handle_church_task_errors(exception)
-
-            match = re.search(
-                r"You have not gotten a task yet or you took more than (\d+) seconds to submit your task",
-                detail
-            )
-            if not match:
-                # If the detail isn't matching, this isn't an exception from the rick church
-                return super()._handle_church_task_errors(exception)
+        if not handle_rick_church_error(exception, self.base_church_url):
+            return super()._handle_church_task_errors(exception)
 
-            # Log the exception and proceed cleanly
-            logger.warning(f"Church task failed, task disassigned, submitting took over {match.groups()[0]} seconds")
-        elif isinstance(exception, requests.HTTPError):
-            try:
-                detail: str = get_response_result(exception, "detail", error_on_fail=True)  # type: ignore - if it's not str, we handle it
-            except (UnicodeDecodeError, JSONDecodeError, KeyError):
-                # If we can't get the detail, this isn't the exception we're looking for
-                return super()._handle_church_task_errors(exception)
-
-            if exception.response.status_code == 409:
-                if detail != "This is not the task you were assigned":
-                    # If the detail isn't matching, this isn't an exception from the rick church
-                    return super()._handle_church_task_errors(exception)
-
-                # Log the exception and proceed cleanly
-                logger.warning("Church task failed, this task already got reassigned to somebody else.")
-            elif exception.response.status_code == 400:
-                msg = (
-                    "You did not complete this task properly, or it was fixed before the server could verify it. "
-                    "You have not been credited for this task."
-                )
-                if detail != msg:
-                    # If the detail isn't matching, this isn't an exception from the rick church
-                    return super()._handle_church_task_errors(exception)
-
-                # Log the exception and proceed cleanly
-                logger.warning("Church task failed, check failed, someone has overwritten the pixel before we could submit it.")
-        elif isinstance(exception, requests.exceptions.SSLError):
-            url = exception.request.url
-            if not url.startswith(self.base_church_url):
-                # This error doesn't come from church of rick URL
-                return super()._handle_church_task_errors(exception)
+    def _get_stats(self, endpoint: str, params: Optional[dict] = None, max_age: Optional[float] = None) -> Any:
+        """
+        Get the JSON response of a stats endpoint, reusing the cached one if it isn't
+        older than `max_age` seconds (`stats_ttl` by default, use 0 to always request it).
+        """
+        if max_age is None:
+            max_age = self.stats_ttl
+        cached = self._stats_cache.get(endpoint)
+        if cached is not None and time.monotonic() - cached[0] < max_age:
+            return cached[1]
 
-            # Log the exception and proceed cleanly
-            logger.warning("Church task failed, SSL Error: Church of rick's SSL certificate wasn't valid. For some reason this sometimes occurs.")
-        else:
-            # If we didn't find a rich church specific exception,
-            # call the super's implementation of this, there could
-            # be some other common errors
-            return super()._handle_church_task_errors(exception)
+        url = self.resolve_church_endpoint(endpoint)
+        requested_at = time.monotonic()
+        response = self.make_request("GET", url, params=params).json()
+        self._stats_cache[endpoint] = (requested_at, response)
+        return response
 
     # region: Add some misc endpoints which Church of Rick provides
 
-    def get_personal_stats(self):
+    def get_personal_stats(self, max_age: Optional[float] = None):
         """Get personal stats."""
-        url = self.resolve_church_endpoint("user/stats")
-        return self.make_request("GET", url, params={"key": self.church_token}).json()
+        return self._get_stats("user/stats", {"key": self.church_token}, max_age)
 
-    def get_church_stats(self):
+    def get_church_stats(self, max_age: Optional[float] = None):
         """Get church stats."""
-        url = self.resolve_church_endpoint("overall_stats")
-        return self.make_request("GET", url).json()
+        return self._get_stats("overall_stats", max_age=max_age)
 
-    def get_leaderboard(self) -> list:
+    def get_leaderboard(self, max_age: Optional[float] = None) -> list:
         """Get church leaderboard."""
-        url = self.resolve_church_endpoint("leaderboard")
-        return self.make_request("GET", url).json()["leaderboard"]
+        return self._get_stats("leaderboard", max_age=max_age)["leaderboard"]
 
-    def get_uptime(self) -> float:
+    def get_uptime(self, max_age: Optional[float] = None) -> float:
         """Uptime of the church of rick."""
-        url = self.resolve_church_endpoint("leaderboard")
-        return float(self.make_request("GET", url).json()["uptime"])
+        return float(self._get_stats("leaderboard", max_age=max_age)["uptime"])
 
-    def get_projects(self) -> list:
+    def get_projects(self, max_age: Optional[float] = None) -> list:
         """Get project data from the church."""
-        url = self.resolve_church_endpoint("projects/stats")
-        return self.make_request("GET", url).json()
+        return self._get_stats("projects/stats", max_age=max_age)
 
     # endregion
 
 
 class SQLiteChurchClient(ChurchClient):
-    """Church Client designed to work specifically with rick church"""
+    """
+    Church Client designed to work specifically with SQLite church
+
+    Tasks are picked by `select_sqlite_church_task`, attempted tasks are skipped for
+    `attempt_ttl` seconds, and tasks are checked against the canvas in the client's `canvas_cache`,
+    if it isn't older than `canvas_max_age` seconds (`None` disables the check). The canvas is only
+    cached by the other clients using the cache (i.e. drawers or guards), or by `get_canvas`.
+    """
 
     def __init__(
             self,
             pixel_api_token: str,
             base_church_url: str = SQLITE_CHURCH,
             *args,
+            attempt_ttl: float = 60,
+            canvas_max_age: Optional[float] = 10,
             **kwargs
     ):
         # SQLite Church API is open for everyone, it doesn't need a token
         church_token = ""
         super().__init__(pixel_api_token, church_token, base_church_url, *args, **kwargs)
+        self.attempt_ttl = attempt_ttl
+        self.canvas_max_age = canvas_max_age
+        self._attempted_tasks: Dict[int, float] = {}
+
+    def _task_canvas(self) -> Optional[Canvas]:
+        """
+        Get a fresh snapshot of the canvas from the canvas cache to check the tasks against, if there is one.
+        The canvas is never downloaded just for this, the check is skipped instead.
+        """
+        if self.canvas_max_age is None or self.canvas_cache is None:
+            return None
+        return self.canvas_cache.peek(self.canvas_max_age)
 
     def get_task(self, endpoint: str = "tasks", repeat_delay: int = 2) -> SQLiteChurchTask:
         url = self.resolve_church_endpoint(endpoint)
         while True:
             response = self.make_request("GET", url).json()
 
-            if len(response) == 0:
-                logger.info(f"Church doesn't currently have any aviable tasks, waiting {repeat_delay}s")
+            task = None
+            if len(response) != 0:
+                task = select_sqlite_church_task(response, self.token, self._attempted_tasks, self._task_canvas())
+            if task is None:
+                logger.info(f"Church doesn't currently have any aviable tasks ({len(response)} skipped), waiting {repeat_delay}s")
                 time.sleep(repeat_delay)
                 continue
-            # SQLite church returns a list of aviable tasks to complete, it doesn't assign
-            # specific tasks to members, since there is no unique API key. Best we can do is
-            # Therefore to pick a task randomly from this list
-            task = random.choice(response)
+
+            self._attempted_tasks[task["id"]] = time.monotonic() + self.attempt_ttl
             return SQLiteChurchTask(**task)
 
     def submit_task(self, church_task: SQLiteChurchTask, endpoint: str = "submit_task") -> requests.Response:
@@ -191,4 +322,7 @@ class SQLiteChurchClient(ChurchClient):
         body = {"task_id": church_task.id}
         req = self.make_request("POST", url, data=body)
         logger.info("Task submitted to the church")
+        # Keep the cached canvas up to date with our own changes
+        if self.canvas_cache is not None:
+            self.canvas_cache.set_pixel(church_task.x, church_task.y, tuple(bytes.fromhex(parse_color(church_task.color))))
         return req
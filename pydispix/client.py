@@ -1,22 +1,82 @@
 import logging
 import os
-from typing import Callable, Optional
+import time
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
 
-from pydispix.canvas import Canvas, Dimensions, Pixel
+from pydispix.canvas import Canvas, CanvasBuffer, CanvasCache, Dimensions, Pixel, ProgressCallback
 from pydispix.color import ResolvableColor, parse_color
-from pydispix.errors import InvalidToken, RateLimitBreached, handle_invalid_body
+from pydispix.errors import CanvasFormatError, HTTPResponse, InvalidToken, RateLimitBreached, handle_invalid_body
+from pydispix.metrics import Instrumentation
 from pydispix.ratelimits import RateLimiter
+from pydispix.stores import RateLimitStore
 from pydispix.utils import resolve_url_endpoint
 
 logger = logging.getLogger("pydispix")
 
+# Size of the chunks in which the canvas is downloaded
+CANVAS_CHUNK_SIZE = 64 * 1024
+
+
+def handle_response_status(response: HTTPResponse) -> None:
+    """Raise an appropriate exception, if the status code of given `response` isn't 200 (OK)."""
+    if response.status_code == 429:
+        raise RateLimitBreached(
+            "Request didn't succeed because it was made during a rate-limit phase.",
+            response=response
+        )
+    if response.status_code == 401:
+        logger.error("Request failed with 401 (Forbidden) code. This means your API token is most likely invalid.")
+        raise InvalidToken("Received 401 - FORBIDDEN: Is your API token correct?", response=response)
+
+    if response.status_code == 422:
+        exc = handle_invalid_body(response)
+        if exc is not None:
+            raise exc
+
+    if response.status_code != 200:
+        raise requests.HTTPError(f"Received code {response.status_code}", response=response)
+
+
+def announced_length(headers) -> Optional[int]:
+    """Get the length of the response body from given headers, if it's known before it's received."""
+    # The length of compressed responses doesn't match the length of the decoded body
+    if "Content-Length" not in headers or "Content-Encoding" in headers:
+        return None
+    return int(headers["Content-Length"])
+
 
 class Client:
-    """HTTP client to the pixel API."""
+    """
+    HTTP client to the pixel API.
+
+    Connections are kept alive and reused between requests, with a separate pool of
+    up to `pool_size` connections for every host we talk to. Use `close()` or the client
+    as a context manager to release these connections once you're done with it.
+
+    The rate limits are kept in `rate_limit_store`, pass a shared store to share them
+    with other clients, which use the same token (see `SQLiteRateLimitStore`).
 
-    def __init__(self, token: Optional[str] = None, base_url: str = "https://pixels.pythondiscord.com/"):
+    The requests and rate limit waits are reported to `instrumentation`, pass
+    a `MetricsRegistry` to collect metrics about them.
+
+    The canvas dimensions are only requested once, and cached. Pass a `canvas_cache` to
+    reuse fetched canvases, instead of downloading the canvas for every `get_canvas`,
+    this cache can be shared with other clients too (see `CanvasCache`).
+    """
+
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        base_url: str = "https://pixels.pythondiscord.com/",
+        pool_size: int = 10,
+        rate_limit_store: Optional[RateLimitStore] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        canvas_cache: Optional[CanvasCache] = None,
+    ):
         if token is None:
             try:
                 token = os.environ["TOKEN"]
@@ -29,7 +89,38 @@ class Client:
         self.token = token
         self.base_url = base_url
         self.headers = {"Authorization": "Bearer " + token}
-        self.rate_limiter = RateLimiter()
+        self.rate_limiter = RateLimiter(store=rate_limit_store, token=token, instrumentation=instrumentation)
+        self.instrumentation = self.rate_limiter.instrumentation
+        self.pool_size = pool_size
+        self.canvas_cache = canvas_cache
+        self._dimensions: Optional[Dimensions] = None
+        self._sessions: Dict[str, requests.Session] = {}
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close all pooled connections, the client will open new ones if it's used again."""
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+
+    def get_session(self, url: str) -> requests.Session:
+        """Get the pooled session for the host of given `url`, creating it if it doesn't exist yet."""
+        parsed_url = urlsplit(url)
+        host_url = f"{parsed_url.scheme}://{parsed_url.netloc}/"
+        try:
+            return self._sessions[host_url]
+        except KeyError:
+            pass
+
+        session = requests.Session()
+        session.mount(host_url, HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+        self._sessions[host_url] = session
+        return session
 
     def make_raw_request(
         self, method: str, url: str, *,
@@ -37,10 +128,14 @@ class Client:
         params: Optional[dict] = None,
         headers: Optional[dict] = None,
         update_rate_limits: bool = True,
+        stream: bool = False,
     ) -> requests.Response:
         """
         This method is here purely to make an HTTP request and update the rate limiter.
         Even though this will update the rate limtis, it will not wait for them.
+
+        With `stream`, only the headers of successful responses are received, and the body
+        has to be read (or the response closed) by the caller.
         """
         logger.debug(f"Request: {method} on {url} {data=} {params=}.")
 
@@ -50,33 +145,38 @@ class Client:
         # Set the user-agent, if not set to something else
         headers.setdefault("User-Agent", "ItsDrike pydispix")
 
-        response = requests.request(
-            method, url,
-            json=data,
-            params=params,
-            headers=headers
-        )
+        token_id = self.rate_limiter.key_prefix
+        self.instrumentation.on_request_start(token_id, method, url)
+        sent_at = time.monotonic()
+        try:
+            response = self.get_session(url).request(
+                method, url,
+                json=data,
+                params=params,
+                headers=headers,
+                stream=stream,
+            )
+        except Exception:
+            self.instrumentation.on_request_end(token_id, method, url, None, time.monotonic() - sent_at)
+            raise
+        self.instrumentation.on_request_end(token_id, method, url, response.status_code, time.monotonic() - sent_at)
 
         if update_rate_limits:
-            self.rate_limiter.update_from_headers(url, response.headers)
+            self.rate_limiter.update_from_headers(
+                url, response.headers,
+                sent_at=sent_at, rtt=response.elapsed.total_seconds()
+            )
 
         if response.status_code == 429:
             logger.debug(f"Request failed (rate limitation): {method} on {url} {data=} {params=}")
-            raise RateLimitBreached(
-                "Request didn't succeed because it was made during a rate-limit phase.",
-                response=response
-            )
-        if response.status_code == 401:
-            logger.error("Request failed with 401 (Forbidden) code. This means your API token is most likely invalid.")
-            raise InvalidToken("Received 401 - FORBIDDEN: Is your API token correct?", response=response)
-
-        if response.status_code == 422:
-            exc = handle_invalid_body(response)
-            if exc is not None:
-                raise exc
-
-        if response.status_code != 200:
-            raise requests.HTTPError(f"Received code {response.status_code}", response=response)
+            self.instrumentation.on_rate_limit_breach(token_id, url)
+            # Our local rate limits didn't match the real ones, make sure to obtain them again
+            if update_rate_limits:
+                self.rate_limiter.mark_stale(url)
+        if stream and response.status_code != 200:
+            # The errors are handled with the whole body, reading it also releases the connection
+            response.content
+        handle_response_status(response)
 
         return response
 
@@ -90,6 +190,7 @@ class Client:
         head_ratelimit_update: bool = False,
         repeat_on_ratelimit: bool = False,
         show_progress: bool = False,
+        stream: bool = False,
     ) -> requests.Response:
         """
         This method handles making a request on a rate-limited endpoint.
@@ -110,13 +211,16 @@ class Client:
         trigger interfere with the API, and are here purely to obtain the rate limits, so that we
         can wait it out before we make an actual request. This can only be used when `ratelimit_after`
         isn't being used, since if it is, we'll obtain rate-limits from the original made request,
-        instead of the HEAD.
+        instead of the HEAD. The HEAD request is only made if we don't already know the rate limits
+        from a previous request (see `RateLimitedEndpoint.needs_update`).
 
         `repeat_on_ratelimit`: This can be used to repeat this request if request gives us
         `RateLimitBreached` exception. This will re-run the whole function again one more time, but
         if the second request fails too, `RateLimitBreached` will be raised anyway. (To avoid infinite
         loops). This option can't be used with `ratelimit_after` since if we breached rate limit, we
         have to wait it out, and we can't wait it out after the request we made has failed.
+
+        `stream`: Don't receive the body of the response right away, see `make_raw_request`.
         """
         if repeat_on_ratelimit and ratelimit_after:
             raise ValueError(
@@ -125,7 +229,7 @@ class Client:
             )
 
         if not ratelimit_after:
-            if head_ratelimit_update:
+            if head_ratelimit_update and self.rate_limiter.needs_update(url):
                 self.make_raw_request("HEAD", url, headers=headers, update_rate_limits=True)
             self.rate_limiter.wait(url, show_progress=show_progress)
 
@@ -135,11 +239,13 @@ class Client:
                 data=data,
                 params=params,
                 headers=headers,
-                update_rate_limits=True
+                update_rate_limits=True,
+                stream=stream,
             )
         except RateLimitBreached as exc:
             if repeat_on_ratelimit:
                 logger.warning(f"Hit rate limit, repeating request ({exc.response.content})")
+                self.instrumentation.on_retry(self.rate_limiter.key_prefix, url)
                 # There's no point in using `head_ratelimit_update` here, since the failed
                 # request has already updated the rate limits.
                 return self.make_request(
@@ -149,7 +255,8 @@ class Client:
                     headers=headers,
                     ratelimit_after=False,
                     task_after=task_after, head_ratelimit_update=False,
-                    repeat_on_ratelimit=False, show_progress=show_progress
+                    repeat_on_ratelimit=False, show_progress=show_progress,
+                    stream=stream,
                 )
             raise exc
 
@@ -170,21 +277,72 @@ class Client:
         """Resolve given `endpoint` to use the base_url"""
         return resolve_url_endpoint(self.base_url, endpoint)
 
-    def get_dimensions(self) -> Dimensions:
-        """Make a request to obtain the canvas dimensions"""
-        url = self.resolve_endpoint("get_size")
-        data = self.make_request("GET", url).json()
-        return Dimensions(width=data["width"], height=data["height"])
+    def get_dimensions(self, refresh: bool = False) -> Dimensions:
+        """
+        Get the canvas dimensions, these almost never change, so they're only requested once
+        and then cached, unless `refresh` is set. They're also requested again automatically,
+        if a fetched canvas doesn't match them.
+        """
+        if self._dimensions is None or refresh:
+            url = self.resolve_endpoint("get_size")
+            data = self.make_request("GET", url).json()
+            self._dimensions = Dimensions(width=data["width"], height=data["height"])
+        return self._dimensions
 
-    def get_canvas(self, show_progress: bool = False) -> Canvas:
-        """Fetch the whole canvas and return it in a `Canvas` object."""
+    def _fetch_canvas(self, show_progress: bool = False, progress: Optional[ProgressCallback] = None, retry: bool = True) -> Canvas:
+        """
+        Download the canvas in chunks, right into a buffer of the size of the cached dimensions.
+        If the canvas doesn't match them, they're requested again, and the canvas is fetched
+        again too, unless it's length was announced and the buffer was sized by it right away.
+        """
         url = self.resolve_endpoint("get_pixels")
-        data = self.make_request("GET", url, headers=self.headers, show_progress=show_progress).content
         size = self.get_dimensions()
-        return Canvas(size, data)
+        with self.make_request("GET", url, headers=self.headers, show_progress=show_progress, stream=True) as response:
+            length = announced_length(response.headers)
+            if length is not None and length != size.width * size.height * 3:
+                logger.info("Fetched canvas doesn't match the cached dimensions, requesting them again.")
+                size = self.get_dimensions(refresh=True)
+            buffer = CanvasBuffer(size, progress)
+            try:
+                for chunk in response.iter_content(CANVAS_CHUNK_SIZE):
+                    buffer.feed(chunk)
+                return buffer.finish()
+            except CanvasFormatError:
+                if length is not None or not retry:
+                    raise
+
+        # The canvas was most likely resized, obtain the new dimensions
+        logger.info("Fetched canvas doesn't match the cached dimensions, requesting them again.")
+        if self.get_dimensions(refresh=True) == size:
+            raise CanvasFormatError(f"Fetched canvas doesn't match it's dimensions ({size}).")
+        return self._fetch_canvas(show_progress, progress, retry=False)
+
+    def get_canvas(
+        self,
+        show_progress: bool = False,
+        max_age: Optional[float] = None,
+        progress: Optional[ProgressCallback] = None,
+    ) -> Canvas:
+        """
+        Fetch the whole canvas and return it in a `Canvas` object.
+
+        The canvas is streamed into a buffer preallocated for it, so it's never held in memory twice,
+        `progress` is called with the number of received and total bytes after every received chunk.
+
+        With a `canvas_cache`, the cached canvas is returned instead, if it isn't older
+        than `max_age` seconds (by default, the max age of the cache).
+        """
+        if self.canvas_cache is None:
+            return self._fetch_canvas(show_progress, progress)
+        return self.canvas_cache.get(lambda: self._fetch_canvas(show_progress, progress), max_age)
 
     def get_pixel(self, x: int, y: int, show_progress: bool = False) -> Pixel:
-        """Fetch rgb data about a specific pixel"""
+        """Fetch rgb data about a specific pixel, this uses the cached canvas, if there's a fresh one."""
+        if self.canvas_cache is not None:
+            canvas = self.canvas_cache.peek()
+            if canvas is not None:
+                return canvas[x, y]
+
         url = self.resolve_endpoint("get_pixel")
         data = self.make_request(
             "GET", url, params={"x": x, "y": y}, headers=self.headers,
@@ -220,6 +378,9 @@ class Client:
             show_progress=show_progress,
         )
 
+        if self.canvas_cache is not None:
+            self.canvas_cache.set_pixel(x, y, tuple(bytes.fromhex(parse_color(color))))
+
         msg = data.json()["message"]
         logger.info(f"Success: {msg}")
         return msg
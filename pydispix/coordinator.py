@@ -0,0 +1,389 @@
+"""
+Coordinating multiple machines drawing an image, by handing out leases of pixels to draw.
+
+Unlike the static split of the image between `DistributedClient`s, the workers here take
+the pixels from a single queue, kept by the coordinator, as soon as their tokens are ready
+to draw. This means that no worker is idle while there are still pixels left to draw, and
+if a worker dies (or is just slow), the pixels leased to it are reassigned to other workers
+once the lease expires. The coordinator can be ran over HTTP, or over a Unix socket, which
+is useful when all of the workers are on the same host:
+
+    python -m pydispix.coordinator my_img.png 10 20 --unix /tmp/pydispix.sock --guard
+"""
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+import PIL.Image
+
+from pydispix.autodraw import AutoDrawer, MultiAutoDrawer
+from pydispix.canvas import Canvas
+from pydispix.client import Client
+from pydispix.errors import RateLimitBreached
+
+logger = logging.getLogger("pydispix")
+
+
+@dataclass
+class PixelLease:
+    """A pixel leased to a worker, which should draw it before `deadline` (monotonic time)."""
+    id: int
+    x: int
+    y: int
+    rgb: str
+    worker: str
+    deadline: float
+
+
+class Coordinator:
+    """
+    Keep a queue of the mismatched pixels of given drawer, and lease them to the workers.
+
+    The canvas is re-fetched with `client` once it's older than `refresh_interval` seconds,
+    but only when a worker asks for a pixel, and the pixels which aren't leased at the moment
+    are then replaced with the new mismatched pixels, in the order the drawer would draw them.
+
+    Workers need to report every leased pixel as completed within `lease_time` seconds,
+    otherwise the lease expires and the pixel goes back to the front of the queue. Once there
+    are no pixels left to draw, no active leases, and the canvas was fetched after the last
+    pixel was completed, the workers are told that the drawing is done, unless we're guarding
+    the image, in which case they keep waiting for more pixels.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        drawer: Union[AutoDrawer, MultiAutoDrawer],
+        guard: bool = False,
+        lease_time: float = 30,
+        refresh_interval: float = 5,
+    ):
+        self.client = client
+        self.drawer = drawer
+        self.guard = guard
+        self.lease_time = lease_time
+        self.refresh_interval = refresh_interval
+
+        self.canvas: Optional[Canvas] = None
+        # Pixels waiting to be leased, (x, y) -> hex color
+        self.pending: "OrderedDict[Tuple[int, int], str]" = OrderedDict()
+        self.leases: Dict[int, PixelLease] = {}
+        self.completed = 0
+        self._lease_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._refreshing = False
+        # Pixels completed while the canvas was being fetched, which the fetched canvas might not include yet
+        self._completed_during_refresh: Dict[Tuple[int, int], str] = {}
+        # Monotonic times of the start of the last canvas fetch, and of the last completed pixel
+        self._fetched_at = 0.0
+        self._last_completed_at = 0.0
+        self._server: Optional[socketserver.BaseServer] = None
+
+    def _refresh(self):
+        """
+        Re-fetch the canvas and replace the pending pixels with the currently mismatched ones.
+
+        The (rate limited) fetch is done without holding the lock, so the other workers
+        can keep leasing and completing pixels meanwhile, only the swap is done with it.
+        Pixels which are leased, or were completed since the fetch started, are left out
+        of the new queue, since the fetched canvas might not include them yet.
+        """
+        try:
+            fetched_at = time.monotonic()
+            canvas = self.client.get_canvas()
+            mismatched = [((x, y), pixel.hex_str.lstrip("#")) for x, y, pixel in self.drawer.iter_mismatched_pixels(canvas)]
+            with self._lock:
+                skipped = {(lease.x, lease.y) for lease in self.leases.values()} | self._completed_during_refresh.keys()
+                # Keep the completed pixels on the fetched canvas too, same as `complete` does
+                for xy, rgb in self._completed_during_refresh.items():
+                    canvas[xy] = tuple(bytes.fromhex(rgb))
+                self._completed_during_refresh.clear()
+                self.canvas = canvas
+                self._fetched_at = fetched_at
+                self.pending = OrderedDict((xy, rgb) for xy, rgb in mismatched if xy not in skipped)
+                logger.debug(f"Coordinator found {len(self.pending)} mismatched pixels ({len(self.leases)} leased).")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _expire_leases(self):
+        """Put the pixels of expired leases back to the front of the queue."""
+        now = time.monotonic()
+        for lease in [lease for lease in self.leases.values() if lease.deadline <= now]:
+            logger.warning(f"Lease of pixel ({lease.x}, {lease.y}) by {lease.worker} expired, reassigning it.")
+            del self.leases[lease.id]
+            self.pending[lease.x, lease.y] = lease.rgb
+            self.pending.move_to_end((lease.x, lease.y), last=False)
+
+    def lease(self, worker: str, count: int = 1) -> dict:
+        """Lease up to `count` pixels to given worker."""
+        with self._lock:
+            self._expire_leases()
+            # Only a single worker refreshes the canvas, the others get the pixels which are pending meanwhile
+            refresh = (
+                not self._refreshing and not self.pending
+                and (self.canvas is None or self.canvas.age >= self.refresh_interval)
+            )
+            if refresh:
+                self._refreshing = True
+                self._completed_during_refresh.clear()
+        if refresh:
+            self._refresh()
+
+        with self._lock:
+            deadline = time.monotonic() + self.lease_time
+            leases = []
+            while self.pending and len(leases) < count:
+                (x, y), rgb = self.pending.popitem(last=False)
+                lease = PixelLease(next(self._lease_ids), x, y, rgb, worker, deadline)
+                self.leases[lease.id] = lease
+                leases.append(lease)
+
+            # The pixels can't be known to be drawn until a canvas is fetched after the last one was completed
+            done = (
+                not self.guard and not leases and not self.leases and not self._refreshing
+                and self.canvas is not None and self._fetched_at >= self._last_completed_at
+            )
+            # Nothing to do right now, ask again once the canvas can be re-fetched, or a lease expires
+            retry_after = self.refresh_interval
+            if self.leases:
+                retry_after = min(retry_after, min(lease.deadline for lease in self.leases.values()) - time.monotonic())
+
+        return {
+            "leases": [{"id": lease.id, "x": lease.x, "y": lease.y, "rgb": lease.rgb} for lease in leases],
+            "lease_time": self.lease_time,
+            "retry_after": max(retry_after, 0),
+            "done": done,
+        }
+
+    def complete(self, lease_id: int, success: bool) -> dict:
+        """Finish a lease, if the pixel wasn't drawn successfully, it goes back to the queue."""
+        with self._lock:
+            lease = self.leases.pop(lease_id, None)
+            if lease is None:
+                # The lease has already expired, and the pixel was put back to the queue
+                return {"accepted": False}
+
+            if success:
+                self.completed += 1
+                self._last_completed_at = time.monotonic()
+                if self._refreshing:
+                    self._completed_during_refresh[lease.x, lease.y] = lease.rgb
+                if self.canvas is not None:
+                    self.canvas[lease.x, lease.y] = tuple(bytes.fromhex(lease.rgb))
+            else:
+                self.pending[lease.x, lease.y] = lease.rgb
+                self.pending.move_to_end((lease.x, lease.y), last=False)
+        return {"accepted": True}
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "pending": len(self.pending),
+                "leased": len(self.leases),
+                "completed": self.completed,
+                "workers": sorted({lease.worker for lease in self.leases.values()}),
+            }
+
+    def serve(self, address: Union[Tuple[str, int], str]) -> socketserver.BaseServer:
+        """
+        Start serving the coordinator in a background thread, and return the server.
+
+        `address` is either a (host, port) tuple for HTTP, or a path of a Unix socket.
+        """
+        if isinstance(address, str):
+            if not hasattr(socketserver, "UnixStreamServer"):
+                raise RuntimeError("Unix sockets aren't supported on this platform, use HTTP instead.")
+            server: socketserver.BaseServer = _UnixHTTPServer(address, _CoordinatorHandler)
+        else:
+            server = ThreadingHTTPServer(address, _CoordinatorHandler)
+        server.coordinator = self  # type: ignore - custom attribute, used by the handler
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self._server = server
+        return server
+
+    def close(self):
+        """Stop the server, if it's running."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+class _CoordinatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args):
+        # Client address is empty on Unix sockets, which the default implementation doesn't support
+        logger.debug(f"Coordinator: {format % args}")
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):  # noqa: N802 - name required by BaseHTTPRequestHandler
+        if self.path == "/status":
+            return self._send_json(200, self.server.coordinator.status())  # type: ignore - custom attribute
+        self._send_json(404, {"detail": "Not found"})
+
+    def do_POST(self):  # noqa: N802 - name required by BaseHTTPRequestHandler
+        coordinator: Coordinator = self.server.coordinator  # type: ignore - custom attribute
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path == "/lease":
+            return self._send_json(200, coordinator.lease(str(body["worker"]), int(body.get("count", 1))))
+        if self.path == "/complete":
+            return self._send_json(200, coordinator.complete(int(body["lease_id"]), bool(body["success"])))
+        self._send_json(404, {"detail": "Not found"})
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket."""
+
+    def __init__(self, path: str, timeout: float = 10):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class CoordinatedWorker:
+    """
+    Draw the pixels leased from a `Coordinator` with given client.
+
+    `coordinator_url` is either an HTTP url (`http://host:port/`), or a path of a Unix socket
+    prefixed with `unix://` (`unix:///tmp/pydispix.sock`). A pixel is only leased once the
+    rate limits of our token were waited out, so the lease is only held for a single request.
+    To use multiple tokens, run a worker with a client for each of them (i.e. in threads).
+    """
+
+    def __init__(self, client: Client, coordinator_url: str, name: Optional[str] = None):
+        self.client = client
+        self.coordinator_url = coordinator_url
+        self.name = name if name is not None else f"{socket.gethostname()}-{id(self):x}"
+        self._connection: Optional[http.client.HTTPConnection] = None
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._connection is None:
+            url = urlsplit(self.coordinator_url)
+            if url.scheme == "unix":
+                self._connection = _UnixHTTPConnection(url.path)
+            else:
+                self._connection = http.client.HTTPConnection(url.netloc)
+        return self._connection
+
+    def _send(self, method: str, path: str, data: Optional[bytes]) -> dict:
+        connection = self._connect()
+        connection.request(method, path, body=data, headers={"Content-Type": "application/json"})
+        return json.loads(connection.getresponse().read())
+
+    def _coordinator_request(self, method: str, path: str, body: Optional[dict] = None) -> dict:
+        """Make a request to the coordinator, reconnecting once if the kept alive connection was closed."""
+        data = json.dumps(body).encode() if body is not None else None
+        try:
+            return self._send(method, path, data)
+        except (ConnectionError, http.client.HTTPException):
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            return self._send(method, path, data)
+
+    def run(self, show_progress: bool = False):
+        """Keep drawing the leased pixels, until the coordinator reports that the drawing is done."""
+        url = self.client.resolve_endpoint("set_pixel")
+        # Waiting reserves a request, so it's kept for the next lease, if nothing was leased
+        acquired = False
+        while True:
+            # Only take a lease once we can use it right away
+            if not acquired:
+                if self.client.rate_limiter.needs_update(url):
+                    self.client.make_raw_request("HEAD", url, headers=self.client.headers)
+                self.client.rate_limiter.wait(url, show_progress=show_progress)
+                acquired = True
+
+            # A single pixel is leased at a time, since we can only draw one before waiting again
+            result = self._coordinator_request("POST", "/lease", {"worker": self.name, "count": 1})
+            if result["done"]:
+                logger.info("Coordinator reports that the drawing is done.")
+                return
+            if not result["leases"]:
+                time.sleep(result["retry_after"])
+                continue
+
+            acquired = False
+            for lease in result["leases"]:
+                success = self._draw_lease(url, lease)
+                self._coordinator_request("POST", "/complete", {"lease_id": lease["id"], "success": success})
+
+    def _draw_lease(self, url: str, lease: dict) -> bool:
+        """Draw a leased pixel, returning whether it was successful."""
+        try:
+            response = self.client.make_raw_request(
+                "POST", url,
+                data={"x": lease["x"], "y": lease["y"], "rgb": lease["rgb"]},
+                headers=self.client.headers,
+            )
+        except RateLimitBreached:
+            logger.warning(f"Leased pixel ({lease['x']}, {lease['y']}) hit a rate limit, returning it.")
+            return False
+        except Exception:
+            logger.exception(f"Failed to draw leased pixel ({lease['x']}, {lease['y']}), returning it.")
+            return False
+        logger.info(f"Success: {response.json()['message']}")
+        return True
+
+
+def main(argv: Optional[List[str]] = None):
+    """Run a coordinator for an image, using the token from the `TOKEN` environmental variable."""
+    parser = argparse.ArgumentParser(description="Coordinate workers drawing an image on the pixels canvas.")
+    parser.add_argument("image", help="Path to the image to draw")
+    parser.add_argument("x", type=int, help="X coordinate of the top left corner of the image")
+    parser.add_argument("y", type=int, help="Y coordinate of the top left corner of the image")
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--base-url", default="https://pixels.pythondiscord.com/")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8123)
+    parser.add_argument("--unix", help="Serve on a Unix socket at this path, instead of HTTP")
+    parser.add_argument("--guard", action="store_true", help="Keep handing out pixels once the image is drawn")
+    parser.add_argument("--lease-time", type=float, default=30)
+    parser.add_argument("--refresh-interval", type=float, default=5)
+    args = parser.parse_args(argv)
+
+    client = Client(base_url=args.base_url)
+    drawer = AutoDrawer.load_image(client, (args.x, args.y), PIL.Image.open(args.image), args.scale)
+    coordinator = Coordinator(client, drawer, args.guard, args.lease_time, args.refresh_interval)
+    coordinator.serve(args.unix if args.unix is not None else (args.host, args.port))
+    logger.info(f"Coordinator is running on {args.unix or f'{args.host}:{args.port}'}")
+
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"Coordinator status: {coordinator.status()}")
+    except KeyboardInterrupt:
+        coordinator.close()
+
+
+if __name__ == "__main__":
+    main()
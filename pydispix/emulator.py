@@ -0,0 +1,372 @@
+"""
+Local emulator of the pixels API, for testing and load-testing without the real service.
+
+The emulator serves `get_size`, `get_pixels`, `get_pixel` and `set_pixel` (and HEAD requests
+on all of them) over HTTP, with the same rate limit headers as the real API, so that clients
+can be pointed at it with `base_url`. It can also be started from the command line:
+`python -m pydispix.emulator --width 160 --height 90 --port 8000`.
+"""
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from pydispix.canvas import Canvas, Dimensions
+
+logger = logging.getLogger("pydispix")
+
+# Area of the canvas, as (x0, y0, x1, y1), where (x1, y1) is exclusive
+RegionType = Tuple[int, int, int, int]
+
+
+@dataclass
+class EndpointLimits:
+    """
+    Rate limits of an emulated endpoint, `limit` requests per `period` seconds, for every token.
+
+    Breaching the limit puts the token on a `cooldown` (in seconds), and making requests
+    during the cooldown triggers the `anti_spam` delay, which is sent in `retry-after`.
+    """
+    limit: int
+    period: float
+    cooldown: float = 0
+    anti_spam: float = 0
+
+
+# Rate limits similar to the ones of the real API
+DEFAULT_LIMITS = {
+    "get_size": EndpointLimits(5, 10),
+    "get_pixels": EndpointLimits(5, 10, cooldown=10),
+    "get_pixel": EndpointLimits(8, 10, cooldown=10),
+    "set_pixel": EndpointLimits(2, 120, cooldown=240, anti_spam=360),
+}
+
+
+class _TokenLimits:
+    """Current state of the rate limits of one endpoint for one token."""
+
+    def __init__(self, limits: EndpointLimits):
+        self.limits = limits
+        self.window_start = -float("inf")
+        self.used = 0
+        self.cooldown_until = 0.0
+        self.anti_spam_until = 0.0
+
+    def hit(self, now: float) -> Tuple[bool, Dict[str, str]]:
+        """Make a request at monotonic time `now`, return whether it's allowed and the rate limit headers."""
+        if now >= self.window_start + self.limits.period:
+            self.window_start = now
+            self.used = 0
+
+        allowed = now >= self.cooldown_until and now >= self.anti_spam_until and self.used < self.limits.limit
+        if allowed:
+            self.used += 1
+        elif now < self.cooldown_until:
+            # Requests made during the cooldown are considered spam
+            if self.limits.anti_spam:
+                self.anti_spam_until = now + self.limits.anti_spam
+        elif now >= self.anti_spam_until and self.limits.cooldown:
+            self.cooldown_until = now + self.limits.cooldown
+        return allowed, self.headers(now)
+
+    def headers(self, now: float) -> Dict[str, str]:
+        """Get the rate limit headers at monotonic time `now`, without making a request."""
+        if now >= self.window_start + self.limits.period:
+            remaining, reset = self.limits.limit, 0.0
+        else:
+            remaining, reset = self.limits.limit - self.used, self.window_start + self.limits.period - now
+
+        headers = {
+            "requests-limit": str(self.limits.limit),
+            "requests-period": str(self.limits.period),
+            "requests-remaining": str(remaining),
+            "requests-reset": f"{reset:.3f}",
+        }
+        if now < self.cooldown_until:
+            headers["cooldown-reset"] = f"{self.cooldown_until - now:.3f}"
+        if now < self.anti_spam_until:
+            headers["retry-after"] = f"{self.anti_spam_until - now:.3f}"
+        return headers
+
+
+class PixelsEmulator:
+    """
+    Emulated pixels API, with a canvas of given size, initially filled with `background`.
+
+    `limits` override the rate limits (`EndpointLimits`) of the endpoints, pass `None` as the
+    limits of an endpoint to not limit it at all. If `tokens` are given, only these are accepted,
+    otherwise any token is. Every response is delayed by `latency` seconds, plus up to `jitter`.
+
+    To simulate adversaries, `attack_rate` pixels per second (within `attack_region`, by default
+    the whole canvas) are overwritten with random colors from `attack_colors`. The randomness
+    (of both the attacks and the jitter) comes from `seed`, so the runs are reproducible.
+    Pixels can also be attacked manually with `attack`.
+    """
+
+    def __init__(
+        self,
+        width: int = 160,
+        height: int = 90,
+        *,
+        background: str = "ffffff",
+        limits: Optional[Dict[str, Optional[EndpointLimits]]] = None,
+        tokens: Optional[List[str]] = None,
+        latency: float = 0,
+        jitter: float = 0,
+        attack_rate: float = 0,
+        attack_region: Optional[RegionType] = None,
+        attack_colors: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+    ):
+        self.size = Dimensions(width=width, height=height)
+        self.canvas = bytearray(bytes.fromhex(background) * (width * height))
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self.tokens: Optional[Set[str]] = set(tokens) if tokens is not None else None
+        self.latency = latency
+        self.jitter = jitter
+        self.attack_rate = attack_rate
+        self.attack_region = attack_region or (0, 0, width, height)
+        self.attack_colors = attack_colors or ["000000", "ff0000", "00ff00", "0000ff"]
+        self.random = random.Random(seed)
+
+        # Numbers of responses by (endpoint, status code) and of attacked pixels
+        self.stats: Counter = Counter()
+        self.attacked = 0
+        self._token_limits: Dict[Tuple[str, str], _TokenLimits] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._stopped = threading.Event()
+
+    def __enter__(self) -> "PixelsEmulator":
+        if self._server is None:
+            self.serve()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def url(self) -> str:
+        """Base url of the running emulator, to be used as `base_url` of the clients."""
+        if self._server is None:
+            raise RuntimeError("The emulator isn't running, start it with `serve` first.")
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def serve(self, address: Tuple[str, int] = ("127.0.0.1", 0)) -> ThreadingHTTPServer:
+        """Start serving the emulator in a background thread (on a random free port by default), and return the server."""
+        server = ThreadingHTTPServer(address, _EmulatorHandler)
+        server.daemon_threads = True
+        server.emulator = self  # type: ignore - custom attribute, used by the handler
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self._server = server
+
+        self._stopped.clear()
+        if self.attack_rate > 0:
+            threading.Thread(target=self._run_attacker, daemon=True).start()
+        return server
+
+    def close(self):
+        """Stop the server and the attacker, if they're running."""
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def get_canvas(self) -> Canvas:
+        """Get a snapshot of the emulated canvas."""
+        with self._lock:
+            return Canvas(self.size, bytes(self.canvas))
+
+    def set_pixel(self, x: int, y: int, rgb: str):
+        """Set a pixel directly, without any rate limits."""
+        index = (y * self.size.width + x) * 3
+        with self._lock:
+            self.canvas[index:index + 3] = bytes.fromhex(rgb)
+
+    def attack(self, count: int = 1):
+        """Overwrite `count` random pixels within `attack_region` with random colors."""
+        x0, y0, x1, y1 = self.attack_region
+        for _ in range(count):
+            x, y = self.random.randrange(x0, x1), self.random.randrange(y0, y1)
+            self.set_pixel(x, y, self.random.choice(self.attack_colors))
+        self.attacked += count
+
+    def _run_attacker(self):
+        """Keep attacking `attack_rate` pixels per second, until the emulator is closed."""
+        last = time.monotonic()
+        debt = 0.0
+        while not self._stopped.wait(min(1 / self.attack_rate, 1)):
+            now = time.monotonic()
+            debt += (now - last) * self.attack_rate
+            last = now
+            if debt >= 1:
+                self.attack(int(debt))
+                debt -= int(debt)
+
+    def _check_limits(self, endpoint: str, token: str, consume: bool) -> Tuple[bool, Dict[str, str]]:
+        """Check (and if `consume` is set, use up) the rate limits of `endpoint` for `token`."""
+        limits = self.limits.get(endpoint)
+        if limits is None:
+            return True, {}
+        with self._lock:
+            state = self._token_limits.setdefault((endpoint, token), _TokenLimits(limits))
+            if not consume:
+                return True, state.headers(time.monotonic())
+            return state.hit(time.monotonic())
+
+    def _delay(self):
+        """Simulate the latency of the network and the server."""
+        delay = self.latency
+        if self.jitter:
+            with self._lock:
+                delay += self.random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def handle(self, method: str, endpoint: str, token: Optional[str], params: dict, body: dict) -> Tuple[int, Dict[str, str], object]:
+        """Handle a request, return the status code, headers and the body (bytes, or JSON serializable)."""
+        self._delay()
+        if endpoint not in self.limits:
+            return 404, {}, {"detail": "Not Found"}
+        if endpoint == "get_size":
+            # Canvas size is public, it doesn't need a token
+            token = token or ""
+        elif token is None or (self.tokens is not None and token not in self.tokens):
+            return 401, {}, {"detail": "Invalid token"}
+
+        allowed, headers = self._check_limits(endpoint, token, consume=method != "HEAD")
+        if not allowed:
+            return 429, headers, {"message": "You are being rate limited, slow down!"}
+        if method == "HEAD":
+            return 200, headers, b""
+
+        if endpoint == "get_size":
+            return 200, headers, {"width": self.size.width, "height": self.size.height}
+        if endpoint == "get_pixels":
+            with self._lock:
+                return 200, headers, bytes(self.canvas)
+
+        try:
+            x, y = int(params["x"]), int(params["y"])
+        except (KeyError, ValueError):
+            return 422, headers, {"detail": [{"loc": ["body", "x"], "msg": "field required", "type": "value_error"}]}
+        for name, value, size in (("x", x, self.size.width), ("y", y, self.size.height)):
+            if not 0 <= value < size:
+                msg = f"{name} must be in range [0, {size})"
+                return 422, headers, {"detail": [{"loc": ["body", name], "msg": msg, "type": "value_error"}]}
+
+        if endpoint == "get_pixel":
+            index = (y * self.size.width + x) * 3
+            with self._lock:
+                return 200, headers, {"x": x, "y": y, "rgb": self.canvas[index:index + 3].hex().upper()}
+
+        rgb = str(body.get("rgb", ""))
+        if not re.fullmatch(r"[0-9a-fA-F]{6}", rgb):
+            msg = f"'{rgb}' is not a valid color"
+            return 422, headers, {"detail": [{"loc": ["body", "rgb"], "msg": msg, "type": "value_error"}]}
+        self.set_pixel(x, y, rgb)
+        return 200, headers, {"message": f"added pixel at x={x},y={y} of color {rgb}"}
+
+
+class _EmulatorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are sent separately, Nagle's algorithm would delay the body of every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args):
+        logger.debug(f"Emulator: {format % args}")
+
+    def _handle(self):
+        emulator: PixelsEmulator = self.server.emulator  # type: ignore - custom attribute
+        url = urlsplit(self.path)
+        endpoint = url.path.strip("/")
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = {}
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            try:
+                body = json.loads(self.rfile.read(length))
+            except json.JSONDecodeError:
+                pass
+        if endpoint == "set_pixel":
+            params = body
+
+        token = None
+        authorization = self.headers.get("Authorization", "")
+        if authorization.startswith("Bearer "):
+            token = authorization[len("Bearer "):]
+
+        status, headers, response = emulator.handle(self.command, endpoint, token, params, body)
+        if isinstance(response, bytes):
+            data, content_type = response, "application/octet-stream"
+        else:
+            data, content_type = json.dumps(response).encode(), "application/json"
+        with emulator._lock:
+            emulator.stats[endpoint, status] += 1
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    do_GET = do_POST = do_HEAD = _handle  # noqa: N815 - names required by BaseHTTPRequestHandler
+
+
+def main(argv: Optional[List[str]] = None):
+    """Run the emulator until it's interrupted."""
+    parser = argparse.ArgumentParser(description="Emulate the pixels API locally.")
+    parser.add_argument("--width", type=int, default=160)
+    parser.add_argument("--height", type=int, default=90)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--jitter", type=float, default=0)
+    parser.add_argument("--attack-rate", type=float, default=0, help="Number of pixels overwritten by adversaries per second")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument(
+        "--limit", action="append", default=[], metavar="ENDPOINT=LIMIT/PERIOD",
+        help="Override the rate limits of an endpoint, i.e. 'set_pixel=1/0.5', or 'set_pixel=none' to disable them"
+    )
+    args = parser.parse_args(argv)
+
+    limits: Dict[str, Optional[EndpointLimits]] = {}
+    for override in args.limit:
+        endpoint, _, value = override.partition("=")
+        if value.lower() == "none":
+            limits[endpoint] = None
+        else:
+            limit, _, period = value.partition("/")
+            limits[endpoint] = EndpointLimits(int(limit), float(period))
+
+    emulator = PixelsEmulator(
+        args.width, args.height,
+        limits=limits, latency=args.latency, jitter=args.jitter,
+        attack_rate=args.attack_rate, seed=args.seed,
+    )
+    emulator.serve((args.host, args.port))
+    logger.info(f"Pixels API emulator is running on {emulator.url}")
+
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"Emulator stats: {dict(emulator.stats)}, attacked pixels: {emulator.attacked}")
+    except KeyboardInterrupt:
+        emulator.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,42 @@
 import re
 from json.decoder import JSONDecodeError
-from typing import Any, Optional, Union
+from typing import Any, Mapping, Optional, Protocol, Union
 
 import requests
 
 from pydispix.ratelimits import RateLimitedEndpoint
 
 
+class HTTPResponse(Protocol):
+    """
+    The part of the interface of `requests` and `httpx` responses used by the error handling,
+    so that the same exceptions can be raised for the responses of both of the clients.
+    """
+    status_code: int
+
+    @property
+    def url(self) -> Any: ...
+
+    @property
+    def headers(self) -> Mapping[str, str]: ...
+
+    @property
+    def content(self) -> bytes: ...
+
+    def json(self, **kwargs) -> Any: ...
+
+
 class PyDisPixError(Exception):
     """Parent class for all exceptions defined by this library"""
 
 
 class RateLimitBreached(PyDisPixError):
     """Request failed due to rate limit breach."""
-    def __init__(self, *args, response: requests.Response, **kwargs):
+    def __init__(self, *args, response: HTTPResponse, **kwargs):
         super().__init__(*args, **kwargs)
 
         # Get time limits from headers with RateLimitedEndpoint
-        temp_rate_limit = RateLimitedEndpoint(response.url)
+        temp_rate_limit = RateLimitedEndpoint(str(response.url))
         temp_rate_limit.update_from_headers(response.headers)
 
         self.requests_limit = temp_rate_limit.requests_limit
@@ -64,7 +83,7 @@ class OutOfBoundaries(PyDisPixError):
     """Status code 422 - tried to draw a pixel outside of the canvas"""
 
 
-def handle_invalid_body(response: requests.Response) -> Union[PyDisPixError, requests.HTTPError]:
+def handle_invalid_body(response: HTTPResponse) -> Union[PyDisPixError, requests.HTTPError]:
     """
     Handle 442 (invalid body) error code. This code can mean many things,
     this function analyzes what exactly does the 442 refer to, and returns
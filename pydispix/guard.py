@@ -0,0 +1,200 @@
+"""Guarding drawn images, repairing the most important damaged pixels first."""
+import logging
+import time
+from typing import Generic, Iterator, List, Optional, TYPE_CHECKING, Tuple, TypeVar
+
+import numpy as np
+
+from pydispix.canvas import Canvas
+from pydispix.client import Client
+
+if TYPE_CHECKING:
+    from pydispix.autodraw import AutoDrawer, _BaseAutoDrawer
+
+logger = logging.getLogger("pydispix")
+
+# Type of the drawers of a guard or a multi auto drawer
+DrawerType = TypeVar("DrawerType", bound="_BaseAutoDrawer")
+
+
+class _BaseGuard(Generic[DrawerType]):
+    """The damage tracking of a guard, shared by the regular and the asynchronous guards, see `Guard`."""
+
+    def __init__(
+        self,
+        drawers: List[DrawerType],
+        priorities: Optional[List[float]] = None,
+        *,
+        priority_weight: float = 1,
+        age_weight: float = 0.01,
+        heat_weight: float = 1,
+        heat_half_life: float = 600,
+        interval: float = 5,
+        min_interval: float = 1,
+        max_interval: float = 60,
+    ):
+        if priorities is None:
+            priorities = [len(drawers) - index for index in range(len(drawers))]
+        if len(priorities) != len(drawers):
+            raise ValueError("Every drawer needs to have a priority.")
+
+        self.drawers = drawers
+        self.priorities = priorities
+        self.priority_weight = priority_weight
+        self.age_weight = age_weight
+        self.heat_weight = heat_weight
+        self.heat_half_life = heat_half_life
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        # Per-drawer (height, width) arrays of the known damage, the monotonic time the pixel
+        # was damaged at (infinity for pixels which aren't damaged) and the attack heat map
+        self.damaged = [np.zeros(drawer.target.shape[:2], dtype=bool) for drawer in drawers]
+        self.damaged_at = [np.full(drawer.target.shape[:2], np.inf) for drawer in drawers]
+        self.heat = [np.zeros(drawer.target.shape[:2]) for drawer in drawers]
+
+        self.tamper_rate: Optional[float] = None  # Smoothed number of attacked pixels per second
+        self.updated_at: Optional[float] = None
+        # Timestamp of the last observed canvas, a cached canvas can be returned more than once
+        self.canvas_timestamp: Optional[float] = None
+        # Damaged pixels as (drawer index, x, y), sorted by their score, highest last
+        self.queue: List[Tuple[int, int, int]] = []
+
+    def update(self, canvas: Canvas):
+        """
+        Find the damage on a newly fetched canvas, re-build the queue and adapt the re-fetch interval.
+        An already observed canvas (e.g. returned again by a `CanvasCache`) is ignored, it doesn't show any new attacks.
+        """
+        if canvas.timestamp == self.canvas_timestamp:
+            logger.debug("Guard got an already observed canvas, ignoring it.")
+            return
+        self.canvas_timestamp = canvas.timestamp
+
+        now = time.monotonic()
+        first_update = self.updated_at is None
+        elapsed = now - self.updated_at if self.updated_at is not None else 0
+
+        attacks = 0
+        for index, drawer in enumerate(self.drawers):
+            mask = drawer._mismatch_mask(canvas)
+            attacked = mask & ~self.damaged[index]
+            if not first_update:
+                attacks += int(attacked.sum())
+                self.heat[index] *= 0.5 ** (elapsed / self.heat_half_life)
+                self.heat[index][attacked] += 1
+            self.damaged_at[index][attacked] = now
+            self.damaged_at[index][~mask] = np.inf
+            self.damaged[index] = mask
+
+        if not first_update and elapsed > 0:
+            self._adapt_interval(attacks / elapsed)
+        self.updated_at = now
+        self._build_queue()
+
+        logger.debug(f"Guard found {len(self.queue)} damaged pixels ({attacks} new), re-fetching every {self.interval:.1f}s.")
+
+    def _adapt_interval(self, tamper_rate: float):
+        """Re-fetch about as often as a new pixel gets attacked."""
+        if self.tamper_rate is None:
+            self.tamper_rate = tamper_rate
+        else:
+            self.tamper_rate = 0.5 * self.tamper_rate + 0.5 * tamper_rate
+
+        if self.tamper_rate == 0:
+            interval = self.interval * 2
+        else:
+            interval = 1 / self.tamper_rate
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+
+    def _build_queue(self):
+        """Sort all of the damaged pixels by their score."""
+        # The age of all pixels grows at the same rate, so the order doesn't change over time, and
+        # the score can use the negated time of the damage, instead of the age at a specific moment
+        indices, xs, ys, scores = [], [], [], []
+        for index, drawer in enumerate(self.drawers):
+            # Transpose, so that the pixels with the same score are in the order of `_iter_coords`
+            dxs, dys = np.nonzero(self.damaged[index].T)
+            score = (
+                self.priority_weight * self.priorities[index]
+                + self.heat_weight * self.heat[index][dys, dxs]
+                - self.age_weight * self.damaged_at[index][dys, dxs]
+            )
+            indices.append(np.full(len(dxs), index))
+            xs.append(dxs + drawer.x0)
+            ys.append(dys + drawer.y0)
+            scores.append(score)
+
+        if not scores:
+            self.queue = []
+            return
+        # Stable sort of negated scores, reversed, to pop the highest scoring pixels from the end
+        order = np.argsort(-np.concatenate(scores), kind="stable")[::-1]
+        self.queue = list(zip(
+            np.concatenate(indices)[order].tolist(),
+            np.concatenate(xs)[order].tolist(),
+            np.concatenate(ys)[order].tolist(),
+        ))
+
+    def pop(self) -> Optional[Tuple[DrawerType, int, int]]:
+        """Take the damaged pixel with the highest score from the queue, marking it as repaired."""
+        if not self.queue:
+            return None
+        index, x, y = self.queue.pop()
+        drawer = self.drawers[index]
+        self.damaged[index][y - drawer.y0, x - drawer.x0] = False
+        self.damaged_at[index][y - drawer.y0, x - drawer.x0] = np.inf
+        return drawer, x, y
+
+    def _iter_repairs(self, canvas: Canvas) -> Iterator[Tuple[DrawerType, int, int]]:
+        """
+        Take the damaged pixels from the queue, until it's time to re-fetch the canvas, or there are none left.
+        A shared canvas is re-fetched right away once it's no longer valid, instead of reading the data being overwritten.
+        """
+        while canvas.is_valid and time.monotonic() < canvas.timestamp + self.interval:
+            damaged_pixel = self.pop()
+            if damaged_pixel is None:
+                return
+            yield damaged_pixel
+
+    def _fetch_delay(self, canvas: Canvas) -> float:
+        """Get the number of seconds to wait before re-fetching the canvas, `interval` seconds after it was fetched."""
+        if not canvas.is_valid:
+            return 0
+        return max(canvas.timestamp + self.interval - time.monotonic(), 0)
+
+
+class Guard(_BaseGuard["AutoDrawer"]):
+    """
+    Keep the images of given drawers on the canvas, repairing the damaged pixels by priority.
+
+    Every fetched canvas is compared with the previous one (including our own repairs),
+    pixels which were correct before, but aren't anymore, were attacked. The damaged pixels
+    are then repaired in the order of their score, which is a weighted sum of:
+    - `priority` of the image (by default, the first drawer has the highest priority)
+    - the time (in seconds) since the pixel was damaged
+    - the heat of the pixel, which is the number of times it was attacked, halved every `heat_half_life` seconds
+
+    The canvas is re-fetched every `interval` seconds, which adapts to the observed rate of
+    attacks, between `min_interval` and `max_interval`. When the pixels are attacked often,
+    the canvas is re-fetched more often, so that the queue follows the damage closely, and
+    when the images are left alone, it's re-fetched less and less often.
+    """
+
+    def __init__(self, client: Client, drawers: List["AutoDrawer"], *args, **kwargs):
+        super().__init__(drawers, *args, **kwargs)
+        self.client = client
+
+    def run(self, canvas: Optional[Canvas] = None, show_progress: bool = True):
+        """Keep repairing the damaged pixels, re-fetching the canvas every `interval` seconds."""
+        if canvas is None:
+            canvas = self.client.get_canvas()
+        self.update(canvas)
+
+        while True:
+            for drawer, x, y in self._iter_repairs(canvas):
+                drawer.draw_pixel(canvas, x, y, show_progress=show_progress)
+
+            time.sleep(self._fetch_delay(canvas))
+            canvas = self.client.get_canvas(max_age=self.interval)
+            self.update(canvas)
@@ -0,0 +1,283 @@
+"""
+Recording the history of the canvas into a compact, append-only file.
+
+A `CanvasRecorder` stores a full canvas (keyframe) only once in a while, and only the pixels
+changed since the previous canvas (delta) otherwise, all of them compressed. The recorded
+history can be read with `CanvasHistory`, which memory-maps the file, so it can be read
+while it's still being recorded. The recorder can also be started from the command line,
+using the token from the `TOKEN` environmental variable:
+`python -m pydispix.history canvas.history --interval 5`.
+"""
+import argparse
+import bisect
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from pydispix.canvas import Canvas, CanvasDiff, Dimensions
+from pydispix.client import Client
+from pydispix.errors import CanvasFormatError
+
+logger = logging.getLogger("pydispix")
+
+# The file starts with the magic bytes, followed by the records. Every record starts with it's
+# kind, the wall-clock time of the canvas and the length of it's payload. Keyframes contain the
+# canvas dimensions and the compressed raw data, deltas contain the compressed gaps between the
+# indices of the changed pixels (as uint32), followed by their new RGB colors.
+_MAGIC = b"PDXHIST1"
+_RECORD = struct.Struct("<BdI")
+_SIZE = struct.Struct("<II")
+_KEYFRAME = 0
+_DELTA = 1
+
+
+def _encode_delta(diff: CanvasDiff, compression_level: int) -> bytes:
+    gaps = np.diff(diff.indices, prepend=0).astype("<u4")
+    return zlib.compress(gaps.tobytes() + diff.new.astype(np.uint8).tobytes(), compression_level)
+
+
+def _decode_delta(payload: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """Get the indices and the new colors of the pixels changed in a delta."""
+    data = zlib.decompress(payload)
+    count = len(data) // 7
+    indices = np.cumsum(np.frombuffer(data, dtype="<u4", count=count), dtype=np.int64)
+    colors = np.frombuffer(data, dtype=np.uint8, offset=count * 4).reshape(count, 3)
+    return indices, colors
+
+
+class CanvasRecorder:
+    """
+    Record canvases into the history file at `path`.
+
+    A keyframe is stored for the first canvas, when the canvas is resized, and after every
+    `keyframe_interval` deltas, which limits the number of deltas that need to be applied
+    to get a recorded canvas. Recording into an existing file continues it's history.
+    """
+
+    def __init__(self, path: str, keyframe_interval: int = 100, compression_level: int = 6):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.compression_level = compression_level
+        self.canvas: Optional[Canvas] = None
+        self._since_keyframe = 0
+        self._stopped = threading.Event()
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with CanvasHistory(path) as history:
+                if len(history) > 0:
+                    self.canvas = history[-1]
+                    self._since_keyframe = len(history) - 1 - history.keyframes[-1]
+                end = history.end
+            # Drop a record, which wasn't written completely (i.e. if the recorder was killed)
+            os.truncate(path, end)
+            self._file = open(path, "ab")
+        else:
+            self._file = open(path, "wb")
+            self._file.write(_MAGIC)
+            self._file.flush()
+
+    def __enter__(self) -> "CanvasRecorder":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write(self, kind: int, timestamp: float, payload: bytes):
+        # Written at once, so that the readers don't see a record without it's header
+        self._file.write(_RECORD.pack(kind, timestamp, len(payload)) + payload)
+        self._file.flush()
+
+    def record(self, canvas: Canvas) -> Optional[CanvasDiff]:
+        """Append given canvas to the history, return it's diff from the previous one, unless a keyframe was stored."""
+        timestamp = time.time() - canvas.age
+        # Keep our own copy, the canvas can be modified locally (i.e. by a canvas cache)
+        previous, self.canvas = self.canvas, Canvas((canvas.width, canvas.height), canvas.as_array().tobytes())
+
+        if (
+            previous is None or self._since_keyframe >= self.keyframe_interval
+            or (previous.width, previous.height) != (canvas.width, canvas.height)
+        ):
+            payload = _SIZE.pack(canvas.width, canvas.height) + zlib.compress(self.canvas.raw, self.compression_level)
+            self._write(_KEYFRAME, timestamp, payload)
+            self._since_keyframe = 0
+            return None
+
+        diff = previous.diff(self.canvas)
+        self._write(_DELTA, timestamp, _encode_delta(diff, self.compression_level))
+        self._since_keyframe += 1
+        return diff
+
+    def run(self, client: Client, interval: float = 5):
+        """Keep recording a newly fetched canvas every `interval` seconds, until the recorder is closed."""
+        self._stopped.clear()
+        while True:
+            try:
+                diff = self.record(client.get_canvas())
+            except Exception:
+                logger.exception("Unable to record the canvas.")
+            else:
+                logger.debug(f"Recorded the canvas ({'keyframe' if diff is None else f'{len(diff)} changed pixels'}).")
+            if self._stopped.wait(interval):
+                return
+
+    def start(self, client: Client, interval: float = 5) -> threading.Thread:
+        """Start recording in a background thread, see `run`."""
+        thread = threading.Thread(target=self.run, args=(client, interval), daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        """Stop recording and close the file."""
+        self._stopped.set()
+        self._file.close()
+
+
+class CanvasHistory:
+    """
+    Read the canvases recorded into the history file at `path`.
+
+    The file is memory-mapped, and only the recorded canvases which are accessed get decompressed.
+    `refresh` picks up the records appended since the file was opened, so the history can be
+    followed while it's being recorded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap: Optional[mmap.mmap] = None
+        # Kind, timestamp, offset and length of the payload of every record
+        self.records: List[Tuple[int, float, int, int]] = []
+        self.keyframes: List[int] = []
+        self.end = len(_MAGIC)
+        self.refresh()
+
+    def __enter__(self) -> "CanvasHistory":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def refresh(self):
+        """Read the headers of the records appended since the last refresh."""
+        size = os.fstat(self._file.fileno()).st_size
+        if size < len(_MAGIC):
+            raise CanvasFormatError(f"{self.path!r} isn't a canvas history file.")
+        if self._mmap is None or len(self._mmap) < size:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+            if self._mmap[:len(_MAGIC)] != _MAGIC:
+                raise CanvasFormatError(f"{self.path!r} isn't a canvas history file.")
+
+        # Stop at a record which isn't fully written yet
+        while self.end + _RECORD.size <= size:
+            kind, timestamp, length = _RECORD.unpack_from(self._mmap, self.end)
+            offset = self.end + _RECORD.size
+            if offset + length > size:
+                break
+            if kind == _KEYFRAME:
+                self.keyframes.append(len(self.records))
+            self.records.append((kind, timestamp, offset, length))
+            self.end = offset + length
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def timestamps(self) -> List[float]:
+        """Wall-clock times (as in `time.time`) of the recorded canvases."""
+        return [timestamp for _, timestamp, _, _ in self.records]
+
+    def _payload(self, index: int) -> bytes:
+        _, _, offset, length = self.records[index]
+        return self._mmap[offset:offset + length]  # type: ignore - it's always mapped by now
+
+    def _keyframe(self, index: int) -> Canvas:
+        _, _, offset, length = self.records[index]
+        width, height = _SIZE.unpack_from(self._mmap, offset)  # type: ignore - it's always mapped by now
+        data = bytearray(zlib.decompress(self._mmap[offset + _SIZE.size:offset + length]))  # type: ignore - same as above
+        return Canvas(Dimensions(width=width, height=height), data)
+
+    def _with_timestamp(self, canvas: Canvas, index: int) -> Canvas:
+        canvas.timestamp = time.monotonic() - (time.time() - self.records[index][1])
+        return canvas
+
+    def __getitem__(self, index: int) -> Canvas:
+        """Get the n-th recorded canvas, it's rebuilt from the last keyframe before it."""
+        if index < 0:
+            index += len(self.records)
+        if not 0 <= index < len(self.records):
+            raise IndexError(f"Canvas {index} wasn't recorded ({len(self.records)} canvases are recorded)")
+
+        keyframe = self.keyframes[bisect.bisect_right(self.keyframes, index) - 1]
+        canvas = self._keyframe(keyframe)
+        for delta in range(keyframe + 1, index + 1):
+            indices, colors = _decode_delta(self._payload(delta))
+            CanvasDiff((canvas.width, canvas.height), indices, colors, colors).apply(canvas)
+        return self._with_timestamp(canvas, index)
+
+    def iter_diffs(self, start: int = 0) -> Iterator[Tuple[float, CanvasDiff]]:
+        """
+        Iterate over the timestamps and the changes of the recorded canvases, since the canvas
+        at index `start`. Changes between keyframes of different sizes are skipped.
+        """
+        canvas = self[start]
+        for index in range(start + 1, len(self.records)):
+            kind, timestamp, _, _ = self.records[index]
+            if kind == _KEYFRAME:
+                new = self._keyframe(index)
+                if (new.width, new.height) == (canvas.width, canvas.height):
+                    yield timestamp, canvas.diff(new)
+                canvas = new
+                continue
+
+            indices, colors = _decode_delta(self._payload(index))
+            old = canvas.as_array().reshape(-1, 3)[indices]
+            diff = CanvasDiff((canvas.width, canvas.height), indices, old, colors)
+            diff.apply(canvas)
+            yield timestamp, diff
+
+    def __iter__(self) -> Iterator[Canvas]:
+        """Iterate over all of the recorded canvases (i.e. for a timelapse), each one is a separate copy."""
+        canvas = None
+        for index, (kind, _, _, _) in enumerate(self.records):
+            if kind == _KEYFRAME or canvas is None:
+                canvas = self._keyframe(index)
+            else:
+                indices, colors = _decode_delta(self._payload(index))
+                CanvasDiff((canvas.width, canvas.height), indices, colors, colors).apply(canvas)
+            yield self._with_timestamp(Canvas((canvas.width, canvas.height), bytes(canvas.raw)), index)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    """Record the canvas history, using the token from the `TOKEN` environmental variable."""
+    parser = argparse.ArgumentParser(description="Record the history of the pixels canvas into a file.")
+    parser.add_argument("path", help="History file, recording into an existing one continues it")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between the canvas fetches")
+    parser.add_argument("--keyframe-interval", type=int, default=100, help="Number of deltas stored between the keyframes")
+    parser.add_argument("--base-url", default="https://pixels.pythondiscord.com/")
+    args = parser.parse_args(argv)
+
+    with CanvasRecorder(args.path, args.keyframe_interval) as recorder:
+        logger.info(f"Recording the canvas into {args.path!r} every {args.interval}s")
+        try:
+            recorder.run(Client(base_url=args.base_url), args.interval)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
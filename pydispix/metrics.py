@@ -0,0 +1,204 @@
+"""Instrumentation of the requests, and a registry of metrics collected from it."""
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("pydispix")
+
+# Sorted (name, value) pairs of the labels of a metric
+LabelsType = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Instrumentation:
+    """
+    Hooks called by the clients and rate limiters, this base class ignores all of them.
+
+    Subclass this and pass it as `instrumentation` to the clients to observe the requests.
+    `token_id` identifies the token of the client, without revealing it (see `RateLimiter.key_prefix`),
+    and `url` is the url of the endpoint. The hooks are called from the threads making
+    the requests, so they need to be thread safe, and they should return quickly.
+    """
+
+    def on_request_start(self, token_id: str, method: str, url: str) -> None:
+        """Called right before a request is sent."""
+
+    def on_request_end(self, token_id: str, method: str, url: str, status: Optional[int], duration: float) -> None:
+        """Called once a response was received, `status` is `None` if the request failed without a response."""
+
+    def on_rate_limit_wait(self, token_id: str, url: str, seconds: float) -> None:
+        """Called after the rate limits of given endpoint were waited out, with the time spent waiting."""
+
+    def on_rate_limit_breach(self, token_id: str, url: str) -> None:
+        """Called when a request was refused, because it breached the rate limits."""
+
+    def on_retry(self, token_id: str, url: str) -> None:
+        """Called when a request is being repeated, after it breached the rate limits."""
+
+
+class Histogram:
+    """Distribution of observed values, counted in cumulative buckets, like the Prometheus histograms."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is the +Inf bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[int]:
+        counts, total = [], 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+
+def _format_labels(labels: LabelsType) -> str:
+    if not labels:
+        return ""
+    escaped = [(name, value.replace("\\", "\\\\").replace('"', '\\"')) for name, value in labels]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def endpoint_name(url: str) -> str:
+    """Get a short name of the endpoint at given url (the last part of it's path) to use as a label."""
+    return urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1]
+
+
+class MetricsRegistry(Instrumentation):
+    """
+    In-process registry of metrics, collected from the instrumentation hooks.
+
+    The metrics are labeled by the endpoint (see `endpoint_name`), and where it makes sense,
+    by the token (`token_id`). These are collected:
+    - `pydispix_requests_total` counter, with the method and the status code
+    - `pydispix_request_duration_seconds` histogram of the time spent on the network
+    - `pydispix_rate_limit_wait_seconds` histogram of the time spent waiting out the rate limits
+    - `pydispix_rate_limit_breaches_total` and `pydispix_retries_total` counters
+    - `pydispix_pixels_total` counter of the pixels placed by every token
+
+    A single registry can be shared by all of the clients. The metrics can be exported in the
+    Prometheus text format with `to_prometheus`, or as a dict with `snapshot`, which can also
+    be taken periodically with `start_reporting`.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counters: Dict[str, Dict[LabelsType, float]] = defaultdict(lambda: defaultdict(float))
+        self.histograms: Dict[str, Dict[LabelsType, Histogram]] = defaultdict(dict)
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._reporting: Optional[threading.Event] = None
+
+    def increment(self, name: str, labels: Dict[str, str], value: float = 1):
+        """Increment a counter with given labels."""
+        with self._lock:
+            self.counters[name][tuple(sorted(labels.items()))] += value
+
+    def observe(self, name: str, labels: Dict[str, str], value: float):
+        """Add a value to a histogram with given labels."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self.histograms[name].get(key)
+            if histogram is None:
+                histogram = self.histograms[name][key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def on_request_end(self, token_id: str, method: str, url: str, status: Optional[int], duration: float) -> None:
+        endpoint = endpoint_name(url)
+        self.increment("pydispix_requests_total", {"endpoint": endpoint, "method": method, "status": str(status)})
+        self.observe("pydispix_request_duration_seconds", {"endpoint": endpoint}, duration)
+        if endpoint == "set_pixel" and method == "POST" and status == 200:
+            self.increment("pydispix_pixels_total", {"token": token_id})
+
+    def on_rate_limit_wait(self, token_id: str, url: str, seconds: float) -> None:
+        self.observe("pydispix_rate_limit_wait_seconds", {"endpoint": endpoint_name(url)}, seconds)
+
+    def on_rate_limit_breach(self, token_id: str, url: str) -> None:
+        self.increment("pydispix_rate_limit_breaches_total", {"endpoint": endpoint_name(url), "token": token_id})
+
+    def on_retry(self, token_id: str, url: str) -> None:
+        self.increment("pydispix_retries_total", {"endpoint": endpoint_name(url)})
+
+    def to_prometheus(self) -> str:
+        """Export the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                lines.extend(f"{name}{_format_labels(labels)} {value:g}" for labels, value in sorted(series.items()))
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(series.items()):
+                    bounds = [f"{bucket:g}" for bucket in histogram.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, histogram.cumulative_counts()):
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:g}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """
+        Get the current values of the metrics as a JSON serializable dict, along with the
+        number of pixels per minute placed by every token, since the registry was created.
+        """
+        now = time.time()
+        with self._lock:
+            counters = {
+                name: [{"labels": dict(labels), "value": value} for labels, value in series.items()]
+                for name, series in self.counters.items()
+            }
+            histograms = {
+                name: [
+                    {"labels": dict(labels), "count": histogram.count, "sum": histogram.sum}
+                    for labels, histogram in series.items()
+                ]
+                for name, series in self.histograms.items()
+            }
+            pixels = self.counters.get("pydispix_pixels_total", {})
+            minutes = max(now - self.started_at, 1e-9) / 60
+            pixels_per_minute = {dict(labels)["token"]: value / minutes for labels, value in pixels.items()}
+
+        return {
+            "timestamp": now,
+            "uptime": now - self.started_at,
+            "counters": counters,
+            "histograms": histograms,
+            "pixels_per_minute": pixels_per_minute,
+        }
+
+    def start_reporting(self, interval: float = 60, callback: Optional[Callable[[dict], None]] = None):
+        """
+        Start taking a snapshot every `interval` seconds in a background thread, and pass it to
+        `callback`, by default, the snapshots are logged. Stop this with `stop_reporting`.
+        """
+        if callback is None:
+            def callback(snapshot: dict):
+                logger.info(f"Metrics snapshot: {snapshot}")
+
+        self.stop_reporting()
+        stopped = self._reporting = threading.Event()
+
+        def report():
+            while not stopped.wait(interval):
+                try:
+                    callback(self.snapshot())  # type: ignore - it's always set by now
+                except Exception:
+                    logger.exception("Metrics reporting callback failed.")
+
+        threading.Thread(target=report, daemon=True).start()
+
+    def stop_reporting(self):
+        if self._reporting is not None:
+            self._reporting.set()
+            self._reporting = None
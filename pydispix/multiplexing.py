@@ -1,9 +1,14 @@
 import logging
 from typing import Iterator, List, Optional, Tuple
 
-from pydispix.autodraw import AutoDrawer
+import numpy as np
+
+from pydispix.autodraw import AutoDrawer, GridType
+from pydispix.canvas import Canvas, CanvasCache
 from pydispix.client import Client
-from pydispix.color import Pixel
+from pydispix.metrics import Instrumentation
+from pydispix.partitioners import ModuloPartitioner, Partitioner
+from pydispix.stores import RateLimitStore
 
 logger = logging.getLogger('pydispix')
 
@@ -13,9 +18,14 @@ class DistributedClient(Client):
         self,
         token: Optional[str] = None,
         base_url: str = "https://pixels.pythondiscord.com/",
+        pool_size: int = 10,
+        rate_limit_store: Optional[RateLimitStore] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        canvas_cache: Optional[CanvasCache] = None,
         *,
         total_tasks: int,
         controlled_tasks: List[int],
+        partitioner: Optional[Partitioner] = None,
     ):
         """
         Add possibility to split tasks across multiple clients.
@@ -31,26 +41,78 @@ class DistributedClient(Client):
             You usually want `total_tasks` to be equal to the number of your machines,
             since there is no real reason to give machines more than 1 controlled task,
             but as seen from the example, it is possible, if needed.
+
+        `partitioner` decides which pixels belong to which task, by default, the tasks are
+        interleaved pixel by pixel (`ModuloPartitioner`). Partitioners which give every task
+        a compact region of the image (i.e. `TilePartitioner`) mean that every client only
+        needs to compare and guard it's own part of the image.
         """
-        super().__init__(token, base_url)
+        super().__init__(token, base_url, pool_size, rate_limit_store, instrumentation, canvas_cache)
 
         self.total_tasks = total_tasks
         self.controlled_tasks = controlled_tasks
+        self.partitioner = partitioner if partitioner is not None else ModuloPartitioner()
 
 
 class DistributedAutoDrawer(AutoDrawer):
-    def __init__(self, client: DistributedClient, x: int, y: int, grid: List[List[Pixel]]):
+    def __init__(self, client: DistributedClient, x: int, y: int, grid: GridType):
         super().__init__(client, x, y, grid)
         # Redefine client for proper type highlights
         self.client: DistributedClient = client
+        # Mask of the pixels of the image, controlled by our tasks, along with the
+        # (canvas width, canvas height, total tasks, controlled tasks, partitioner) it was computed for
+        self._ownership_mask_key: Optional[Tuple[int, int, int, Tuple[int, ...], Partitioner]] = None
+        self._ownership_mask_cache: Optional[np.ndarray] = None
+        # Slices of the smallest part of the image, which contains all of the controlled pixels
+        self._ownership_bounds: Tuple[slice, slice] = (slice(0, 0), slice(0, 0))
 
-    def _iter_coords(self) -> Iterator[Tuple[int, int]]:
-        iter_coords = super()._iter_coords()
-        width, _ = self.client.get_dimensions()
-        for x, y in iter_coords:
-            pixel_no = y * width + x
-            task_no = pixel_no % self.client.total_tasks
-            if task_no in self.client.controlled_tasks:
-                yield x, y
+    def _ownership_mask(self, canvas_width: int, canvas_height: int) -> np.ndarray:
+        """
+        Get a (height, width) boolean array of the image, which is `True` for the pixels controlled by our tasks.
+
+        This is only computed again when the canvas size, the tasks or the partitioner of the client change.
+        """
+        key = (
+            canvas_width, canvas_height,
+            self.client.total_tasks, tuple(self.client.controlled_tasks),
+            self.client.partitioner
+        )
+        if key != self._ownership_mask_key:
+            ys, xs = np.mgrid[self.y0:self.y1, self.x0:self.x1]
+            task_nos = self.client.partitioner.assign(
+                xs, ys, (self.x0, self.y0, self.x1, self.y1),
+                canvas_width, self.client.total_tasks
+            )
+            mask = np.isin(task_nos, self.client.controlled_tasks)
+
+            rows, columns = np.nonzero(mask.any(axis=1))[0], np.nonzero(mask.any(axis=0))[0]
+            if len(rows) == 0:
+                self._ownership_bounds = (slice(0, 0), slice(0, 0))
             else:
-                logger.debug(f"Skipping uncontrolled pixel ({x}, {y} - leaving for task {task_no}")
+                self._ownership_bounds = (slice(rows[0], rows[-1] + 1), slice(columns[0], columns[-1] + 1))
+
+            self._ownership_mask_cache = mask
+            self._ownership_mask_key = key
+            logger.debug(f"Controlling {mask.sum()} of {mask.size} pixels of the image.")
+        return self._ownership_mask_cache  # type: ignore - always set when the key matches
+
+    def _iter_coords(self) -> Iterator[Tuple[int, int]]:
+        # Transpose the mask, so that `nonzero` sorts the results by x first, like `AutoDrawer._iter_coords`
+        xs, ys = np.nonzero(self._ownership_mask(*self.canvas_size).T)
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            yield self.x0 + x, self.y0 + y
+
+    def _mismatch_mask(self, canvas: Canvas) -> np.ndarray:
+        """
+        Only consider mismatched pixels which belong to one of our controlled tasks.
+
+        Only the part of the image containing our pixels is compared with the canvas,
+        which, with a partitioner giving us a compact region, is just a fraction of it.
+        """
+        ownership_mask = self._ownership_mask(canvas.width, canvas.height)
+        rows, columns = self._ownership_bounds
+
+        area = canvas.region(self.x0, self.y0, self.x1, self.y1)[rows, columns]
+        mask = np.zeros(ownership_mask.shape, dtype=bool)
+        mask[rows, columns] = (area != self.target[rows, columns]).any(axis=2) & ownership_mask[rows, columns]
+        return mask
@@ -0,0 +1,139 @@
+"""Strategies for splitting the pixels of an image between the tasks of `DistributedClient`s."""
+import math
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Image area on the canvas, as (x0, y0, x1, y1), where (x1, y1) is exclusive
+BoundsType = Tuple[int, int, int, int]
+
+
+class Partitioner(ABC):
+    """
+    Assign every pixel of an image to one of the tasks.
+
+    All of the collaborating clients need to use the same partitioner, with the same
+    `total_tasks`, otherwise some pixels would be drawn by multiple clients, and some
+    by none of them.
+    """
+
+    @abstractmethod
+    def assign(self, xs: np.ndarray, ys: np.ndarray, bounds: BoundsType, canvas_width: int, total_tasks: int) -> np.ndarray:
+        """
+        Get the task numbers of pixels at given canvas coordinates.
+
+        `xs` and `ys` are (height, width) arrays of the coordinates of all pixels of the image,
+        placed on the canvas at `bounds`. Returns an array of the same shape, with task numbers
+        from 0 to `total_tasks - 1`.
+        """
+
+
+def _weighted_tasks(positions: np.ndarray, weights: Optional[List[float]], total_tasks: int) -> np.ndarray:
+    """Split positions (from 0 to 1) to consecutive ranges, one per task, sized by the weights of the tasks."""
+    if weights is None:
+        weights = [1] * total_tasks
+    if len(weights) != total_tasks:
+        raise ValueError(f"Got {len(weights)} weights for {total_tasks} tasks, every task needs to have a weight.")
+
+    boundaries = np.cumsum(weights, dtype=np.float64)
+    boundaries /= boundaries[-1]
+    return np.minimum(np.searchsorted(boundaries, positions, side="right"), total_tasks - 1)
+
+
+class ModuloPartitioner(Partitioner):
+    """
+    Interleave the tasks, pixel by pixel, going through the canvas row by row.
+
+    This is the default partitioner, each task gets pixels scattered across the whole image.
+    """
+
+    def assign(self, xs: np.ndarray, ys: np.ndarray, bounds: BoundsType, canvas_width: int, total_tasks: int) -> np.ndarray:
+        return (ys * canvas_width + xs) % total_tasks
+
+
+class RowBandPartitioner(Partitioner):
+    """
+    Split the image into horizontal bands of rows, one per task.
+
+    `weights` can be used to give some tasks a bigger share of the image (i.e. the tasks
+    ran by machines with more tokens), by default, all of the bands have the same height.
+    """
+
+    def __init__(self, weights: Optional[List[float]] = None):
+        self.weights = weights
+
+    def assign(self, xs: np.ndarray, ys: np.ndarray, bounds: BoundsType, canvas_width: int, total_tasks: int) -> np.ndarray:
+        _, y0, _, y1 = bounds
+        positions = (ys - y0) / (y1 - y0)
+        return _weighted_tasks(positions, self.weights, total_tasks)
+
+
+class TilePartitioner(Partitioner):
+    """
+    Split the image into rectangular tiles of (nearly) equal area, one per task.
+
+    The image is split into bands of rows, and each band into columns, with the height of
+    every band proportional to it's number of columns. The number of rows is picked so that
+    the tiles are as close to squares as possible, which keeps the pixels of every task
+    close to each other.
+    """
+
+    def assign(self, xs: np.ndarray, ys: np.ndarray, bounds: BoundsType, canvas_width: int, total_tasks: int) -> np.ndarray:
+        x0, y0, x1, y1 = bounds
+        rows = min(max(round(math.sqrt(total_tasks * (y1 - y0) / (x1 - x0))), 1), total_tasks)
+        # The first rows get an extra column, if the tasks can't be split evenly
+        columns_per_row = np.array([total_tasks // rows + (row < total_tasks % rows) for row in range(rows)])
+        first_task_of_row = np.concatenate(([0], np.cumsum(columns_per_row)[:-1]))
+
+        # The height of every row is proportional to it's number of columns, so that all of the tiles have the same area
+        row = _weighted_tasks((ys - y0) / (y1 - y0), columns_per_row.tolist(), rows)
+        columns = columns_per_row[row]
+        column = np.minimum((xs - x0) * columns // (x1 - x0), columns - 1)
+        return first_task_of_row[row] + column
+
+
+def _hilbert_index(xs: np.ndarray, ys: np.ndarray, order: int) -> np.ndarray:
+    """Get the distances of given points along a Hilbert curve, filling a square of `2 ** order` points."""
+    side = 1 << order
+    xs = xs.astype(np.int64)
+    ys = ys.astype(np.int64)
+    distances = np.zeros(xs.shape, dtype=np.int64)
+
+    s = side // 2
+    while s > 0:
+        rx = (xs & s) > 0
+        ry = (ys & s) > 0
+        distances += s * s * ((3 * rx) ^ ry)
+
+        # Rotate the quadrant, so that the curve continues from the end of the previous one
+        flip = ~ry & rx
+        xs = np.where(flip, side - 1 - xs, xs)
+        ys = np.where(flip, side - 1 - ys, ys)
+        xs, ys = np.where(~ry, ys, xs), np.where(~ry, xs, ys)
+        s //= 2
+    return distances
+
+
+class HilbertPartitioner(Partitioner):
+    """
+    Split the image into consecutive ranges of a Hilbert curve, filling the image, one per task.
+
+    Unlike bands or tiles, this works well for any number of tasks and any shape of the image,
+    every task gets a compact region, with the pixels close to each other.
+    `weights` work the same as in `RowBandPartitioner`.
+    """
+
+    def __init__(self, weights: Optional[List[float]] = None):
+        self.weights = weights
+
+    def assign(self, xs: np.ndarray, ys: np.ndarray, bounds: BoundsType, canvas_width: int, total_tasks: int) -> np.ndarray:
+        x0, y0, x1, y1 = bounds
+        order = max(math.ceil(math.log2(max(x1 - x0, y1 - y0, 1))), 0)
+        distances = _hilbert_index(xs - x0, ys - y0, order)
+
+        # Split the pixels (rather than the curve, which can go outside of the image) to the ranges
+        ranks = np.empty(distances.size, dtype=np.int64)
+        ranks[np.argsort(distances, axis=None)] = np.arange(distances.size)
+        positions = ranks.reshape(distances.shape) / distances.size
+        return _weighted_tasks(positions, self.weights, total_tasks)
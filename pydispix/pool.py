@@ -0,0 +1,319 @@
+"""Pool of multiple tokens, sharing the work of drawing pixels."""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Set, Tuple, Union
+
+from pydispix.autodraw import AutoDrawer, MultiAutoDrawer
+from pydispix.canvas import Canvas, CanvasCache, Dimensions, Pixel
+from pydispix.client import Client
+from pydispix.color import ResolvableColor, parse_color
+from pydispix.errors import RateLimitBreached
+from pydispix.guard import _BaseGuard
+from pydispix.metrics import Instrumentation
+from pydispix.stores import RateLimitStore
+
+logger = logging.getLogger("pydispix")
+
+
+@dataclass
+class PixelWrite:
+    """A pending pixel write in the queue of the `TokenPool`."""
+    x: int
+    y: int
+    color: ResolvableColor
+    future: Future = field(default_factory=Future)
+
+
+class TokenWorkers:
+    """
+    Base of the pools of multiple pixel API tokens, where every token has it's own worker thread.
+
+    Each worker waits out the `set_pixel` rate limits of it's token (including the anti-spam
+    `retry-after` delay, which applies to all of our tokens, so when one of them hits it, all of
+    them wait it out), and only then takes the next job with `_take_job` and draws it with `_run_job`.
+    A worker stops once `_take_job` returns `None`, if it's token can't be used (i.e. if it's
+    invalid), or right away once `_stopped` is set, even while it's waiting out the rate limits.
+    Once the last worker stops because of an error, `_on_workers_failed` is called with it.
+    """
+
+    def __init__(self, clients: List[Client]):
+        self.clients = clients
+        self.anti_spam_until = 0.0
+        self.live_workers = 0
+        # Error which stopped the last worker, if all of them failed
+        self.workers_error: Optional[Exception] = None
+        self._workers_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def _take_job(self) -> Optional[Any]:
+        """Get the next job for a worker, which is ready to draw, `None` stops the worker."""
+        raise NotImplementedError
+
+    def _run_job(self, client: Client, url: str, job: Any) -> None:
+        """Make the `set_pixel` request of a job, with given client."""
+        raise NotImplementedError
+
+    def _on_workers_failed(self, exception: Exception) -> None:
+        """Called once all of the workers stopped, the last one because of given exception."""
+
+    def _start_workers(self, show_progress: bool = False) -> List[threading.Thread]:
+        with self._workers_lock:
+            self.live_workers += len(self.clients)
+            self.workers_error = None
+        workers = [
+            threading.Thread(target=self._run_worker, args=(client, show_progress), daemon=True)
+            for client in self.clients
+        ]
+        for worker in workers:
+            worker.start()
+        return workers
+
+    def _run_worker(self, client: Client, show_progress: bool = False):
+        """Keep running the jobs with given client, waiting out it's rate limits in between."""
+        url = client.resolve_endpoint("set_pixel")
+        error = None
+        try:
+            # We don't know the rate limits of this token yet, obtain them without using up a request
+            if client.rate_limiter.needs_update(url):
+                client.make_raw_request("HEAD", url, headers=client.headers)
+
+            while True:
+                if not client.rate_limiter.wait(url, show_progress=show_progress, stop=self._stopped):
+                    return
+                anti_spam_delay = self.anti_spam_until - time.monotonic()
+                if anti_spam_delay > 0:
+                    logger.warning(f"Sleeping {anti_spam_delay:.1f}s, anti-spam cooldown was triggered by another token.")
+                    if self._stopped.wait(anti_spam_delay):
+                        return
+
+                job = self._take_job()
+                if job is None:
+                    return
+                self._run_job(client, url, job)
+
+                anti_spam_delay = client.rate_limiter.rate_limits[url].anti_spam_delay
+                if anti_spam_delay != 0:
+                    with self._workers_lock:
+                        self.anti_spam_until = max(self.anti_spam_until, time.monotonic() + anti_spam_delay)
+        except Exception as exc:
+            logger.exception("Token worker failed, it's token won't be used anymore.")
+            error = exc
+        finally:
+            with self._workers_lock:
+                self.live_workers -= 1
+                failed = error is not None and self.live_workers == 0
+                if failed:
+                    self.workers_error = error
+            if failed:
+                self._on_workers_failed(error)  # type: ignore - it's set if we failed
+
+
+class TokenPool(TokenWorkers):
+    """
+    Pool of multiple pixel API tokens, sharing a queue of pending pixel writes.
+
+    Every token has it's own client (and so it's own rate limits) and it's own worker
+    thread, which takes the next pending write from the queue once it's ready to draw
+    (see `TokenWorkers`), which means every write is made by the token, which is available
+    first. If a write hits a rate limit anyway, it is put back to the queue for another token.
+    If none of the tokens can be used, the pending writes fail, and so do the new ones.
+
+    Read-only requests (`get_canvas`, `get_pixel`, `get_dimensions`) are made with
+    a separate client, using the first token, so they can be made while drawing.
+
+    Pass a `rate_limit_store` to share the rate limits of the tokens with other clients
+    or processes, which use the same tokens (see `SQLiteRateLimitStore`), and a `canvas_cache`
+    to share the fetched canvas with other clients (see `CanvasCache`).
+    """
+
+    def __init__(
+        self,
+        tokens: List[str],
+        base_url: str = "https://pixels.pythondiscord.com/",
+        pool_size: int = 10,
+        rate_limit_store: Optional[RateLimitStore] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        canvas_cache: Optional[CanvasCache] = None,
+    ):
+        if len(tokens) == 0:
+            raise ValueError("Token pool needs at least one token.")
+
+        super().__init__([Client(token, base_url, pool_size, rate_limit_store, instrumentation) for token in tokens])
+        self.reader = Client(tokens[0], base_url, pool_size, rate_limit_store, instrumentation, canvas_cache)
+        self.canvas_cache = canvas_cache
+        self.queue: "queue.Queue[Optional[PixelWrite]]" = queue.Queue()
+        self.workers: List[threading.Thread] = []
+
+    def __enter__(self) -> "TokenPool":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        """Start the worker threads, this is done automatically once a write is submitted."""
+        if not self.workers:
+            self._stopped.clear()
+            self.workers = self._start_workers()
+
+    def close(self):
+        """Stop the worker threads, once they finish all of the pending writes, and close the clients."""
+        self.queue.join()
+        # Wake up the workers waiting out their rate limits, and the ones waiting for a write
+        self._stopped.set()
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers.clear()
+        # Drop the `None`s, which weren't taken by the workers stopped while waiting out their rate limits
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.queue.task_done()
+
+        for client in self.clients:
+            client.close()
+        self.reader.close()
+
+    def _take_job(self) -> Optional[PixelWrite]:
+        write = self.queue.get()
+        if write is None:
+            self.queue.task_done()
+        return write
+
+    def _run_job(self, client: Client, url: str, write: PixelWrite) -> None:
+        try:
+            response = client.make_raw_request(
+                "POST", url,
+                data={
+                    "x": write.x,
+                    "y": write.y,
+                    "rgb": parse_color(write.color)
+                },
+                headers=client.headers,
+            )
+        except RateLimitBreached:
+            logger.warning(f"Pixel write ({write.x}, {write.y}) hit a rate limit, putting it back to the queue.")
+            client.instrumentation.on_retry(client.rate_limiter.key_prefix, url)
+            self._put(write)
+        except Exception as exc:
+            write.future.set_exception(exc)
+        else:
+            msg = response.json()["message"]
+            logger.info(f"Success: {msg}")
+            write.future.set_result(msg)
+            if self.canvas_cache is not None:
+                self.canvas_cache.set_pixel(write.x, write.y, tuple(bytes.fromhex(parse_color(write.color))))
+        finally:
+            self.queue.task_done()
+
+    def _on_workers_failed(self, exception: Exception) -> None:
+        """Fail all of the pending writes, since there are no workers left to make them."""
+        with self._workers_lock:
+            while True:
+                try:
+                    write = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if write is not None:
+                    write.future.set_exception(exception)
+                self.queue.task_done()
+
+    def _put(self, write: PixelWrite):
+        with self._workers_lock:
+            if self.workers_error is not None:
+                raise self.workers_error
+            self.queue.put(write)
+
+    def submit(self, x: int, y: int, color: ResolvableColor) -> "Future[str]":
+        """
+        Add a pixel write to the queue, returning a future with the result message.
+        If none of the tokens can be used, the error which stopped the last of them is raised.
+        """
+        self.start()
+        write = PixelWrite(x, y, color)
+        self._put(write)
+        return write.future
+
+    def join(self):
+        """Wait until all of the pending writes are made."""
+        self.queue.join()
+
+    def put_pixel(self, x: int, y: int, color: ResolvableColor, show_progress: bool = False) -> str:
+        """Draw a pixel with the first available token and return a message."""
+        return self.submit(x, y, color).result()
+
+    set_pixel = put_pixel
+
+    def get_dimensions(self) -> Dimensions:
+        """Make a request to obtain the canvas dimensions"""
+        return self.reader.get_dimensions()
+
+    def get_canvas(self, show_progress: bool = False, max_age: Optional[float] = None) -> Canvas:
+        """Fetch the whole canvas and return it in a `Canvas` object, or use the cached one, see `Client.get_canvas`."""
+        return self.reader.get_canvas(show_progress=show_progress, max_age=max_age)
+
+    def get_pixel(self, x: int, y: int, show_progress: bool = False) -> Pixel:
+        """Fetch rgb data about a specific pixel"""
+        return self.reader.get_pixel(x, y, show_progress=show_progress)
+
+    def _wait_for_writes(self, writes: List[Tuple[int, int, "Future[str]"]]):
+        """Wait until given writes are made, logging the ones which failed."""
+        wait([future for _, _, future in writes])
+        for x, y, future in writes:
+            if future.exception() is not None:
+                logger.error(f"Failed to draw pixel ({x}, {y}): {future.exception()}")
+
+    def _guard(self, drawers: List[AutoDrawer], interval: float):
+        """
+        Keep the images of given drawers on the canvas, repairing the damaged pixels by priority, like `Guard.run`,
+        with all of the tokens at once. Only one write per token is kept in the queue, so that newly damaged pixels
+        with higher scores don't have to wait behind all of the others.
+        """
+        guard: "_BaseGuard[AutoDrawer]" = _BaseGuard(drawers, interval=interval)
+        canvas = self.get_canvas()
+        guard.update(canvas)
+
+        while True:
+            writes = []
+            pending: "Set[Future[str]]" = set()
+            for drawer, x, y in guard._iter_repairs(canvas):
+                if len(pending) >= len(self.clients):
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                future = self.submit(x, y, drawer.target_pixel(x, y))
+                writes.append((x, y, future))
+                pending.add(future)
+            self._wait_for_writes(writes)
+
+            time.sleep(guard._fetch_delay(canvas))
+            canvas = self.get_canvas(max_age=guard.interval)
+            guard.update(canvas)
+
+    def draw(
+        self,
+        drawer: Union[AutoDrawer, MultiAutoDrawer],
+        guard: bool = False,
+        guard_delay: int = 5,
+    ):
+        """
+        Draw the image(s) of given auto drawer, with all of the tokens at once.
+
+        All of the mismatched pixels are added to the queue in the order the drawer
+        would draw them. With `guard`, the images are then kept on the canvas, see `_guard`,
+        re-fetching the canvas every `guard_delay` seconds initially, like with a `Guard`.
+        """
+        canvas = self.get_canvas()
+        self._wait_for_writes([
+            (x, y, self.submit(x, y, color))
+            for x, y, color in drawer.iter_mismatched_pixels(canvas)
+        ])
+
+        if guard:
+            self._guard(drawer.drawers if isinstance(drawer, MultiAutoDrawer) else [drawer], guard_delay)
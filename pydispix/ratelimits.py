@@ -1,15 +1,37 @@
+import asyncio
+import hashlib
 import logging
 import sys
+import threading
 import time
-from typing import Union
+from functools import partial
+from typing import Callable, Dict, Mapping, Optional, Tuple, TypeVar, Union
 
-from requests.models import CaseInsensitiveDict
+from pydispix.metrics import Instrumentation
+from pydispix.stores import MemoryRateLimitStore, RateLimitStore
 
 logger = logging.getLogger('pydispix')
 
+T = TypeVar("T")
+
 
 class RateLimitedEndpoint:
-    def __init__(self, endpoint: str, default_delay: int = 0):
+    """
+    Rate limits of a single endpoint.
+
+    The limits are stored as absolute deadlines (in `time.monotonic` time), computed from
+    the headers of the last response, this means we know how long to wait before the next
+    request, no matter how much time has passed since the last response, and we don't need
+    to ask the API about the limits before every request (with a HEAD request), unless the
+    limits are unknown (`needs_update`), i.e. we didn't make a request yet, or the limits
+    were breached, meaning that our local state doesn't reflect the real one.
+
+    We also keep track of the round trip time (RTT) of requests to this endpoint. The limits
+    start counting on the server, about half the RTT after we sent the request, and the next
+    request also takes about half the RTT to reach the server. So we wake up that much sooner,
+    in order for the request to arrive just as the limit resets, plus a small `safety_margin`.
+    """
+    def __init__(self, endpoint: str, default_delay: int = 0, safety_margin: float = 0.05):
         self.endpoint = endpoint
 
         self.requests_limit = None          # Total number of requests before reset time wait
@@ -20,7 +42,44 @@ class RateLimitedEndpoint:
         self.default_delay = default_delay  # If no other limit is found, how long should we wait
         self.anti_spam_delay = 0            # This is hit when multiple tokens are used
 
-    def update_from_headers(self, headers: CaseInsensitiveDict):
+        # Monotonic times at which the above delays end
+        self.reset_deadline = 0.0
+        self.cooldown_deadline = 0.0
+        self.anti_spam_deadline = 0.0
+
+        self.updated_at: Optional[float] = None  # Monotonic time of the last update from headers
+        self.stale = False                       # Set when the local state turned out to be wrong
+
+        self.rtt: Optional[float] = None     # Smoothed round trip time of the requests
+        self.safety_margin = safety_margin   # Extra time to wait, in case the latency varies
+
+    def record_rtt(self, rtt: float):
+        """Update the smoothed round trip time with a new measurement."""
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            self.rtt = 0.75 * self.rtt + 0.25 * rtt
+
+    def update_from_headers(
+        self,
+        headers: Mapping[str, str],
+        *,
+        sent_at: Optional[float] = None,
+        rtt: Optional[float] = None,
+    ):
+        """
+        Update the rate limits from response headers, given as a case-insensitive mapping (of `requests` or `httpx`).
+
+        `sent_at` is the monotonic time at which the request was sent, and `rtt` is it's round trip
+        time. If both are known, the server most likely started counting the limits half the RTT
+        after the request was sent, rather than now, when we're processing the response.
+        """
+        now = time.monotonic()
+        if rtt is not None:
+            self.record_rtt(rtt)
+            if sent_at is not None:
+                now = sent_at + rtt / 2
+
         # Static values for given endpoint
         if "requests-limit" in headers:
             self.requests_limit = int(headers["requests-limit"])
@@ -33,26 +92,119 @@ class RateLimitedEndpoint:
         self.cooldown_time = float(headers.get('cooldown-reset', 0))
         self.anti_spam_delay = float(headers.get('retry-after', 0))
 
+        self.reset_deadline = now + self.reset_time
+        self.cooldown_deadline = now + self.cooldown_time
+        self.anti_spam_deadline = now + self.anti_spam_delay
+        self.updated_at = now
+        self.stale = False
+
         logger.debug(
             f"Rates updated for {self.endpoint}: {self.remaining_requests=}, {self.reset_time=}, "
             f"{self.cooldown_time=}, {self.anti_spam_delay=}"
         )
 
+    @property
+    def needs_update(self) -> bool:
+        """Check whether we need to obtain the rate limits from the API, since we don't know them."""
+        return self.updated_at is None or self.stale
+
+    def dump_state(self) -> dict:
+        """
+        Get the state of the limits as a JSON serializable dict, for a `RateLimitStore`.
+
+        The deadlines are converted to wall-clock time, since the monotonic clock can't
+        be compared across processes. The RTT isn't included, it's specific to each client.
+        """
+        offset = time.time() - time.monotonic()
+        return {
+            "requests_limit": self.requests_limit,
+            "requests_period": self.requests_period,
+            "remaining_requests": self.remaining_requests,
+            "reset_time": self.reset_time,
+            "cooldown_time": self.cooldown_time,
+            "anti_spam_delay": self.anti_spam_delay,
+            "reset_deadline": self.reset_deadline + offset,
+            "cooldown_deadline": self.cooldown_deadline + offset,
+            "anti_spam_deadline": self.anti_spam_deadline + offset,
+            "updated_at": self.updated_at + offset if self.updated_at is not None else None,
+            "stale": self.stale,
+        }
+
+    def load_state(self, state: dict):
+        """Replace the state of the limits with one from `dump_state`."""
+        offset = time.time() - time.monotonic()
+        self.requests_limit = state["requests_limit"]
+        self.requests_period = state["requests_period"]
+        self.remaining_requests = state["remaining_requests"]
+        self.reset_time = state["reset_time"]
+        self.cooldown_time = state["cooldown_time"]
+        self.anti_spam_delay = state["anti_spam_delay"]
+        self.reset_deadline = state["reset_deadline"] - offset
+        self.cooldown_deadline = state["cooldown_deadline"] - offset
+        self.anti_spam_deadline = state["anti_spam_deadline"] - offset
+        self.updated_at = state["updated_at"] - offset if state["updated_at"] is not None else None
+        self.stale = state["stale"]
+
+    def reserve(self):
+        """
+        Count a request, which is about to be made, against the remaining requests.
+
+        The response will update the limits anyway, but until then, other clients sharing
+        these limits (through a `RateLimitStore`) need to know that the request was made.
+        """
+        now = time.monotonic()
+        if self.reset_deadline <= now and self.requests_limit is not None:
+            # The period is over (or none started yet), this request starts a new one
+            self.remaining_requests = self.requests_limit
+            if self.requests_period is not None:
+                self.reset_time = self.requests_period
+                self.reset_deadline = now + self.requests_period
+        self.remaining_requests = max(self.remaining_requests - 1, 0)
+
+    def _remaining_delays(self) -> Tuple[float, float, float]:
+        """Get the remaining anti-spam, cooldown and reset delays, at this moment, compensated for latency."""
+        # Our request should reach the server `safety_margin` seconds after the deadline,
+        # and it will take it about half the RTT to get there, so we can send it sooner
+        one_way_latency = self.rtt / 2 if self.rtt is not None else 0
+        arrival = time.monotonic() + one_way_latency - self.safety_margin
+
+        def remaining(delay: float, deadline: float) -> float:
+            # Delays which weren't set by the last response aren't active at all
+            if delay == 0:
+                return 0
+            return max(deadline - arrival, 0)
+
+        return (
+            remaining(self.anti_spam_delay, self.anti_spam_deadline),
+            remaining(self.cooldown_time, self.cooldown_deadline),
+            remaining(self.reset_time, self.reset_deadline),
+        )
+
+    @property
+    def is_limited(self) -> bool:
+        """Check whether any of the limits is currently active (ignoring the default delay)."""
+        anti_spam_delay, cooldown_time, reset_time = self._remaining_delays()
+        return anti_spam_delay != 0 or cooldown_time != 0 or (self.remaining_requests == 0 and reset_time != 0)
+
     def get_wait_time(self):
-        if self.anti_spam_delay != 0:
-            return self.anti_spam_delay
-        if self.cooldown_time != 0:
-            return self.cooldown_time
-        if self.remaining_requests == 0:
-            return self.reset_time
+        anti_spam_delay, cooldown_time, reset_time = self._remaining_delays()
+        if anti_spam_delay != 0:
+            return anti_spam_delay
+        if cooldown_time != 0:
+            return cooldown_time
+        if self.remaining_requests == 0 and reset_time != 0:
+            return reset_time
 
         return self.default_delay
 
-    def sleep(self, seconds: Union[int, float], *, show_progress: bool = False):
+    def sleep(self, seconds: Union[int, float], *, show_progress: bool = False, stop: Optional[threading.Event] = None) -> bool:
+        """Sleep for given number of seconds, return `False` if the sleep was interrupted by setting the `stop` event."""
+        if stop is None:
+            stop = threading.Event()
         # Progress bars shouldn't appear if we're waiting less than 5 seconds
         # it tends to be spammy and doesn't really provide much value
         if not show_progress or seconds < 5:
-            return time.sleep(seconds)
+            return not stop.wait(seconds)
 
         toolbar_width = 40
 
@@ -61,37 +213,206 @@ class RateLimitedEndpoint:
         sys.stdout.flush()
         sys.stdout.write("\b" * (toolbar_width + 1))  # return to start of line, after '['
 
-        for _ in range(toolbar_width):
-            time.sleep(seconds / toolbar_width)
+        # Sleep until the deadline of each step, rather than for a fraction of the time,
+        # so that the small delays between the individual sleeps don't add up
+        start = time.monotonic()
+        for step in range(1, toolbar_width + 1):
+            if stop.wait(max(start + seconds * step / toolbar_width - time.monotonic(), 0)):
+                sys.stdout.write("]\n")
+                return False
             sys.stdout.write("#")
             sys.stdout.flush()
         sys.stdout.write("]\n")  # this ends the progress bar
+        return True
 
-    def wait(self, *, show_progress: bool = False):
-        if self.anti_spam_delay != 0:
-            logger.warning(f"Sleeping for {self.anti_spam_delay}s, anti-spam cooldown triggered! ({self.endpoint})")
-            return self.sleep(self.anti_spam_delay, show_progress=show_progress)
-        if self.cooldown_time != 0:
-            logger.warning(f"Sleeping {self.cooldown_time}s, cooldown trigerred! ({self.endpoint})")
-            return self.sleep(self.cooldown_time, show_progress=show_progress)
-        if self.remaining_requests == 0:
-            logger.info(f"Sleeping {self.reset_time}s, on reset. ({self.endpoint})")
-            return self.sleep(self.reset_time, show_progress=show_progress)
+    def announce_wait(self) -> Union[int, float]:
+        """Log the reason we need to wait for and return the number of seconds to wait."""
+        anti_spam_delay, cooldown_time, reset_time = self._remaining_delays()
+        if anti_spam_delay != 0:
+            logger.warning(f"Sleeping for {anti_spam_delay:.2f}s, anti-spam cooldown triggered! ({self.endpoint})")
+            return anti_spam_delay
+        if cooldown_time != 0:
+            logger.warning(f"Sleeping {cooldown_time:.2f}s, cooldown trigerred! ({self.endpoint})")
+            return cooldown_time
+        if self.remaining_requests == 0 and reset_time != 0:
+            logger.info(f"Sleeping {reset_time:.2f}s, on reset. ({self.endpoint})")
+            return reset_time
 
         logger.debug(f"Sleeping default delay ({self.default_delay}), {self.remaining_requests} requests remaining. ({self.endpoint})")
-        return self.sleep(self.default_delay, show_progress=show_progress)
+        return self.default_delay
+
+    def wait(self, *, show_progress: bool = False):
+        return self.sleep(self.announce_wait(), show_progress=show_progress)
+
+
+class _BaseRateLimiter:
+    """
+    Rate limits of all endpoints, shared by the blocking and the asynchronous rate limiters.
 
+    `safety_margin` is used for all of the endpoints, see `RateLimitedEndpoint`.
 
-class RateLimiter:
-    def __init__(self):
-        self.rate_limits = {}
+    The limits are kept in a `store`, under keys derived from the `token` (the token itself
+    isn't stored), which can be shared by multiple clients using the same token, even from
+    different processes (with `SQLiteRateLimitStore`), so that they don't breach the limits
+    of each other. Every client reserves a request in the store before it makes it.
+    By default, every rate limiter has it's own `MemoryRateLimitStore`.
+
+    The time spent waiting is reported to the `instrumentation`, with `key_prefix` as the `token_id`.
+    """
+    def __init__(
+        self,
+        safety_margin: float = 0.05,
+        store: Optional[RateLimitStore] = None,
+        token: Optional[str] = None,
+        instrumentation: Optional[Instrumentation] = None,
+    ):
+        self.rate_limits: Dict[str, RateLimitedEndpoint] = {}
+        self.safety_margin = safety_margin
+        self.store = store if store is not None else MemoryRateLimitStore()
+        self.key_prefix = hashlib.sha256(token.encode()).hexdigest()[:16] if token is not None else ""
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+
+    def get_endpoint(self, endpoint: str) -> RateLimitedEndpoint:
+        if endpoint not in self.rate_limits:
+            self.rate_limits[endpoint] = RateLimitedEndpoint(endpoint, safety_margin=self.safety_margin)
+        return self.rate_limits[endpoint]
+
+    def _store_key(self, endpoint: str) -> str:
+        return f"{self.key_prefix}:{endpoint}"
+
+    def _load(self, endpoint: str) -> RateLimitedEndpoint:
+        """Update the limits of given endpoint from the store, this should be done while holding the store lock."""
+        limiter = self.get_endpoint(endpoint)
+        state = self.store.load(self._store_key(endpoint))
+        if state is not None:
+            limiter.load_state(state)
+        return limiter
+
+    def _save(self, endpoint: str):
+        self.store.save(self._store_key(endpoint), self.get_endpoint(endpoint).dump_state())
+
+    def update_from_headers(
+        self,
+        endpoint: str,
+        headers: Mapping[str, str],
+        *,
+        sent_at: Optional[float] = None,
+        rtt: Optional[float] = None,
+    ):
+        with self.store.lock(self._store_key(endpoint)):
+            limiter = self._load(endpoint)
+            # Other clients sharing the store could have reserved requests in the current period, which
+            # didn't reach the server yet, so the response can't give them back, or end that period
+            reserved = None
+            if limiter.reset_deadline > time.monotonic():
+                reserved = (limiter.remaining_requests, limiter.reset_time, limiter.reset_deadline)
+            limiter.update_from_headers(headers, sent_at=sent_at, rtt=rtt)
+            if reserved is not None:
+                remaining_requests, reset_time, reset_deadline = reserved
+                limiter.remaining_requests = min(limiter.remaining_requests, remaining_requests)
+                if reset_deadline > limiter.reset_deadline:
+                    limiter.reset_time, limiter.reset_deadline = reset_time, reset_deadline
+            self._save(endpoint)
+
+    def needs_update(self, endpoint: str) -> bool:
+        """Check whether the rate limits of given endpoint are unknown, and should be obtained with a HEAD request."""
+        with self.store.lock(self._store_key(endpoint)):
+            return self._load(endpoint).needs_update
+
+    def mark_stale(self, endpoint: str):
+        """Mark the local rate limits of given endpoint as no longer reliable (i.e. after a breach)."""
+        with self.store.lock(self._store_key(endpoint)):
+            self._load(endpoint).stale = True
+            self._save(endpoint)
+
+    def _acquire(self, endpoint: str) -> Tuple[bool, Union[int, float]]:
+        """
+        Reserve a request on given endpoint, if it isn't rate limited.
+
+        Return whether the request was reserved and how long to sleep, before making
+        it, or before trying to reserve it again, if it wasn't reserved.
+        """
+        with self.store.lock(self._store_key(endpoint)):
+            limiter = self._load(endpoint)
+            limited = limiter.is_limited
+            seconds = limiter.announce_wait()
+            if not limited:
+                limiter.reserve()
+                self._save(endpoint)
+        return not limited, seconds
+
+
+class RateLimiter(_BaseRateLimiter):
+    def wait(self, endpoint: str, show_progress: bool = False, stop: Optional[threading.Event] = None) -> bool:
+        """
+        Wait until a request can be made on given endpoint, and reserve it.
+        Return `False` if the wait was interrupted by setting the `stop` event.
+        """
+        # Another client sharing the store can take the request while we're sleeping, so check again
+        start = time.monotonic()
+        while True:
+            acquired, seconds = self._acquire(endpoint)
+            if not self.get_endpoint(endpoint).sleep(seconds, show_progress=show_progress, stop=stop):
+                return False
+            if acquired:
+                self.instrumentation.on_rate_limit_wait(self.key_prefix, endpoint, time.monotonic() - start)
+                return True
+
+
+class AsyncRateLimiter(_BaseRateLimiter):
+    """
+    Rate limiter for asyncio, which awaits the rate limits instead of blocking the thread.
+
+    Since multiple tasks can share a single client, this also holds a lock for every
+    endpoint, so that the tasks wait for the rate limits of that endpoint one by one.
+    """
+    def __init__(
+        self,
+        safety_margin: float = 0.05,
+        store: Optional[RateLimitStore] = None,
+        token: Optional[str] = None,
+        instrumentation: Optional[Instrumentation] = None,
+    ):
+        super().__init__(safety_margin, store, token, instrumentation)
+        self.locks: Dict[str, asyncio.Lock] = {}
+
+    def lock(self, endpoint: str) -> asyncio.Lock:
+        """Get the lock for given endpoint, which should be held while waiting and making the request."""
+        return self.locks.setdefault(endpoint, asyncio.Lock())
+
+    async def sleep(self, seconds: Union[int, float], *, show_progress: bool = False):
+        # Same progress bar as `RateLimitedEndpoint.sleep`, only awaiting instead of blocking
+        if not show_progress or seconds < 5:
+            return await asyncio.sleep(seconds)
+
+        toolbar_width = 40
+
+        sys.stdout.write(f"[{' ' * toolbar_width}]")
+        sys.stdout.flush()
+        sys.stdout.write("\b" * (toolbar_width + 1))
+
+        start = time.monotonic()
+        for step in range(1, toolbar_width + 1):
+            await asyncio.sleep(max(start + seconds * step / toolbar_width - time.monotonic(), 0))
+            sys.stdout.write("#")
+            sys.stdout.flush()
+        sys.stdout.write("]\n")
 
-    def update_from_headers(self, endpoint: str, headers: CaseInsensitiveDict):
-        self.rate_limits.setdefault(endpoint, RateLimitedEndpoint(endpoint))
-        limiter = self.rate_limits[endpoint]
-        limiter.update_from_headers(headers)
+    async def run_store(self, function: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Call given method accessing the store, in a separate thread if the store is `blocking`
+        (i.e. `SQLiteRateLimitStore` waiting for other processes), so it doesn't block the event loop.
+        """
+        if not self.store.blocking:
+            return function(*args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(None, partial(function, *args, **kwargs))
 
-    def wait(self, endpoint: str, show_progress: bool = False):
-        self.rate_limits.setdefault(endpoint, RateLimitedEndpoint(endpoint))
-        limiter = self.rate_limits[endpoint]
-        limiter.wait(show_progress=show_progress)
+    async def wait(self, endpoint: str, show_progress: bool = False):
+        # See `RateLimiter.wait`
+        start = time.monotonic()
+        while True:
+            acquired, seconds = await self.run_store(self._acquire, endpoint)
+            await self.sleep(seconds, show_progress=show_progress)
+            if acquired:
+                self.instrumentation.on_rate_limit_wait(self.key_prefix, endpoint, time.monotonic() - start)
+                return
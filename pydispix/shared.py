@@ -0,0 +1,306 @@
+"""
+Sharing a single downloaded canvas between processes on one host, through shared memory.
+
+A `CanvasPublisher` fetches the canvas and writes it into a shared memory segment, and the
+worker processes read it from there, with `SharedCanvasReader` or `SharedCanvasCache`, instead
+of each downloading (and keeping) their own copy. The publisher can also be started from the
+command line, using the token from the `TOKEN` environmental variable:
+`python -m pydispix.shared --name pydispix-canvas --interval 5`.
+"""
+import argparse
+import logging
+import multiprocessing
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+import PIL.Image
+import numpy as np
+
+from pydispix.canvas import Canvas, CanvasCache, Dimensions, Pixel, SizeType
+from pydispix.client import Client
+from pydispix.errors import CanvasFormatError
+
+try:
+    from multiprocessing import resource_tracker
+except ImportError:  # pragma: no cover - Windows doesn't have a resource tracker
+    resource_tracker = None
+
+logger = logging.getLogger("pydispix")
+
+# The segment starts with the version (number of published canvases) and the version which is
+# being written, followed by the width, height and the wall-clock publish time of both slots, and
+# then the canvas data of both slots. Canvases are published into the slot which isn't current
+# (`version % 2` is the current one), and the version is only increased once it's fully written.
+_VERSIONS = struct.Struct("<QQ")
+_SLOT = struct.Struct("<IId")
+_HEADER_SIZE = _VERSIONS.size + 2 * _SLOT.size
+
+# Names of the segments created by publishers in this process
+_published_names: Set[str] = set()
+
+
+def _untrack(memory: shared_memory.SharedMemory):
+    """
+    Stop the resource tracker from removing an attached segment once this process exits, since it's
+    owned by the publisher. Processes started by `multiprocessing` (and the publisher's own process)
+    share the tracker with the publisher, which removes the segment itself, so they're left alone.
+    """
+    if resource_tracker is None or memory.name in _published_names or multiprocessing.parent_process() is not None:
+        return
+    resource_tracker.unregister(memory._name, "shared_memory")  # type: ignore - private, but there's no other way
+
+
+class SharedCanvas(Canvas):
+    """
+    Read-only view of a canvas published to shared memory, no data is copied.
+
+    The view stays valid until the publisher starts writing into it's slot again, which happens
+    on the second publish after this one, `is_valid` can be used to check that (the drawers and guards
+    re-fetch the canvas once it isn't). Pixels modified locally (`canvas[x, y] = pixel`) are kept in a
+    small per-process `overlay` on top of the shared data, so the shared memory is neither changed,
+    nor copied into the process.
+    """
+
+    def __init__(self, size: Dimensions, data: memoryview, version: int, reader: "SharedCanvasReader"):
+        super().__init__(size, data)  # type: ignore - memoryview supports everything Canvas needs from bytes
+        self.version = version
+        self.reader = reader
+        # Locally modified pixels, by their index, as RGB triples
+        self.overlay: Dict[int, Tuple[int, int, int]] = {}
+
+    @property
+    def is_current(self) -> bool:
+        """Check whether this is the latest published canvas."""
+        return self.reader.version == self.version
+
+    @property
+    def is_valid(self) -> bool:
+        """Check whether the data of this view aren't being overwritten by a newer canvas."""
+        return self.reader.writing <= self.version + 1
+
+    def _pixel_at(self, index: int) -> Pixel:
+        triple = self.overlay.get(index)
+        if triple is not None:
+            return Pixel(*triple)
+        return super()._pixel_at(index)
+
+    def __setitem__(self, xy: SizeType, pixel: Union[Pixel, Tuple[int, int, int]]):
+        """Change a pixel by coordinates, it's only stored in the overlay of this process."""
+        index = self._index(xy)
+        self.overlay[index] = pixel.triple if isinstance(pixel, Pixel) else tuple(pixel)  # type: ignore - it's a triple
+        self._changed()
+
+    def _apply_overlay(self, array: np.ndarray, x0: int = 0, y0: int = 0) -> np.ndarray:
+        """Get a copy of given part of the shared data, starting at (`x0`, `y0`), with the overlay applied to it."""
+        array = array.copy()
+        height, width = array.shape[:2]
+        for index, triple in self.overlay.items():
+            y, x = divmod(index, self.width)
+            if x0 <= x < x0 + width and y0 <= y < y0 + height:
+                array[y - y0, x - x0] = triple
+        array.flags.writeable = False
+        return array
+
+    def as_array(self) -> np.ndarray:
+        """Get the canvas as an array, see `Canvas.as_array`, this copies the whole canvas if there are any local changes."""
+        array = super().as_array()
+        if not self.overlay:
+            return array
+        return self._apply_overlay(array)
+
+    def region(self, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+        """Get a part of the canvas, see `Canvas.region`, only this part is copied if there are any local changes."""
+        area = super().as_array()[y0:y1, x0:x1]
+        if not self.overlay:
+            return area
+        return self._apply_overlay(area, x0, y0)
+
+    @property
+    def image(self) -> PIL.Image.Image:
+        if self._image is None:
+            self._image = PIL.Image.fromarray(self.as_array())
+        return self._image
+
+
+class CanvasPublisher:
+    """
+    Fetch the canvas with given client, and publish it into a shared memory segment called `name`.
+
+    The segment is created for canvases of up to `capacity` pixels (by default the size of the
+    current canvas), and it's removed once the publisher is closed.
+    """
+
+    def __init__(self, client: Client, name: Optional[str] = None, capacity: Optional[int] = None):
+        self.client = client
+        if capacity is None:
+            size = client.get_dimensions()
+            capacity = size.width * size.height
+        self.capacity = capacity * 3
+        self.memory = shared_memory.SharedMemory(name, create=True, size=_HEADER_SIZE + 2 * self.capacity)
+        self.name = self.memory.name
+        _published_names.add(self.name)
+        self.version = 0
+        _VERSIONS.pack_into(self.memory.buf, 0, 0, 0)
+        self._stopped = threading.Event()
+
+    def __enter__(self) -> "CanvasPublisher":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def publish(self, canvas: Optional[Canvas] = None) -> int:
+        """Publish given canvas (fetching a new one by default), return the new version."""
+        if canvas is None:
+            canvas = self.client.get_canvas()
+        length = canvas.width * canvas.height * 3
+        if length > self.capacity:
+            raise CanvasFormatError(f"Canvas ({canvas.width}x{canvas.height}) doesn't fit into the shared memory segment.")
+
+        # Write into the slot which isn't current, readers are only pointed to it by the new version
+        version = self.version + 1
+        slot = version % 2
+        published_at = time.time() - canvas.age
+        offset = _HEADER_SIZE + slot * self.capacity
+        _VERSIONS.pack_into(self.memory.buf, 0, self.version, version)
+        self.memory.buf[offset:offset + length] = canvas.raw
+        _SLOT.pack_into(self.memory.buf, _VERSIONS.size + slot * _SLOT.size, canvas.width, canvas.height, published_at)
+        _VERSIONS.pack_into(self.memory.buf, 0, version, version)
+        self.version = version
+        return version
+
+    def run(self, interval: float = 5):
+        """Keep publishing a new canvas every `interval` seconds, until the publisher is closed."""
+        self._stopped.clear()
+        while True:
+            try:
+                self.publish()
+            except Exception:
+                logger.exception("Unable to publish the canvas.")
+            if self._stopped.wait(interval):
+                return
+
+    def start(self, interval: float = 5) -> threading.Thread:
+        """Start publishing in a background thread, see `run`."""
+        thread = threading.Thread(target=self.run, args=(interval,), daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        """Stop publishing and remove the shared memory segment."""
+        self._stopped.set()
+        self.memory.close()
+        self.memory.unlink()
+        _published_names.discard(self.name)
+
+
+class SharedCanvasReader:
+    """Read the canvases published by a `CanvasPublisher` into the shared memory segment called `name`."""
+
+    def __init__(self, name: str):
+        self.memory = shared_memory.SharedMemory(name)
+        self.capacity = (self.memory.size - _HEADER_SIZE) // 2
+        _untrack(self.memory)
+
+    def __enter__(self) -> "SharedCanvasReader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def version(self) -> int:
+        """Version of the latest published canvas, 0 if nothing was published yet."""
+        return _VERSIONS.unpack_from(self.memory.buf, 0)[0]
+
+    @property
+    def writing(self) -> int:
+        """Version of the canvas which is being published, or was published last."""
+        return _VERSIONS.unpack_from(self.memory.buf, 0)[1]
+
+    def get_canvas(self) -> Optional[SharedCanvas]:
+        """Get a view of the latest published canvas, or `None` if nothing was published yet."""
+        while True:
+            version = self.version
+            if version == 0:
+                return None
+            slot = version % 2
+            width, height, published_at = _SLOT.unpack_from(self.memory.buf, _VERSIONS.size + slot * _SLOT.size)
+            # Make sure the slot didn't start being re-written while we were reading it's size
+            if self.writing <= version + 1:
+                break
+
+        offset = _HEADER_SIZE + slot * self.capacity
+        data = self.memory.buf[offset:offset + width * height * 3].toreadonly()
+        canvas = SharedCanvas(Dimensions(width=width, height=height), data, version, self)
+        canvas.timestamp = time.monotonic() - (time.time() - published_at)
+        return canvas
+
+    def wait_for_canvas(self, newer_than: int = 0, timeout: Optional[float] = None, poll_interval: float = 0.1) -> Optional[SharedCanvas]:
+        """Wait until a canvas newer than version `newer_than` is published, return `None` on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.version <= newer_than:
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+        return self.get_canvas()
+
+    def close(self):
+        """Detach from the shared memory, this fails if any of the views are still in use."""
+        self.memory.close()
+
+
+class SharedCanvasCache(CanvasCache):
+    """
+    Canvas cache for clients in worker processes, using the canvas published to shared memory.
+
+    While the published canvas is younger than `max_age` seconds, `get_canvas` of the clients
+    returns a view of it, without downloading anything. Otherwise (i.e. if the publisher isn't
+    running), the clients fetch the canvas themselves, and it's cached locally, like with `CanvasCache`.
+    """
+
+    def __init__(self, name: str, max_age: float = 10):
+        super().__init__(max_age)
+        self.reader = SharedCanvasReader(name)
+        self._shared: Optional[SharedCanvas] = None
+
+    def peek(self, max_age: Optional[float] = None) -> Optional[Canvas]:
+        # Re-use the view of the same version, so that the drawers' local changes to it are kept
+        if self._shared is None or not self._shared.is_current:
+            self._shared = self.reader.get_canvas()
+        shared = self._shared
+        if shared is not None and shared.age <= (self.max_age if max_age is None else max_age):
+            return shared
+        return super().peek(max_age)
+
+    def set_pixel(self, x: int, y: int, pixel):
+        super().set_pixel(x, y, pixel)
+        if self._shared is not None:
+            self._shared[x, y] = pixel
+
+    def invalidate(self):
+        super().invalidate()
+        self._shared = None
+
+
+def main(argv: Optional[List[str]] = None):
+    """Run a canvas publisher, using the token from the `TOKEN` environmental variable."""
+    parser = argparse.ArgumentParser(description="Publish the pixels canvas into shared memory, for worker processes.")
+    parser.add_argument("--name", default="pydispix-canvas", help="Name of the shared memory segment")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between the canvas fetches")
+    parser.add_argument("--base-url", default="https://pixels.pythondiscord.com/")
+    args = parser.parse_args(argv)
+
+    with CanvasPublisher(Client(base_url=args.base_url), args.name) as publisher:
+        logger.info(f"Publishing the canvas to shared memory segment {publisher.name!r} every {args.interval}s")
+        try:
+            publisher.run(args.interval)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Storages for the rate limit state, which allow sharing it between clients or processes."""
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+
+class RateLimitStore(ABC):
+    """
+    Storage of the rate limit state of endpoints, under a key unique to the token and the endpoint.
+
+    Clients using the same store (and the same token) see each others rate limits, and
+    wait for each other. The state is stored as a JSON serializable dict, with deadlines
+    in wall-clock time, so that it can be shared across processes.
+
+    `blocking` tells whether accessing the store can block for a while (i.e. waiting for other
+    processes), the asynchronous clients then access it from a separate thread.
+    """
+
+    blocking = True
+
+    @abstractmethod
+    @contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        """Lock the state under given key, while it's being loaded, modified and saved again."""
+        yield
+
+    @abstractmethod
+    def load(self, key: str) -> Optional[dict]:
+        """Load the state under given key, or return `None` if there isn't any."""
+
+    @abstractmethod
+    def save(self, key: str, state: dict) -> None:
+        """Save the state under given key."""
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """
+    Store the rate limits in memory, this is the default store.
+
+    A single instance can be shared between multiple clients (or threads) in one process.
+    """
+
+    # The lock is only ever held for a moment
+    blocking = False
+
+    def __init__(self):
+        self.states: Dict[str, dict] = {}
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        with self._lock:
+            yield
+
+    def load(self, key: str) -> Optional[dict]:
+        return self.states.get(key)
+
+    def save(self, key: str, state: dict) -> None:
+        self.states[key] = state
+
+
+class SQLiteRateLimitStore(RateLimitStore):
+    """
+    Store the rate limits in an SQLite database file.
+
+    All processes on the host using the same file share the rate limits, so for example
+    a drawer, a guard and a church worker, all using the same token, can be ran at once,
+    without constantly breaching each others rate limits.
+    """
+
+    def __init__(self, path: str, timeout: float = 10):
+        # Transactions are handled manually, with `BEGIN IMMEDIATE` to lock the database
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, state TEXT NOT NULL)")
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        # The whole database is locked, SQLite doesn't support locking individual rows
+        with self._lock:
+            if self._depth == 0:
+                self.connection.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.connection.execute("COMMIT")
+
+    def load(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self.connection.execute("SELECT state FROM rate_limits WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def save(self, key: str, state: dict) -> None:
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO rate_limits (key, state) VALUES (?, ?)",
+                (key, json.dumps(state))
+            )
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,18 @@
+import pytest
+
+from pydispix.emulator import EndpointLimits, PixelsEmulator
+
+# Much shorter than the real limits, so that the tests hit them without waiting for minutes
+FAST_LIMITS = {
+    "get_size": EndpointLimits(5, 1),
+    "get_pixels": EndpointLimits(5, 1, cooldown=2),
+    "get_pixel": EndpointLimits(5, 1, cooldown=2),
+    "set_pixel": EndpointLimits(2, 1, cooldown=2, anti_spam=3),
+}
+
+
+@pytest.fixture
+def emulator():
+    """Emulated pixels API with a small canvas and the fast rate limits."""
+    with PixelsEmulator(8, 6, limits=FAST_LIMITS) as emulator:
+        yield emulator
@@ -0,0 +1,88 @@
+import time
+
+import PIL.Image
+import pytest
+
+from pydispix.autodraw import AutoDrawer
+from pydispix.client import Client
+from pydispix.guard import Guard
+
+
+@pytest.fixture
+def client(emulator):
+    with Client("token", emulator.url) as client:
+        yield client
+
+
+def load_drawer(client: Client, emulator, x: int, y: int, color: str) -> AutoDrawer:
+    """Drawer of a 3x2 image, which is already drawn on the emulated canvas."""
+    drawer = AutoDrawer.load_image(client, (x, y), PIL.Image.new("RGB", (3, 2), "#" + color))
+    for dx in range(3):
+        for dy in range(2):
+            emulator.set_pixel(x + dx, y + dy, color)
+    return drawer
+
+
+def fetch(emulator):
+    # Make sure every fetched canvas has a different timestamp
+    time.sleep(0.01)
+    return emulator.get_canvas()
+
+
+def test_attack_counting(client, emulator):
+    drawer = load_drawer(client, emulator, 1, 1, "ff0000")
+    guard = Guard(client, [drawer], interval=5)
+    guard.update(fetch(emulator))
+    assert guard.queue == []
+    assert guard.tamper_rate is None
+
+    # Pixels outside of the image aren't attacks
+    emulator.set_pixel(1, 1, "000000")
+    emulator.set_pixel(3, 2, "000000")
+    emulator.set_pixel(6, 5, "000000")
+    guard.update(fetch(emulator))
+    assert sorted(guard.queue) == [(0, 1, 1), (0, 3, 2)]
+    assert guard.heat[0].sum() == 2
+    assert guard.tamper_rate > 0
+
+    # Damaged pixels which are still damaged aren't attacked again
+    guard.update(fetch(emulator))
+    assert guard.heat[0].sum() == pytest.approx(2, abs=0.01)
+    assert len(guard.queue) == 2
+
+    # A repaired pixel, which is wrong again on the next canvas, was attacked again
+    assert guard.pop() is not None
+    repaired = guard.queue[0]
+    assert guard.pop() is not None
+    emulator.set_pixel(repaired[1], repaired[2], "ff0000")
+    guard.update(fetch(emulator))
+    assert guard.heat[0].sum() == pytest.approx(3, abs=0.01)
+    assert len(guard.queue) == 1
+
+
+def test_cached_canvas_is_ignored(client, emulator):
+    drawer = load_drawer(client, emulator, 0, 0, "00ff00")
+    guard = Guard(client, [drawer], interval=2, max_interval=60)
+    canvas = fetch(emulator)
+    guard.update(canvas)
+    guard.update(canvas)
+    guard.update(canvas)
+    assert guard.interval == 2
+
+    # A new canvas without any attacks makes the guard re-fetch less often
+    guard.update(fetch(emulator))
+    assert guard.interval == 4
+
+
+def test_priorities(client, emulator):
+    low = load_drawer(client, emulator, 0, 0, "ff0000")
+    high = load_drawer(client, emulator, 4, 3, "0000ff")
+    guard = Guard(client, [low, high], priorities=[1, 10], interval=5)
+    guard.update(fetch(emulator))
+
+    emulator.set_pixel(0, 0, "ffffff")
+    emulator.set_pixel(4, 3, "ffffff")
+    guard.update(fetch(emulator))
+    assert guard.pop() == (high, 4, 3)
+    assert guard.pop() == (low, 0, 0)
+    assert guard.pop() is None
@@ -0,0 +1,75 @@
+import numpy as np
+
+from pydispix.canvas import Canvas
+from pydispix.history import CanvasHistory, CanvasRecorder
+
+
+def make_canvases(count: int, width: int = 8, height: int = 6):
+    """Canvases changing a few pixels at a time, every third one doesn't change at all."""
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    canvases = []
+    for index in range(count):
+        data = data.copy()
+        if index % 3 != 2:
+            data[rng.integers(0, height, 3), rng.integers(0, width, 3)] = rng.integers(0, 256, (3, 3), dtype=np.uint8)
+        canvases.append(Canvas((width, height), data.tobytes()))
+    return canvases
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "canvas.history")
+    canvases = make_canvases(10)
+    with CanvasRecorder(path, keyframe_interval=4) as recorder:
+        diffs = [recorder.record(canvas) for canvas in canvases]
+
+    # Unchanged canvases are stored as empty deltas, not skipped
+    assert diffs[0] is None
+    assert len(diffs[2]) == 0
+
+    with CanvasHistory(path) as history:
+        assert len(history) == 10
+        assert history.keyframes == [0, 5]
+        for index, canvas in enumerate(canvases):
+            assert history[index].raw == canvas.raw
+        assert [recorded.raw for recorded in history] == [canvas.raw for canvas in canvases]
+
+        changes = [len(diff) for _, diff in history.iter_diffs()]
+        assert changes == [len(canvases[index - 1].diff(canvases[index])) for index in range(1, 10)]
+
+
+def test_resume(tmp_path):
+    path = str(tmp_path / "canvas.history")
+    canvases = make_canvases(8)
+    with CanvasRecorder(path, keyframe_interval=4) as recorder:
+        for canvas in canvases[:3]:
+            recorder.record(canvas)
+
+    # A record which wasn't written completely is dropped, and the recording continues from the last full one
+    with open(path, "ab") as file:
+        file.write(b"\x01partial")
+    with CanvasRecorder(path, keyframe_interval=4) as recorder:
+        assert recorder.canvas.raw == canvases[2].raw
+        # The count of deltas since the last keyframe continues too
+        keyframes = [recorder.record(canvas) is None for canvas in canvases[3:]]
+    assert keyframes == [False, False, True, False, False]
+
+    with CanvasHistory(path) as history:
+        assert len(history) == 8
+        assert history.keyframes == [0, 5]
+        assert [recorded.raw for recorded in history] == [canvas.raw for canvas in canvases]
+
+
+def test_follow_while_recording(tmp_path):
+    path = str(tmp_path / "canvas.history")
+    canvases = make_canvases(4)
+    with CanvasRecorder(path) as recorder, CanvasHistory(path) as history:
+        recorder.record(canvases[0])
+        history.refresh()
+        assert len(history) == 1
+
+        for canvas in canvases[1:]:
+            recorder.record(canvas)
+        history.refresh()
+        assert len(history) == 4
+        assert history[-1].raw == canvases[-1].raw
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from pydispix.partitioners import HilbertPartitioner, ModuloPartitioner, RowBandPartitioner, TilePartitioner
+
+SHAPES = [(80, 60), (60, 80), (17, 5), (1, 30), (7, 7)]
+
+
+def assign(partitioner, width: int, height: int, total_tasks: int, x0: int = 3, y0: int = 2) -> np.ndarray:
+    ys, xs = np.mgrid[y0:y0 + height, x0:x0 + width]
+    return partitioner.assign(xs, ys, (x0, y0, x0 + width, y0 + height), 100, total_tasks)
+
+
+@pytest.mark.parametrize("partitioner", [ModuloPartitioner(), RowBandPartitioner(), TilePartitioner(), HilbertPartitioner()])
+@pytest.mark.parametrize("width, height", SHAPES)
+@pytest.mark.parametrize("total_tasks", [1, 2, 3, 5, 7])
+def test_coverage(partitioner, width, height, total_tasks):
+    tasks = assign(partitioner, width, height, total_tasks)
+    assert tasks.shape == (height, width)
+    assert tasks.min() >= 0
+    assert tasks.max() < total_tasks
+    # Every task gets some pixels, as long as there are enough rows for the row bands, and the
+    # image is wider than a column (interleaving follows the canvas rows, not the image ones)
+    if isinstance(partitioner, RowBandPartitioner) and height < total_tasks:
+        return
+    if isinstance(partitioner, ModuloPartitioner) and width == 1:
+        return
+    assert len(np.unique(tasks)) == total_tasks
+
+
+@pytest.mark.parametrize("partitioner, tolerance", [
+    (ModuloPartitioner(), lambda width, height: 1),
+    (HilbertPartitioner(), lambda width, height: 1),
+    (RowBandPartitioner(), lambda width, height: width),
+    (TilePartitioner(), lambda width, height: width + height),
+])
+@pytest.mark.parametrize("width, height", [(80, 60), (60, 80), (40, 40)])
+@pytest.mark.parametrize("total_tasks", [2, 3, 5, 7])
+def test_balance(partitioner, tolerance, width, height, total_tasks):
+    counts = np.bincount(assign(partitioner, width, height, total_tasks).ravel(), minlength=total_tasks)
+    assert counts.max() - counts.min() <= tolerance(width, height)
+
+
+def test_tiles_are_compact():
+    tasks = assign(TilePartitioner(), 80, 60, 4)
+    for task in range(4):
+        ys, xs = np.nonzero(tasks == task)
+        # Every tile is a full rectangle
+        assert (xs.max() - xs.min() + 1) * (ys.max() - ys.min() + 1) == len(xs)
+
+
+@pytest.mark.parametrize("partitioner", [RowBandPartitioner([1, 3]), HilbertPartitioner([1, 3])])
+def test_weights(partitioner):
+    counts = np.bincount(assign(partitioner, 40, 40, 2).ravel(), minlength=2)
+    assert counts[1] / counts.sum() == pytest.approx(0.75, abs=0.03)
+
+
+def test_weights_must_match_tasks():
+    with pytest.raises(ValueError):
+        assign(RowBandPartitioner([1, 2]), 10, 10, 3)
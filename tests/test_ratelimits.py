@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from pydispix.client import Client
+from pydispix.pool import TokenPool
+from pydispix.ratelimits import RateLimitedEndpoint
+
+
+def breaches(emulator) -> int:
+    return sum(count for (_, status), count in emulator.stats.items() if status == 429)
+
+
+def drawn(emulator, rgb: str) -> int:
+    canvas = emulator.get_canvas()
+    return int((canvas.as_array() == tuple(bytes.fromhex(rgb))).all(axis=2).sum())
+
+
+def test_wait_time_follows_headers():
+    endpoint = RateLimitedEndpoint("set_pixel", safety_margin=0)
+    endpoint.update_from_headers({"requests-limit": "2", "requests-period": "10", "requests-remaining": "1", "requests-reset": "4"})
+    assert endpoint.get_wait_time() == 0
+    assert not endpoint.is_limited
+
+    endpoint.reserve()
+    assert endpoint.remaining_requests == 0
+    assert endpoint.get_wait_time() == pytest.approx(4, abs=0.1)
+
+    endpoint.update_from_headers({"requests-remaining": "0", "requests-reset": "4", "cooldown-reset": "8", "retry-after": "12"})
+    assert endpoint.get_wait_time() == pytest.approx(12, abs=0.1)
+
+
+def test_state_round_trip():
+    endpoint = RateLimitedEndpoint("set_pixel")
+    endpoint.update_from_headers({"requests-limit": "2", "requests-period": "10", "requests-remaining": "0", "requests-reset": "4"})
+    other = RateLimitedEndpoint("set_pixel")
+    other.load_state(endpoint.dump_state())
+    assert other.remaining_requests == 0
+    assert other.reset_deadline == pytest.approx(endpoint.reset_deadline, abs=0.01)
+    assert not other.needs_update
+
+
+def test_client_never_breaches(emulator):
+    with Client("token", emulator.url) as client:
+        for x in range(5):
+            client.put_pixel(x, 0, "ff0000")
+    assert breaches(emulator) == 0
+    assert drawn(emulator, "ff0000") == 5
+
+
+def test_pool_never_breaches(emulator):
+    with TokenPool(["first", "second"], emulator.url) as pool:
+        futures = [pool.submit(x, y, "00ff00") for x in range(4) for y in range(2)]
+        for future in futures:
+            future.result(timeout=30)
+
+    assert breaches(emulator) == 0
+    assert drawn(emulator, "00ff00") == 8
+
+
+def test_async_client_never_breaches(emulator):
+    pytest.importorskip("httpx")
+    from pydispix.aio.client import AsyncClient
+
+    async def draw():
+        client = AsyncClient("token", emulator.url)
+        try:
+            await asyncio.gather(*(client.put_pixel(x, 1, "0000ff") for x in range(5)))
+            await asyncio.gather(*(client.get_canvas() for _ in range(5)))
+        finally:
+            await client.close()
+
+    asyncio.run(draw())
+    assert breaches(emulator) == 0
+    assert drawn(emulator, "0000ff") == 5
+    assert emulator.stats["get_size", 200] == 1
@@ -0,0 +1,46 @@
+import multiprocessing
+
+from pydispix.client import Client
+from pydispix.stores import SQLiteRateLimitStore
+
+
+def draw_column(url: str, path: str, x: int, color: str):
+    """Draw a column of pixels with a token shared with the other process, through the store at `path`."""
+    store = SQLiteRateLimitStore(path)
+    try:
+        with Client("shared", url, rate_limit_store=store) as client:
+            for y in range(3):
+                client.put_pixel(x, y, color)
+    finally:
+        store.close()
+
+
+def test_state_is_persisted(tmp_path):
+    path = str(tmp_path / "limits.db")
+    store = SQLiteRateLimitStore(path)
+    with store.lock("key"):
+        assert store.load("key") is None
+        store.save("key", {"remaining_requests": 1})
+    store.close()
+
+    store = SQLiteRateLimitStore(path)
+    assert store.load("key") == {"remaining_requests": 1}
+    store.close()
+
+
+def test_shared_between_processes(tmp_path, emulator):
+    path = str(tmp_path / "limits.db")
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=draw_column, args=(emulator.url, path, x, color))
+        for x, color in ((0, "ff0000"), (1, "0000ff"))
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    assert sum(count for (_, status), count in emulator.stats.items() if status == 429) == 0
+    canvas = emulator.get_canvas()
+    assert [canvas[x, y].triple for y in range(3) for x in range(2)] == [(255, 0, 0), (0, 0, 255)] * 3